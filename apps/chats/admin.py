@@ -5,7 +5,7 @@ from apps.chats.models import Message, Dialog
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ('id', 'sender', 'dialog', 'text', 'is_read', 'created',)
+    list_display = ('id', 'sender', 'dialog', 'text', 'created',)
 
 
 @admin.register(Dialog)
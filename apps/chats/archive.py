@@ -0,0 +1,127 @@
+"""Cold storage of old messages.
+
+Archived messages leave Postgres for append-only segment files. A segment is a concatenation of gzip
+members, one per dialog, with the messages of the dialog as JSON lines. `MessageArchiveEntry` indexes
+where the messages of a dialog are, so reading them back is a single ranged read of a segment.
+"""
+import gzip
+import json
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.core.files.base import File
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from apps.chats.models import Message, MessageArchiveEntry
+
+SEGMENT_SPOOL_SIZE = 16 * 1024 * 1024
+
+
+def get_archive_storage():
+    return import_string(settings.CHAT_ARCHIVE_STORAGE)(location=settings.CHAT_ARCHIVE_LOCATION)
+
+
+def encode_message(message) -> bytes:
+    return json.dumps({
+        'id': message.pk,
+        'sender_id': message.sender_id,
+        'text': message.text,
+        'created': message.created.isoformat(),
+        'modified': message.modified.isoformat(),
+    }).encode('utf-8')
+
+
+def decode_messages(dialog_id: int, data: bytes) -> list:
+    messages = []
+    for line in gzip.decompress(data).decode('utf-8').splitlines():
+        fields = json.loads(line)
+        messages.append(Message(
+            id=fields['id'],
+            dialog_id=dialog_id,
+            sender_id=fields['sender_id'],
+            text=fields['text'],
+            created=parse_datetime(fields['created']),
+            modified=parse_datetime(fields['modified']),
+        ))
+    return messages
+
+
+def write_segment(chunks, storage=None) -> list:
+    """Writes `(dialog_id, messages)` chunks to a new segment, returns the unsaved index entries.
+
+    The messages are streamed into the gzip member of their dialog, the segment is spilled to disk past
+    `SEGMENT_SPOOL_SIZE` bytes, so the memory doesn't grow with the dialogs.
+    """
+    storage = storage or get_archive_storage()
+    entries = []
+    with tempfile.SpooledTemporaryFile(max_size=SEGMENT_SPOOL_SIZE) as segment:
+        for dialog_id, messages in chunks:
+            entry = MessageArchiveEntry(dialog_id=dialog_id, offset=segment.tell(), count=0)
+            with gzip.GzipFile(filename='', mode='wb', fileobj=segment) as member:
+                for message in messages:
+                    if entry.count:
+                        member.write(b'\n')
+                    else:
+                        entry.first_message_id, entry.first_created = message.pk, message.created
+                    member.write(encode_message(message))
+                    entry.last_message_id, entry.last_created = message.pk, message.created
+                    entry.count += 1
+            entry.length = segment.tell() - entry.offset
+            entries.append(entry)
+        segment.seek(0)
+        name = storage.save(f"messages/{timezone.now():%Y/%m/%d}/{uuid.uuid4().hex}.seg", File(segment))
+    for entry in entries:
+        entry.segment = name
+    return entries
+
+
+def read_entry(entry: MessageArchiveEntry, storage=None) -> list:
+    """Archived messages of the entry in the chronological order"""
+    storage = storage or get_archive_storage()
+    with storage.open(entry.segment, 'rb') as segment:
+        segment.seek(entry.offset)
+        return decode_messages(entry.dialog_id, segment.read(entry.length))
+
+
+class DialogArchive:
+    """Reads the archived history of a dialog, `MessageCursorPagination` falls through to it past the hot data"""
+
+    def __init__(self, dialog):
+        self.dialog = dialog
+        self.storage = get_archive_storage()
+
+    def before(self, cursor, limit: int) -> list:
+        """Up to `limit` archived messages older than the `(created, id)` cursor, the newest first"""
+        if self.dialog.archived_until is None:
+            return []
+        entries = self.dialog.archive_entries.order_by('-last_created', '-last_message_id')
+        if cursor is not None:
+            created, pk = cursor
+            entries = entries.filter(Q(first_created__lt=created) | Q(first_created=created, first_message_id__lt=pk))
+        messages = []
+        for entry in entries:
+            messages.extend(m for m in reversed(read_entry(entry, self.storage))
+                            if cursor is None or (m.created, m.pk) < cursor)
+            if len(messages) >= limit:
+                break
+        return messages[:limit]
+
+    def after(self, cursor, limit: int) -> list:
+        """Up to `limit` archived messages newer than the `(created, id)` cursor, the oldest first"""
+        created, pk = cursor
+        if self.dialog.archived_until is None or created > self.dialog.archived_until:
+            return []
+        entries = (self.dialog.archive_entries
+                   .filter(Q(last_created__gt=created) | Q(last_created=created, last_message_id__gt=pk))
+                   .order_by('first_created', 'first_message_id')
+                   )
+        messages = []
+        for entry in entries:
+            messages.extend(m for m in read_entry(entry, self.storage) if (m.created, m.pk) > cursor)
+            if len(messages) >= limit:
+                break
+        return messages[:limit]
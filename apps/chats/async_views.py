@@ -0,0 +1,148 @@
+"""Async versions of the chat hot paths.
+
+The ORM is synchronous, so every query runs in a worker thread. Queries which don't depend
+on each other are started together and the event loop stays free while they run, so a slow
+client no longer holds a whole worker. Authentication, filtering, pagination and serializers
+are the same ones `DialogViewSet` uses.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage, Page
+from django.db import close_old_connections
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from apps.users.cache import get_profiles
+from apps.utils import FastJSONParser
+from . import serializers
+from .archive import DialogArchive
+from .cache import get_inbox_page, get_inbox_page_key, set_inbox_page
+from .filters import DialogFilteringBackend
+from .models import Dialog, DialogReadState
+from .pagination import MessageCursorPagination
+from .views import DialogPagination
+
+
+def run(func, *args, **kwargs):
+    """Runs a blocking call in its own thread, so several calls can run at the same time"""
+    def call():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()  # the worker threads are reused, CONN_MAX_AGE decides on the connection
+    return sync_to_async(call, thread_sensitive=False)()
+
+
+def render(data, status_code=status.HTTP_200_OK) -> HttpResponse:
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+    return HttpResponse(
+        renderer.render(data),
+        status=status_code,
+        content_type=f'{renderer.media_type}; charset={renderer.charset}',
+    )
+
+
+def async_api_view(view):
+    """Authenticates the request with the DRF authentication classes and renders API errors"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request = Request(
+            request,
+            parsers=[FastJSONParser()],
+            authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+        )
+        try:
+            user = await run(lambda: request.user)
+            if not user or not user.is_authenticated:
+                return render({'detail': 'Authentication credentials were not provided.'},
+                              status.HTTP_401_UNAUTHORIZED)
+            return await view(request, *args, **kwargs)
+        except APIException as e:
+            return render({'detail': e.detail}, e.status_code)
+
+    wrapper.csrf_exempt = True  # `csrf_exempt` can't wrap coroutines on Django 3.1
+    return wrapper
+
+
+@async_api_view
+async def dialog_list(request):
+    user = request.user
+    key = await run(get_inbox_page_key, user.pk, request.get_full_path())
+    data = await run(get_inbox_page, key)
+    if data is not None:
+        return render(data)
+
+    queryset = DialogFilteringBackend().filter_queryset(request, Dialog.objects.for_user(user), None)
+    paginator = DialogPagination()
+    django_paginator = paginator.django_paginator_class(queryset, paginator.page_size)
+    page_number = request.query_params.get(paginator.page_query_param, 1)
+    if page_number in paginator.last_page_strings:
+        django_paginator.count = await run(queryset.count)
+        page_number = django_paginator.num_pages
+    try:
+        # the lower bound is checked before slicing, the upper one needs the count
+        number = int(page_number)
+        if number < 1:
+            raise InvalidPage
+    except (ValueError, InvalidPage):
+        return render({'detail': 'Invalid page.'}, status.HTTP_404_NOT_FOUND)
+    offset = (number - 1) * paginator.page_size
+
+    page = run(lambda: list(queryset[offset:offset + paginator.page_size]))
+    if 'count' in vars(django_paginator):
+        dialogs = await page
+    else:
+        # the count and the page don't depend on each other
+        django_paginator.count, dialogs = await asyncio.gather(run(queryset.count), page)
+    try:
+        django_paginator.validate_number(number)
+    except InvalidPage:
+        return render({'detail': 'Invalid page.'}, status.HTTP_404_NOT_FOUND)
+    paginator.request = request
+    paginator.page = Page(dialogs, number, django_paginator)
+
+    participants = await run(get_profiles, (pk for dialog in dialogs for pk in dialog.users))
+    context = {'request': request, 'participants': participants}
+    data = paginator.get_paginated_response(serializers.DialogSerializer(dialogs, many=True, context=context).data).data
+    await run(set_inbox_page, key, data)
+    return render(data)
+
+
+@async_api_view
+async def dialog_messages(request, pk):
+    user = request.user
+    dialog = await run(lambda: Dialog.objects.filter(pk=pk, users__contains=[user.pk]).first())
+    if dialog is None:
+        return render({'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND)
+
+    if request.method == 'POST':
+        serializer = serializers.SendMessageSerializer(data=request.data)
+        if not serializer.is_valid():
+            return render(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        message = await run(dialog.send_message, sender=user, text=serializer.validated_data['text'])
+        context = {'read_positions': {dialog.pk: {}}}  # a new message is unread
+        return render(serializers.MessageSerializer(message, context=context).data)
+    if request.method != 'GET':
+        return render({'detail': f'Method "{request.method}" not allowed.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    paginator = MessageCursorPagination()
+    if dialog.archived_until is not None:
+        paginator.archive = DialogArchive(dialog)
+    messages, positions, users = await asyncio.gather(
+        run(paginator.paginate_queryset, dialog.history(), request),
+        run(DialogReadState.objects.positions, dialog.pk),
+        run(get_profiles, dialog.users),
+    )
+    if messages:
+        # the read is written by the next flush of the read buffer, the response already shows it
+        await run(DialogReadState.objects.buffer_read, dialog, user.pk, messages[-1].pk)
+        DialogReadState.advance(positions[dialog.pk], user.pk, messages[-1].pk)
+    serializer = serializers.MessageSerializer(messages, many=True, context={'read_positions': positions})
+    data = paginator.get_paginated_response(serializer.data).data
+    data['users'] = users
+    return render(data)
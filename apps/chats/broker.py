@@ -0,0 +1,158 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BaseBroker:
+    """Fans out realtime events to the websocket connections of dialog participants.
+
+    Every connection of the process gets its own queue, so a node listens to a channel once however
+    many sockets of the user are open.
+    """
+    errors = (OSError,)  # publishing is retried on them
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel: str, event: dict) -> None:
+        raise NotImplementedError
+
+    def listen(self, channels):
+        """Starts receiving the channels the process has no subscribers of, returns a future or None"""
+
+    def unlisten(self, channels) -> None:
+        """Stops receiving the channels the last subscriber of the process has left"""
+
+    def dispatch(self, channel: str, event: dict) -> None:
+        """Puts the event into the queues of the channel subscribers, it is safe to call from any thread"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    async def subscribe(self, channels):
+        """Returns an async iterator of the events published to the channels"""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        # listening is started and stopped under the lock, so the two can't be reordered
+        with self._lock:
+            new = [channel for channel in channels if not self._subscribers.get(channel)]
+            for channel in channels:
+                self._subscribers[channel].add(subscriber)
+            listening = self.listen(new) if new else None
+        try:
+            if listening is not None:
+                await asyncio.wrap_future(listening)
+            while True:
+                yield await subscriber[1].get()
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers[channel].discard(subscriber)
+                left = [channel for channel in channels if not self._subscribers[channel]]
+                for channel in left:
+                    del self._subscribers[channel]
+                if left:
+                    self.unlisten(left)
+
+
+class InMemoryBroker(BaseBroker):
+    """Delivers events inside the current process only, it is used by tests and single-node setups"""
+
+    def publish(self, channel: str, event: dict) -> None:
+        self.dispatch(channel, event)
+
+
+class RedisBroker(BaseBroker):
+    """Redis pub/sub, every node receives the events of the users connected to it.
+
+    A node has one pub/sub connection read by a dedicated thread, the thread alone uses the connection,
+    subscriptions are handed over to it as commands.
+    """
+    poll_timeout = 0.1  # how long a new subscription may wait for the reader
+
+    def __init__(self, url: str = None):
+        import redis
+        super().__init__()
+        self.redis = redis.Redis.from_url(url or settings.REDIS_URL)
+        self.errors = (OSError, redis.RedisError)
+        self._commands = queue.Queue()
+        self._reader = None
+        self._reader_pid = None
+
+    def publish(self, channel: str, event: dict) -> None:
+        self.redis.publish(channel, json.dumps(event))
+
+    def listen(self, channels):
+        self.start_reader()
+        future = concurrent.futures.Future()
+        self._commands.put(('subscribe', channels, future))
+        return future
+
+    def unlisten(self, channels) -> None:
+        self._commands.put(('unsubscribe', channels, None))
+
+    def start_reader(self) -> None:
+        # a forked worker doesn't inherit the thread of its parent
+        if self._reader is not None and self._reader.is_alive() and self._reader_pid == os.getpid():
+            return
+        self._reader_pid = os.getpid()
+        self._reader = threading.Thread(target=self.read, name='broker-reader', daemon=True)
+        self._reader.start()
+
+    def read(self) -> None:
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        while True:
+            try:
+                self.run_commands(pubsub)
+                message = pubsub.get_message(timeout=self.poll_timeout)
+            except self.errors:
+                # the connection is restored with its subscriptions by the next call
+                logger.exception("Reading the realtime events has failed")
+                time.sleep(self.poll_timeout)
+                continue
+            if message and message['type'] == 'message':
+                self.dispatch(message['channel'].decode(), json.loads(message['data']))
+
+    def run_commands(self, pubsub) -> None:
+        # without subscriptions there is nothing to read, the thread sleeps until the first one
+        block = not pubsub.subscribed
+        while True:
+            try:
+                action, channels, future = self._commands.get(block=block)
+            except queue.Empty:
+                return
+            block = False
+            try:
+                getattr(pubsub, action)(*channels)
+            except self.errors as e:
+                if future is not None:
+                    future.set_exception(e)
+                raise
+            if future is not None:
+                future.set_result(None)
+
+
+_broker = None
+
+
+def get_broker() -> BaseBroker:
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.CHAT_BROKER)()
+    return _broker
+
+
+def get_user_channel(user_id: int) -> str:
+    return f'chats:user:{user_id}'
@@ -0,0 +1,92 @@
+import time
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.users.cache import get_profiles
+
+INBOX_VERSION_KEY = 'chats:inbox:{user_id}:version'
+INBOX_PAGE_KEY = 'chats:inbox:{user_id}:{version}:{query}'
+INBOX_PAGE_TIMEOUT = 5 * 60
+INBOX_HITS_KEY = 'chats:inbox:hits'
+INBOX_MISSES_KEY = 'chats:inbox:misses'
+
+
+def incr(key: str) -> int:
+    """Increments a counter which never expires, the counter is created on the first call"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # a version restarted after eviction must not meet the pages of the old one, so it starts from a timestamp
+        if cache.add(key, int(time.time() * 1000), None):
+            return cache.get(key)
+        return cache.incr(key)
+
+
+def get_inbox_version(user_id: int) -> int:
+    version = cache.get(INBOX_VERSION_KEY.format(user_id=user_id))
+    if version is None:
+        version = incr(INBOX_VERSION_KEY.format(user_id=user_id))
+    return version
+
+
+def bump_inbox_versions(user_ids) -> None:
+    """Drops the cached inbox pages of the users.
+
+    The versions are bumped right away and once more on commit, so a page rendered by
+    a concurrent request in between can't outlive the transaction.
+    """
+    user_ids = list(user_ids)
+
+    def bump():
+        for user_id in user_ids:
+            incr(INBOX_VERSION_KEY.format(user_id=user_id))
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def get_inbox_page_key(user_id: int, full_path: str) -> str:
+    query = md5(full_path.encode('utf-8')).hexdigest()
+    return INBOX_PAGE_KEY.format(user_id=user_id, version=get_inbox_version(user_id), query=query)
+
+
+def get_inbox_page(key: str):
+    data = cache.get(key)
+    if data is None:
+        incr(INBOX_MISSES_KEY)
+        return None
+    incr(INBOX_HITS_KEY)
+    return hydrate(data)
+
+
+def set_inbox_page(key: str, data) -> None:
+    cache.set(key, dehydrate(data), INBOX_PAGE_TIMEOUT)
+
+
+def get_inbox_stats() -> dict:
+    stats = cache.get_many([INBOX_HITS_KEY, INBOX_MISSES_KEY])
+    return {
+        'hits': stats.get(INBOX_HITS_KEY, 0),
+        'misses': stats.get(INBOX_MISSES_KEY, 0),
+    }
+
+
+def _get_dialogs(data) -> list:
+    return data['results'] if isinstance(data, dict) else data
+
+
+def dehydrate(data):
+    """Participants are stored as ids, profiles change independently of the inbox version"""
+    dialogs = [dict(dialog, participants=[p['id'] for p in dialog['participants']]) for dialog in _get_dialogs(data)]
+    if isinstance(data, dict):
+        return dict(data, results=dialogs)
+    return dialogs
+
+
+def hydrate(data):
+    profiles = get_profiles(pk for dialog in _get_dialogs(data) for pk in dialog['participants'])
+    for dialog in _get_dialogs(data):
+        dialog['participants'] = [profiles[pk] for pk in dialog['participants'] if pk in profiles]
+    return data
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from apps.chats.broker import get_broker, get_user_channel
+from apps.users.authentication import StatelessJWTAuthentication
+
+DIALOGS_PATH = '/ws/v1/dialogs/'
+CLOSE_NOT_FOUND = 4404
+CLOSE_UNAUTHORIZED = 4401
+
+
+def get_raw_token(scope):
+    """Takes the simplejwt access token from `?token=` or the `Authorization: Bearer` header"""
+    token = parse_qs(scope.get('query_string', b'').decode('latin1')).get('token', [None])[0]
+    if token is None:
+        header = dict(scope.get('headers', [])).get(b'authorization', b'').decode('latin1').split()
+        if len(header) == 2 and header[0] in api_settings.AUTH_HEADER_TYPES:
+            token = header[1]
+    return token or None
+
+
+def authenticate(raw_token):
+    """The validated token, or None when the API would reject it: it's expired, revoked or the user is inactive"""
+    authentication = StatelessJWTAuthentication()
+    try:
+        token = authentication.get_validated_token(raw_token)
+        authentication.get_user(token)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return token
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'websocket.disconnect':
+        pass  # the socket is one way, anything sent by the client is ignored
+
+
+async def websocket_application(scope, receive, send):
+    """Pushes new messages and read events of every dialog of the connected user.
+
+    The token is checked again every `JWT_CLAIMS_CACHE_TTL` seconds and when it expires, the socket is
+    closed once the API would reject the token.
+    """
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    if scope['path'] != DIALOGS_PATH:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    raw_token = get_raw_token(scope)
+    token = await sync_to_async(authenticate)(raw_token) if raw_token else None
+    if token is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+    await send({'type': 'websocket.accept'})
+
+    async def forward():
+        async for event in get_broker().subscribe([get_user_channel(token[api_settings.USER_ID_CLAIM])]):
+            await send({'type': 'websocket.send', 'text': json.dumps(event)})
+
+    forwarding = asyncio.ensure_future(forward())
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        while True:
+            timeout = max(min(settings.JWT_CLAIMS_CACHE_TTL, token['exp'] - time.time()), 0)
+            done, _ = await asyncio.wait({disconnected}, timeout=timeout)
+            if done:
+                break
+            if await sync_to_async(authenticate)(raw_token) is None:
+                await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+                break
+    finally:
+        for task in (forwarding, disconnected):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,26 @@
+from django.db import transaction
+
+
+def publish(user_ids, event: dict) -> None:
+    """Events are published by a task once the transaction is committed, so clients never see rolled back data"""
+    from apps.chats.tasks import publish_event
+
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: publish_event.delay(user_ids, event))
+
+
+def publish_message(dialog, message) -> None:
+    from apps.chats.serializers import MessageSerializer
+
+    # a new message is unread by definition, so the read cursors are not loaded
+    data = MessageSerializer(message, context={'read_positions': {message.dialog_id: {}}}).data
+    publish(dialog.users, {'type': 'message', 'message': dict(data)})
+
+
+def publish_read(dialog, user_id: int, message_id: int) -> None:
+    publish(dialog.users, {
+        'type': 'read',
+        'dialog_id': dialog.pk,
+        'user_id': user_id,
+        'message_id': message_id,
+    })
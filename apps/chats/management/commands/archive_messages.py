@@ -0,0 +1,61 @@
+from datetime import timedelta
+from itertools import groupby
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from apps.chats.archive import write_segment
+from apps.chats.models import Dialog, Message, MessageArchiveEntry
+
+# a raw DELETE, the ORM one would null the dialog and read cursor references to the archived messages
+DELETE_ARCHIVED_SQL = """
+    DELETE FROM chats_message
+    WHERE dialog_id = ANY(%(dialog_ids)s) AND created < %(cutoff)s
+"""
+MESSAGES_CHUNK_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = "Moves messages older than the cutoff from the database to compressed segment files of the archive. " \
+           "The history endpoints keep serving them from the archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, required=True)
+        parser.add_argument('--batch-size', type=int, default=500, help="Dialogs per segment file")
+
+    def handle(self, *args, **options):
+        if options['older_than_days'] < 1:
+            raise CommandError("--older-than-days must be positive")
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        dialog_ids = list(Message.objects
+                          .filter(created__lt=cutoff)
+                          .order_by('dialog_id')
+                          .values_list('dialog_id', flat=True)
+                          .distinct())
+        archived = 0
+        for i in range(0, len(dialog_ids), options['batch_size']):
+            archived += self.archive(dialog_ids[i:i + options['batch_size']], cutoff)
+        self.stdout.write(self.style.SUCCESS(f"{archived} messages of {len(dialog_ids)} dialogs are archived"))
+
+    @staticmethod
+    def archive(dialog_ids: list, cutoff) -> int:
+        messages = (Message.objects
+                    .filter(dialog_id__in=dialog_ids, created__lt=cutoff)
+                    .defer('search_vector')
+                    .order_by('dialog_id', 'created', 'id')
+                    .iterator(chunk_size=MESSAGES_CHUNK_SIZE))
+        # streamed from a server side cursor, a dialog is never loaded whole
+        chunks = groupby(messages, key=lambda m: m.dialog_id)
+        # the segment is written first, a failure below leaves an unreferenced file instead of lost messages
+        entries = write_segment(chunks)
+        with transaction.atomic():
+            MessageArchiveEntry.objects.bulk_create(entries)
+            for entry in entries:
+                (Dialog.objects
+                 .filter(pk=entry.dialog_id)
+                 .update(archived_until=Greatest('archived_until', entry.last_created)))  # GREATEST skips NULL
+            with connection.cursor() as cursor:
+                cursor.execute(DELETE_ARCHIVED_SQL, {'dialog_ids': dialog_ids, 'cutoff': cutoff})
+        return sum(entry.count for entry in entries)
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from apps.chats.models import Dialog
+
+CREATE_MEMBERS_SQL = """
+    INSERT INTO chats_dialogmember (created, modified, dialog_id, user_id, unread_count)
+    SELECT now(), now(), d.id, u.user_id, 0
+    FROM chats_dialog d CROSS JOIN LATERAL unnest(d.users) AS u(user_id)
+    WHERE d.id BETWEEN %(low)s AND %(high)s
+    ON CONFLICT (dialog_id, user_id) DO NOTHING
+"""
+
+UPDATE_MEMBERS_SQL = """
+    UPDATE chats_dialogmember m
+    SET last_sent_at = a.last_sent_at, last_received_at = a.last_received_at
+    FROM (
+        SELECT mb.id,
+               MAX(msg.created) FILTER (WHERE msg.sender_id = mb.user_id) AS last_sent_at,
+               MAX(msg.created) FILTER (WHERE msg.sender_id <> mb.user_id) AS last_received_at
+        FROM chats_dialogmember mb
+        JOIN chats_message msg ON msg.dialog_id = mb.dialog_id
+        WHERE mb.dialog_id BETWEEN %(low)s AND %(high)s
+        GROUP BY mb.id
+    ) a
+    WHERE m.id = a.id
+"""
+
+UPDATE_DIALOGS_SQL = """
+    UPDATE chats_dialog d
+    SET last_message_id = l.id, last_message_at = l.created
+    FROM (
+        SELECT DISTINCT ON (dialog_id) dialog_id, id, created
+        FROM chats_message
+        WHERE dialog_id BETWEEN %(low)s AND %(high)s
+        ORDER BY dialog_id, created DESC, id DESC
+    ) l
+    WHERE d.id = l.dialog_id
+"""
+
+
+class Command(BaseCommand):
+    help = "Fills dialog members, their last activity and the last message pointer from the message history. " \
+           "The unread counters of the new members are filled by reconcile_unread_counters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Dialogs per transaction")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = Dialog.objects.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            self.stdout.write("There are no dialogs")
+            return
+
+        low = bounds['low']
+        while low <= bounds['high']:
+            params = {'low': low, 'high': low + batch_size - 1}
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(CREATE_MEMBERS_SQL, params)
+                cursor.execute(UPDATE_MEMBERS_SQL, params)
+                cursor.execute(UPDATE_DIALOGS_SQL, params)
+            self.stdout.write(f"Dialogs {params['low']}..{params['high']} are done")
+            low += batch_size
+        self.stdout.write(self.style.SUCCESS("Dialog activity is backfilled"))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from apps.chats.models import Message
+
+# the trigger recomputes the vector on any UPDATE of the row
+UPDATE_VECTORS_SQL = """
+    UPDATE chats_message
+    SET text = text
+    WHERE id BETWEEN %(low)s AND %(high)s AND search_vector IS NULL
+"""
+
+
+class Command(BaseCommand):
+    help = "Fills the search vectors of the messages written before the search was added"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help="Messages per transaction")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = Message.objects.filter(search_vector__isnull=True).aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            self.stdout.write("There are no messages without search vectors")
+            return
+
+        updated = 0
+        low = bounds['low']
+        while low <= bounds['high']:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(UPDATE_VECTORS_SQL, {'low': low, 'high': low + batch_size - 1})
+                updated += cursor.rowcount
+            low += batch_size
+        self.stdout.write(self.style.SUCCESS(f"{updated} search vectors are filled"))
@@ -0,0 +1,107 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from apps.chats.models import Dialog
+from apps.users.models import User
+
+
+class Command(BaseCommand):
+    help = "Compares how many concurrent requests one process serves with the sync (DRF) and the async chat views. " \
+           "The benchmark runs against a temporary test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dialogs', type=int, default=50)
+        parser.add_argument('--messages', type=int, default=50, help="Messages per dialog")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per run")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+        parser.add_argument('--threads', type=int, default=1,
+                            help="Threads of the sync worker, a sync gunicorn worker has one")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user, dialog = self.seed(options['dialogs'], options['messages'])
+            headers = {'HTTP_AUTHORIZATION': f"Bearer {user.get_tokens()['access']}"}
+            endpoints = {
+                'dialogs': (reverse('dialogs-list'), reverse('async-dialogs-list')),
+                'messages': (reverse('dialogs-messages', kwargs={'pk': dialog.pk}),
+                             reverse('async-dialogs-messages', kwargs={'pk': dialog.pk})),
+            }
+            self.stdout.write(f"{'endpoint':<10}{'stack':<7}{'conc.':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}")
+            for name, (sync_url, async_url) in endpoints.items():
+                for concurrency in options['concurrency']:
+                    for stack, runner, url in (('sync', self.run_sync, sync_url),
+                                               ('async', self.run_async, async_url)):
+                        # the dialog list is cached per query string, every request must miss
+                        urls = [f'{url}?last_sent=true&run={stack}{concurrency}-{i}' if name == 'dialogs' else url
+                                for i in range(options['requests'])]
+                        elapsed, latencies = runner(urls, headers, concurrency, options['threads'])
+                        self.report(name, stack, concurrency, elapsed, latencies)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def seed(self, dialogs_count: int, messages_count: int):
+        password = make_password('password')
+        users = User.objects.bulk_create([
+            User(phone_number=f'+1000{i:07d}', password=password) for i in range(dialogs_count + 1)
+        ])
+        user, friends = users[0], users[1:]
+        dialogs = [Dialog.objects.create(users=[user.pk, friend.pk]) for friend in friends]
+        for dialog, friend in zip(dialogs, friends):
+            Dialog.objects.send_messages(friend, [(dialog, f'Message {i}') for i in range(messages_count)])
+        return user, dialogs[0]
+
+    @staticmethod
+    def run_sync(urls, headers, concurrency, threads):
+        def request(url, queued_at):
+            check(Client().get(url, **headers))
+            return time.perf_counter() - queued_at
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(threads, concurrency)) as executor:
+            futures = [executor.submit(request, url, time.perf_counter()) for url in urls]
+            latencies = [future.result() for future in futures]
+        return time.perf_counter() - started, latencies
+
+    @staticmethod
+    def run_async(urls, headers, concurrency, threads):
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def request(url):
+                queued_at = time.perf_counter()
+                async with semaphore:
+                    # the async test client of Django 3.1 takes raw ASGI headers
+                    check(await AsyncClient().get(url, headers=[
+                        (b'host', b'testserver'),
+                        (b'authorization', headers['HTTP_AUTHORIZATION'].encode()),
+                    ]))
+                return time.perf_counter() - queued_at
+
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*(request(url) for url in urls))
+            return time.perf_counter() - started, latencies
+
+        return asyncio.run(main())
+
+    def report(self, name, stack, concurrency, elapsed, latencies):
+        latencies = sorted(latencies)
+        p50 = statistics.median(latencies) * 1000
+        p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+        self.stdout.write(f"{name:<10}{stack:<7}{concurrency:>6}{len(latencies) / elapsed:>9.1f}{p50:>9.1f}{p95:>9.1f}")
+
+
+def check(response):
+    if response.status_code != 200:
+        raise CommandError(f"{response.status_code} response: {response.content[:200]!r}")
@@ -0,0 +1,89 @@
+import random
+import statistics
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from apps.chats.management.commands.benchmark_endpoints import QueryRecorder
+from apps.users.models import User, get_phone_hash
+
+
+class Command(BaseCommand):
+    help = "Measures the contact discovery of an address book by numbers and by hashes against " \
+           "a lookup per number. The benchmark runs against a temporary test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--contacts', type=int, default=10000, help="Numbers of the address book")
+        parser.add_argument('--hit-rate', type=float, default=0.3, help="Share of the numbers which are registered")
+        parser.add_argument('--requests', type=int, default=10, help="Requests per method")
+        parser.add_argument('--workers', type=int, default=1, help="Processes seeding the users")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if not 0 <= options['hit_rate'] <= 1:
+            raise CommandError("--hit-rate must be between 0 and 1")
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            call_command('populate', users=options['users'], dialogs=0, messages=0, workers=options['workers'],
+                         seed=options['seed'], stdout=StringIO(), stderr=StringIO())
+            numbers = self.make_address_book(options['contacts'], options['hit_rate'], options['seed'])
+            # the benchmark user would be throttled after a few requests
+            with override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={})):
+                self.run(numbers, options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    @staticmethod
+    def make_address_book(size: int, hit_rate: float, seed: int) -> list:
+        rng = random.Random(seed)
+        registered = list(User.objects.values_list('phone_number', flat=True))
+        hits = rng.sample(registered, min(int(size * hit_rate), len(registered)))
+        numbers = hits + [f'+1{rng.randrange(10 ** 10):010d}' for _ in range(size - len(hits))]
+        rng.shuffle(numbers)
+        return numbers
+
+    def run(self, numbers: list, requests: int):
+        user = User.objects.order_by('pk').first()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {user.get_tokens()['access']}")
+        path = reverse('contacts-discover')
+        hashes = [get_phone_hash(number) for number in numbers]
+
+        def discover(data):
+            response = client.post(path, data, format='json')
+            if response.status_code != 200:
+                raise CommandError(f"{response.status_code} response: {response.content[:200]!r}")
+            return len(response.data['results'])
+
+        def lookup_each():
+            return sum(User.objects.filter(phone_number=number, is_active=True).exclude(pk=user.pk).exists()
+                       for number in numbers)
+
+        self.stdout.write(f"{len(numbers)} contacts")
+        self.stdout.write(f"{'method':<19}{'p50 ms':>9}{'max ms':>9}{'queries':>9}{'matches':>9}")
+        self.measure('numbers', lambda: discover({'phone_numbers': numbers}), requests)
+        self.measure('hashes', lambda: discover({'phone_hashes': hashes}), requests)
+        self.measure('lookup per number', lookup_each, 1)
+
+    def measure(self, name: str, func, requests: int):
+        func()  # warmup
+        latencies, queries = [], 0
+        for _ in range(requests):
+            recorder = QueryRecorder()
+            with connection.execute_wrapper(recorder):
+                started = time.perf_counter()
+                matches = func()
+                latencies.append(time.perf_counter() - started)
+            queries = max(queries, recorder.queries)
+        p50, worst = statistics.median(latencies) * 1000, max(latencies) * 1000
+        self.stdout.write(f"{name:<19}{p50:>9.1f}{worst:>9.1f}{queries:>9}{matches:>9}")
@@ -0,0 +1,181 @@
+import json
+import os
+import statistics
+import time
+from collections import namedtuple
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from apps.chats.models import Dialog, Message
+from apps.users.models import User
+
+PASSWORD = 'password'  # the one `populate` gives to every user
+
+# cumulative volumes of users, dialogs and messages, every size adds rows on top of the smaller one
+SIZES = {
+    'small': (500, 5000, 100000),
+    'medium': (2000, 40000, 1000000),
+    'large': (20000, 400000, 10000000),
+}
+
+Endpoint = namedtuple('Endpoint', ('name', 'method', 'path', 'data', 'authenticated'))
+
+
+class QueryRecorder:
+    """Counts the statements and the rows they return, it is installed with `connection.execute_wrapper`"""
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        cursor = context['cursor']
+        if cursor.description is not None:
+            self.rows += max(cursor.rowcount, 0)
+        return result
+
+
+def get_endpoints(user: User, dialog: Dialog, refresh: str) -> list:
+    dialogs = reverse('dialogs-list')
+    messages = reverse('dialogs-messages', kwargs={'pk': dialog.pk})
+    return [
+        # the inbox is cached per query string, `run` makes every request a miss
+        Endpoint('dialogs', 'get', dialogs + '?run={run}', None, True),
+        Endpoint('dialogs_last_sent', 'get', dialogs + '?last_sent=true&run={run}', None, True),
+        Endpoint('dialogs_last_received', 'get', dialogs + '?last_received=true&run={run}', None, True),
+        Endpoint('messages', 'get', messages, None, True),
+        Endpoint('send', 'post', messages, {'text': 'How are you doing?'}, True),
+        Endpoint('favorite', 'patch', reverse('dialogs-add-to-favorite', kwargs={'pk': dialog.pk}), None, True),
+        Endpoint('signin', 'post', reverse('signin'), {'phone_number': user.phone_number, 'password': PASSWORD}, False),
+        Endpoint('refresh', 'post', reverse('token_refresh'), {'refresh': refresh}, False),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Measures the latency, SQL queries and fetched rows of the main endpoints on datasets of several sizes " \
+           "and fails when a budget of the baseline file is exceeded. " \
+           "The benchmark runs against a temporary test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', choices=SIZES, default=['small', 'medium'])
+        parser.add_argument('--requests', type=int, default=50, help="Requests per endpoint and size")
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'endpoints.json'))
+        parser.add_argument('--update-baseline', action='store_true', help="Stores the results as the new baseline")
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help="Allowed latency growth over the baseline, queries and rows are exact budgets")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Processes seeding the data")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        baseline = {}
+        if os.path.exists(options['baseline']):
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        elif not options['update_baseline']:
+            raise CommandError(f"{options['baseline']} doesn't exist, create it with --update-baseline")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = {}
+            self.stdout.write(f"{'size':<8}{'endpoint':<23}{'p50 ms':>9}{'p95 ms':>9}{'queries':>9}{'rows':>7}")
+            # the buffered reads are flushed in the background, a flush during the measured requests would skew them
+            with override_settings(CHAT_READ_FLUSH_INTERVAL=24 * 60 * 60):
+                for size in sorted(options['sizes'], key=list(SIZES).index):
+                    self.seed(SIZES[size], options['workers'], options['seed'])
+                    results[size] = self.run(size, options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['update_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']), exist_ok=True)
+            with open(options['baseline'], 'w') as f:
+                json.dump(dict(baseline, **results), f, indent=2, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(self.style.SUCCESS(f"The baseline is stored in {options['baseline']}"))
+            return
+
+        failures = self.compare(results, baseline, options['tolerance'])
+        if failures:
+            raise CommandError("Budgets are exceeded:\n" + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS("All the endpoints are within their budgets"))
+
+    @staticmethod
+    def seed(volumes, workers: int, seed: int):
+        current = (User.objects.count(), Dialog.objects.count(), Message.objects.count())
+        missing = [max(target - count, 0) for target, count in zip(volumes, current)]
+        call_command('populate', users=missing[0], dialogs=missing[1], messages=missing[2], workers=workers,
+                     seed=seed, stdout=StringIO(), stderr=StringIO())
+
+    def run(self, size: str, requests: int) -> dict:
+        # the busiest user of the dataset and the longest of their dialogs
+        user = User.objects.annotate(dialogs=Count('dialog_memberships')).order_by('-dialogs', 'pk').first()
+        dialog = (Dialog.objects
+                  .filter(users__contains=[user.pk])
+                  .annotate(size=Count('messages'))
+                  .order_by('-size', 'pk')
+                  .first()
+                  )
+        tokens = user.get_tokens()
+        client = APIClient()
+        results = {}
+        for endpoint in get_endpoints(user, dialog, tokens['refresh']):
+            client.credentials(**({'HTTP_AUTHORIZATION': f"Bearer {tokens['access']}"} if endpoint.authenticated
+                                  else {}))
+            self.request(client, endpoint, run='warmup')
+            latencies, queries, rows = [], 0, 0
+            for run in range(requests):
+                recorder = QueryRecorder()
+                with connection.execute_wrapper(recorder):
+                    started = time.perf_counter()
+                    self.request(client, endpoint, run=run)
+                    latencies.append(time.perf_counter() - started)
+                # the budgets hold for every request, the worst one is recorded
+                queries, rows = max(queries, recorder.queries), max(rows, recorder.rows)
+            results[endpoint.name] = self.report(size, endpoint.name, latencies, queries, rows)
+        return results
+
+    @staticmethod
+    def request(client: APIClient, endpoint: Endpoint, run):
+        response = getattr(client, endpoint.method)(endpoint.path.format(run=run), endpoint.data, format='json')
+        if response.status_code not in (200, 201):
+            raise CommandError(f"{endpoint.name}: {response.status_code} response: {response.content[:200]!r}")
+
+    def report(self, size, name, latencies, queries, rows) -> dict:
+        latencies = sorted(latencies)
+        p50 = statistics.median(latencies) * 1000
+        p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000
+        self.stdout.write(f"{size:<8}{name:<23}{p50:>9.1f}{p95:>9.1f}{queries:>9}{rows:>7}")
+        return {'p50_ms': round(p50, 1), 'p95_ms': round(p95, 1), 'queries': queries, 'rows': rows}
+
+    @staticmethod
+    def compare(results: dict, baseline: dict, tolerance: float) -> list:
+        failures = []
+        for size, endpoints in results.items():
+            for name, measured in endpoints.items():
+                budget = baseline.get(size, {}).get(name)
+                if budget is None:
+                    failures.append(f"{size} {name}: there is no baseline")
+                    continue
+                limits = {
+                    'queries': budget['queries'],
+                    'rows': budget['rows'],
+                    'p50_ms': budget['p50_ms'] * (1 + tolerance),
+                    'p95_ms': budget['p95_ms'] * (1 + tolerance),
+                }
+                failures.extend(
+                    f"{size} {name}: {metric} {measured[metric]} > {limit:g}"
+                    for metric, limit in limits.items() if measured[metric] > limit
+                )
+        return failures
@@ -0,0 +1,85 @@
+import gzip
+import io
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from apps.chats.models import Message
+from apps.chats.serializers import MessageSerializer
+from apps.compression import BROTLI_QUALITY, GZIP_LEVEL, brotli
+from apps.utils import FastJSONParser, FastJSONRenderer, get_lorem_ipsum, orjson
+
+
+class Command(BaseCommand):
+    help = "Compares the render and parse time of the stdlib and orjson JSON renderers and the size of " \
+           "the compressed body on a message history page. Nothing is read from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000, help="Messages in the history page")
+        parser.add_argument('--repeat', type=int, default=50, help="Runs per measurement")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stderr.write("orjson isn't installed, the fast renderer falls back to the stdlib one")
+        payloads = self.make_payloads(options['messages'], options['seed'])
+        self.stdout.write(f"{options['messages']} messages")
+        self.stdout.write(f"{'payload':<12}{'renderer':<10}{'render ms':>11}{'parse ms':>10}{'bytes':>10}")
+        renderers = {'json': (JSONRenderer(), JSONParser()), 'orjson': (FastJSONRenderer(), FastJSONParser())}
+        for payload, data in payloads.items():
+            for name, (renderer, parser) in renderers.items():
+                render_ms = self.measure(lambda: renderer.render(data), options['repeat'])
+                body = renderer.render(data)
+                parse_ms = self.measure(lambda: parser.parse(io.BytesIO(body)), options['repeat'])
+                self.stdout.write(f"{payload:<12}{name:<10}{render_ms:>11.2f}{parse_ms:>10.2f}{len(body):>10}")
+
+        body = FastJSONRenderer().render(payloads['serialized'])
+        self.stdout.write(f"\n{'encoding':<22}{'compress ms':>12}{'bytes':>10}{'ratio':>8}")
+        encodings = {f'gzip level {GZIP_LEVEL}': lambda: gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)}
+        if brotli is not None:
+            encodings[f'brotli quality {BROTLI_QUALITY}'] = lambda: brotli.compress(body, quality=BROTLI_QUALITY)
+        else:
+            self.stderr.write("brotli isn't installed, only gzip is measured")
+        for name, compress in encodings.items():
+            compress_ms = self.measure(compress, options['repeat'])
+            size = len(compress())
+            self.stdout.write(f"{name:<22}{compress_ms:>12.2f}{size:>10}{len(body) / size:>8.1f}")
+
+    @staticmethod
+    def make_payloads(count: int, seed: int) -> dict:
+        """A serialized history page as the messages endpoint returns it and the same rows with native types"""
+        rng = random.Random(seed)
+        users = [1, 2]
+        words = get_lorem_ipsum().lower().replace(',', '').replace('.', '').split()
+        created = timezone.now() - timedelta(days=1)
+        messages = []
+        for pk in range(1, count + 1):
+            created += timedelta(seconds=rng.randint(1, 120), microseconds=rng.randint(0, 999999))
+            text = ' '.join(rng.choices(words, k=rng.randint(1, 40))).capitalize()
+            messages.append(Message(id=pk, sender_id=rng.choice(users), dialog_id=1, text=text, created=created))
+        positions = {1: {1: count // 2, 2: count}}
+        serializer = MessageSerializer(messages, many=True, context={'read_positions': positions})
+        profiles = {str(pk): {'id': pk, 'first_name': 'Name', 'last_name': 'Surname'} for pk in users}
+        return {
+            'serialized': {'next': None, 'previous': None, 'results': serializer.data, 'users': profiles},
+            'native': {'results': [
+                {'id': m.id, 'sender_id': m.sender_id, 'dialog_id': m.dialog_id, 'text': m.text, 'created': m.created}
+                for m in messages
+            ]},
+        }
+
+    @staticmethod
+    def measure(func, repeat: int) -> float:
+        func()  # warmup
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - started)
+        return statistics.median(durations) * 1000
@@ -0,0 +1,115 @@
+import statistics
+import time
+from urllib.parse import urlencode
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from apps.chats.models import Dialog, Message
+from apps.users.models import User
+
+# the first words are picked far more often, like in real text
+WORDS = (
+    'the you to and it a is that of in me what this for my on have your do no be not are can with but all so '
+    'just was here know like we get go he about now out there at if they yes how right up one oh got see well '
+    'think come good want time look let where tonight call meeting pizza dinner weekend flight ticket concert '
+    'birthday present hospital invoice contract deadline holiday passport museum guitar bicycle umbrella'
+).split()
+
+FILL_SQL = """
+    INSERT INTO chats_message (created, modified, text, dialog_id, sender_id)
+    SELECT m.created, m.created, m.text, d.id, d.user_low
+    FROM (
+        SELECT (%(dialog_ids)s::int[])[1 + floor(random() * %(dialogs)s)::int] AS dialog_id,
+               now() - random() * interval '300 days' AS created,
+               concat_ws(' ', VARIADIC ARRAY(
+                   SELECT (%(words)s::text[])[1 + floor(random() ^ 3 * %(vocabulary)s)::int]
+                   FROM generate_series(1, 6 + g %% 6)
+               )) AS text
+        FROM generate_series(1, %(count)s) g
+    ) m
+    JOIN chats_dialog d ON d.id = m.dialog_id
+"""
+
+
+class Command(BaseCommand):
+    help = "Measures the message search latency while the messages table grows. " \
+           "The benchmark runs against a temporary test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000000, 2000000, 4000000],
+                            help="Sizes of the messages table to measure at")
+        parser.add_argument('--queries', type=int, default=50, help="Requests per term and size")
+        parser.add_argument('--user-messages', type=int, default=10000, help="Messages in the searcher's dialogs")
+        parser.add_argument('--chunk-size', type=int, default=500000, help="Messages per INSERT")
+
+    def handle(self, *args, **options):
+        if options['sizes'] != sorted(options['sizes']):
+            raise CommandError("--sizes must grow")
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            user, user_dialogs, other_dialogs = self.seed()
+            headers = {'HTTP_AUTHORIZATION': f"Bearer {user.get_tokens()['access']}"}
+            # a frequent word, a rare one and a phrase
+            terms = ('time', 'passport', '"good time"')
+            self.fill(user_dialogs, options['user_messages'], options['chunk_size'])
+
+            self.stdout.write(f"{'messages':>10} {'term':<14}{'matches':>9}{'p50 ms':>9}{'p95 ms':>9}")
+            for size in options['sizes']:
+                self.fill(other_dialogs, size - Message.objects.count(), options['chunk_size'])
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE chats_message")
+                for term in terms:
+                    matches = Message.objects.filter(dialog__in=user_dialogs).search(term).count()
+                    url = f"{reverse('dialogs-search')}?{urlencode({'q': term})}"
+                    latencies = self.measure(url, headers, options['queries'])
+                    self.report(size, term, matches, latencies)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    @staticmethod
+    def seed():
+        password = make_password('password')
+        users = User.objects.bulk_create([User(phone_number=f'+1000{i:07d}', password=password) for i in range(200)])
+        user = users[0]
+        user_dialogs = [Dialog.objects.get_or_create_for(user.pk, friend.pk)[0] for friend in users[1:21]]
+        other_dialogs = [Dialog.objects.get_or_create_for(a.pk, b.pk)[0] for a, b in zip(users[21::2], users[22::2])]
+        return user, user_dialogs, other_dialogs
+
+    def fill(self, dialogs, count: int, chunk_size: int):
+        started = time.perf_counter()
+        for offset in range(0, max(count, 0), chunk_size):
+            with connection.cursor() as cursor:
+                cursor.execute(FILL_SQL, {
+                    'dialog_ids': [dialog.pk for dialog in dialogs],
+                    'dialogs': len(dialogs),
+                    'words': list(WORDS),
+                    'vocabulary': len(WORDS),
+                    'count': min(chunk_size, count - offset),
+                })
+        if count > 0:
+            self.stderr.write(f"{count} messages are inserted in {time.perf_counter() - started:.1f}s")
+
+    @staticmethod
+    def measure(url, headers, queries: int) -> list:
+        client = Client()
+        latencies = []
+        for _ in range(queries):
+            started = time.perf_counter()
+            response = client.get(url, **headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f"{response.status_code} response: {response.content[:200]!r}")
+        return latencies
+
+    def report(self, size, term, matches, latencies):
+        latencies = sorted(latencies)
+        p50 = statistics.median(latencies) * 1000
+        p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+        self.stdout.write(f"{size:>10} {term:<14}{matches:>9}{p50:>9.1f}{p95:>9.1f}")
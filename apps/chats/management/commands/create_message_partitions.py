@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.chats.partitions import create_partitions
+
+
+class Command(BaseCommand):
+    help = "Creates the monthly partitions of the messages table ahead of time. " \
+           "Run it daily, inserting a message into a month without a partition fails."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=3, help="Months to cover after the current one")
+
+    def handle(self, *args, **options):
+        created = create_partitions(options['months'])
+        for name in created:
+            self.stdout.write(f"{name} is created")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partitions are created"))
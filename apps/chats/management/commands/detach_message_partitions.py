@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.chats.partitions import detach_partitions, month_start
+
+
+class Command(BaseCommand):
+    help = "Detaches the monthly partitions of messages older than the retention period. " \
+           "The detached tables keep their rows until they are dropped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, required=True,
+                            help="Whole months to keep before the current one")
+        parser.add_argument('--drop', action='store_true', help="Drops the detached tables")
+
+    def handle(self, *args, **options):
+        if options['keep_months'] < 0:
+            raise CommandError("--keep-months can't be negative")
+        before = month_start(timezone.now(), -options['keep_months'])
+        detached = detach_partitions(before, drop=options['drop'])
+        for name in detached:
+            self.stdout.write(f"{name} is {'dropped' if options['drop'] else 'detached'}")
+        self.stdout.write(self.style.SUCCESS(f"{len(detached)} partitions are detached"))
@@ -0,0 +1,281 @@
+import io
+import multiprocessing
+import os
+import random
+import time
+from datetime import datetime, timezone as dt_timezone
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+
+from apps.chats.management.commands.benchmark_search import WORDS
+from apps.chats.partitions import create_partitions, get_partitions
+from apps.users.models import get_phone_hash
+
+FIRST_NAMES = (
+    'Alex', 'Anna', 'Boris', 'Daria', 'Dmytro', 'Emma', 'Ivan', 'Iryna', 'John', 'Kateryna', 'Liam', 'Maria',
+    'Mykola', 'Olena', 'Oleh', 'Olivia', 'Petro', 'Sofia', 'Taras', 'Yulia',
+)
+LAST_NAMES = (
+    'Bondarenko', 'Brown', 'Hnatyuk', 'Johnson', 'Koval', 'Kovalenko', 'Kravchenko', 'Lysenko', 'Melnyk', 'Miller',
+    'Moroz', 'Oliynyk', 'Petrenko', 'Savchenko', 'Shevchenko', 'Smith', 'Tkachenko', 'Williams', 'Wilson', 'Zhuk',
+)
+
+USER_ALPHA = 1.5  # popularity of the users, a few of them are in a large share of the dialogs
+DIALOG_ALPHA = 1.2  # sizes of the dialogs, most are short and a few hold a large share of the messages
+MAX_DIALOG_WEIGHT = 10000  # keeps the largest dialog in the range of the busiest real ones
+BURST_SIZE = 8  # messages of a conversation session
+MESSAGE_GAP = 40  # mean seconds between the messages of a session
+READ_SHARE = 0.8  # participants who have read the whole dialog
+
+# takes a block of ids from the sequence, rows inserted by the application meanwhile get ids after the block
+RESERVE_IDS_SQL = """
+    SELECT setval(sequence, nextval(sequence) + %(count)s - 1)
+    FROM pg_get_serial_sequence(%(table)s, 'id') AS sequence
+"""
+
+USERS_COPY_SQL = """
+    COPY users_user (id, password, phone_number, phone_hash, first_name, last_name, is_active, is_admin,
+                     claims_version) FROM STDIN
+"""
+DIALOGS_COPY_SQL = """
+    COPY chats_dialog (id, created, modified, users, user_low, user_high, last_message_id, last_message_at) FROM STDIN
+"""
+MEMBERS_COPY_SQL = """
+    COPY chats_dialogmember (created, modified, dialog_id, user_id, last_sent_at, last_received_at, unread_count)
+    FROM STDIN
+"""
+MESSAGES_COPY_SQL = "COPY chats_message (id, created, modified, text, dialog_id, sender_id) FROM STDIN"
+READ_STATES_COPY_SQL = """
+    COPY chats_dialogreadstate (created, modified, dialog_id, user_id, last_read_message_id, last_read_at) FROM STDIN
+"""
+
+NULL = r'\N'
+
+
+def reserve_ids(table: str, count: int) -> int:
+    """Returns the first of `count` ids taken from the sequence of the table"""
+    with connection.cursor() as cursor:
+        cursor.execute(RESERVE_IDS_SQL, {'table': table, 'count': count})
+        return cursor.fetchone()[0] - count + 1
+
+
+def copy_rows(cursor, sql: str, rows) -> None:
+    """Loads tuples with COPY in the text format, the values must not contain tabs, newlines or backslashes"""
+    data = io.StringIO()
+    for row in rows:
+        data.write('\t'.join(NULL if value is None else str(value) for value in row))
+        data.write('\n')
+    data.seek(0)
+    cursor.copy_expert(sql, data)
+
+
+def format_time(value: float) -> str:
+    return datetime.fromtimestamp(value, dt_timezone.utc).isoformat()
+
+
+def make_text(rng: random.Random) -> str:
+    # the first words are picked far more often
+    return ' '.join(WORDS[int(rng.random() ** 3 * len(WORDS))] for _ in range(rng.randint(1, 12)))
+
+
+def make_times(rng: random.Random, count: int, start: float, end: float):
+    """Dialog start and bursty message timestamps: sessions over the dialog lifetime, messages seconds apart"""
+    created = rng.uniform(start, end)
+    sessions = sorted(rng.uniform(created, end) for _ in range(max(1, round(count / BURST_SIZE))))
+    sizes = [0] * len(sessions)
+    for session in rng.choices(range(len(sessions)), k=count):
+        sizes[session] += 1
+    times = []
+    for at, size in zip(sessions, sizes):
+        for _ in range(size):
+            at += rng.expovariate(1 / MESSAGE_GAP)
+            times.append(min(at, end))
+    times.sort()
+    return created, times
+
+
+def generate_dialog(rng: random.Random, rows: dict, dialog_id: int, users: tuple, count: int, first_message_id: int,
+                    start: float, end: float) -> None:
+    """Appends the rows of a dialog with `count` messages to the per table `rows`"""
+    created, times = make_times(rng, count, start, end)
+    sender = rng.choice(users)
+    senders = []
+    for message_id, at in enumerate(times, first_message_id):
+        if rng.random() < 0.4:  # the participants take turns
+            sender = users[0] if sender == users[1] else users[1]
+        senders.append(sender)
+        at = format_time(at)
+        rows['messages'].append((message_id, at, at, make_text(rng), dialog_id, sender))
+
+    last_message_id = first_message_id + count - 1 if count else None
+    modified = format_time(times[-1] if times else created)
+    rows['dialogs'].append((
+        dialog_id, format_time(created), modified, '{%s,%s}' % users, users[0], users[1],
+        last_message_id, modified if count else None,
+    ))
+    for user_id in users:
+        sent = [i for i, sender in enumerate(senders) if sender == user_id]
+        received = [i for i, sender in enumerate(senders) if sender != user_id]
+        if received and rng.random() < READ_SHARE:
+            last_read, unread = count - 1, 0
+        else:  # hasn't opened the dialog since the last own message
+            last_read = sent[-1] if sent else None
+            unread = sum(1 for i in received if last_read is None or i > last_read)
+        rows['members'].append((
+            format_time(created), modified, dialog_id, user_id,
+            format_time(times[sent[-1]]) if sent else None,
+            format_time(times[received[-1]]) if received else None,
+            unread,
+        ))
+        if last_read is not None:
+            read_at = format_time(times[last_read])
+            rows['read_states'].append((read_at, read_at, dialog_id, user_id, first_message_id + last_read, read_at))
+
+
+def load_dialogs(task) -> int:
+    """Generates a chunk of dialogs with their messages and loads it with COPY, it runs in the worker processes"""
+    dialogs, first_message_id, seed, start, end = task
+    rng = random.Random(seed)
+    rows = {'dialogs': [], 'members': [], 'messages': [], 'read_states': []}
+    message_id = first_message_id
+    for dialog_id, users, count in dialogs:
+        generate_dialog(rng, rows, dialog_id, users, count, message_id, start, end)
+        message_id += count
+    with transaction.atomic(), connection.cursor() as cursor:
+        copy_rows(cursor, DIALOGS_COPY_SQL, rows['dialogs'])
+        copy_rows(cursor, MEMBERS_COPY_SQL, rows['members'])
+        copy_rows(cursor, MESSAGES_COPY_SQL, rows['messages'])
+        copy_rows(cursor, READ_STATES_COPY_SQL, rows['read_states'])
+    return len(rows['messages'])
+
+
+class Command(BaseCommand):
+    help = "Fills the database with synthetic users, dialogs and messages for load tests and benchmarks. " \
+           "The dialog sizes and the user activity follow a power law, messages come in bursts. " \
+           "The rows are loaded with COPY by parallel worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--dialogs', type=int, default=100000)
+        parser.add_argument('--messages', type=int, default=5000000, help="Approximate number of messages")
+        parser.add_argument('--days', type=int, default=365, help="Time span of the messages up to now")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Loading processes, 1 loads in the current process")
+        parser.add_argument('--chunk-size', type=int, default=100000, help="Messages per COPY transaction")
+        parser.add_argument('--password', default='password', help="Password of all the generated users")
+        parser.add_argument('--seed', type=int, default=None, help="Makes the generated data reproducible")
+
+    def handle(self, *args, **options):
+        users, dialogs, messages = options['users'], options['dialogs'], options['messages']
+        if min(users, dialogs, messages) < 0:
+            raise CommandError("The volumes must not be negative")
+        if options['days'] < 1 or options['workers'] < 1:
+            raise CommandError("--days and --workers must be positive")
+        if dialogs > users * (users - 1) // 2:
+            raise CommandError(f"{users} users can't have {dialogs} distinct dialogs")
+        end = time.time()
+        start = end - options['days'] * 24 * 60 * 60
+        self.check_partitions(start)
+
+        started = time.perf_counter()
+        rng = random.Random(options['seed'])
+        user_ids = self.load_users(rng, users, options['password'])
+        self.stderr.write(f"{users} users are loaded in {time.perf_counter() - started:.1f}s")
+
+        pairs = self.make_pairs(rng, user_ids, dialogs)
+        sizes = self.make_sizes(rng, dialogs, messages)
+        tasks = self.make_tasks(rng, pairs, sizes, options['chunk_size'], start, end)
+        loaded = self.load(tasks, options['workers'], sum(sizes))
+
+        with connection.cursor() as cursor:
+            for table in ('users_user', 'chats_dialog', 'chats_dialogmember', 'chats_message', 'chats_dialogreadstate'):
+                cursor.execute(f"ANALYZE {table}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{users} users, {dialogs} dialogs and {loaded} messages are loaded "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
+
+    @staticmethod
+    def check_partitions(start: float):
+        create_partitions(0)  # the current month
+        partitions = get_partitions()
+        oldest = partitions[0].start if partitions else None
+        if oldest is not None and oldest.timestamp() > start:
+            raise CommandError(f"The oldest message partition starts at {oldest:%Y-%m-%d}, reduce --days")
+
+    @staticmethod
+    def load_users(rng: random.Random, count: int, password: str) -> list:
+        if not count:
+            return []
+        password = make_password(password)  # hashing is deliberately slow, all the users share the hash
+        first_id = reserve_ids('users_user', count)
+        user_ids = list(range(first_id, first_id + count))
+        rows = []
+        for pk in user_ids:
+            phone_number = f'+999{pk:09d}'
+            rows.append((pk, password, phone_number, get_phone_hash(phone_number),
+                         rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), 't', 'f', 0))
+        with transaction.atomic(), connection.cursor() as cursor:
+            copy_rows(cursor, USERS_COPY_SQL, rows)
+        return user_ids
+
+    @staticmethod
+    def make_pairs(rng: random.Random, user_ids: list, count: int) -> list:
+        """Distinct user pairs, popular users take part in more of them"""
+        cum_weights = list(accumulate(rng.paretovariate(USER_ALPHA) for _ in user_ids))
+        pairs = set()
+        while len(pairs) < count:
+            picked = len(pairs)
+            missing = count - picked
+            for a, b in zip(rng.choices(user_ids, cum_weights=cum_weights, k=missing),
+                            rng.choices(user_ids, cum_weights=cum_weights, k=missing)):
+                if a != b:
+                    pairs.add((a, b) if a < b else (b, a))
+            if len(pairs) == picked:
+                raise CommandError("The users are too few to pick so many distinct dialogs, add users")
+        return sorted(pairs)
+
+    @staticmethod
+    def make_sizes(rng: random.Random, dialogs: int, messages: int) -> list:
+        weights = [min(rng.paretovariate(DIALOG_ALPHA), MAX_DIALOG_WEIGHT) for _ in range(dialogs)]
+        scale = messages / sum(weights) if weights else 0
+        return [int(weight * scale + rng.random()) for weight in weights]
+
+    @staticmethod
+    def make_tasks(rng: random.Random, pairs: list, sizes: list, chunk_size: int, start: float, end: float) -> list:
+        """Splits the dialogs into chunks of about `chunk_size` messages with the ids reserved up front"""
+        if not pairs:
+            return []
+        dialog_id = reserve_ids('chats_dialog', len(pairs))
+        message_id = reserve_ids('chats_message', sum(sizes)) if sum(sizes) else 0
+        tasks, chunk, chunk_messages = [], [], 0
+        for users, count in zip(pairs, sizes):
+            chunk.append((dialog_id, users, count))
+            dialog_id += 1
+            chunk_messages += count
+            if chunk_messages >= chunk_size or len(chunk) >= chunk_size:
+                tasks.append((chunk, message_id, rng.random(), start, end))
+                message_id += chunk_messages
+                chunk, chunk_messages = [], 0
+        if chunk:
+            tasks.append((chunk, message_id, rng.random(), start, end))
+        return tasks
+
+    def load(self, tasks: list, workers: int, total: int) -> int:
+        if workers == 1:
+            return self.track(map(load_dialogs, tasks), total)
+        connections.close_all()  # the forked workers open connections of their own
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            return self.track(pool.imap_unordered(load_dialogs, tasks), total)
+
+    def track(self, results, total: int) -> int:
+        started = time.perf_counter()
+        loaded = 0
+        for count in results:
+            loaded += count
+            elapsed = time.perf_counter() - started
+            self.stderr.write(f"{loaded}/{total} messages, {loaded / max(elapsed, 1e-9):.0f} per second")
+        return loaded
@@ -0,0 +1,47 @@
+import os
+import pstats
+import statistics
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.profiling import PROFILE_SUFFIX, parse_profile_name
+
+
+class Command(BaseCommand):
+    help = "Aggregates the request profiles captured with PROFILING into a report of the top hotspots"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.PROFILING_DIR)
+        parser.add_argument('--view', help="A view or an action, e.g. DialogViewSet or AuthViewSet.signup")
+        parser.add_argument('--min-duration', type=int, default=0, help="Skips the faster requests, in ms")
+        parser.add_argument('--top', type=int, default=25, help="Functions in the report")
+        parser.add_argument('--sort', choices=('tottime', 'cumulative', 'ncalls'), default='tottime')
+
+    def handle(self, *args, **options):
+        profiles = []
+        names = sorted(os.listdir(options['dir'])) if os.path.isdir(options['dir']) else []
+        for name in names:
+            if not name.endswith(PROFILE_SUFFIX):
+                continue
+            request = parse_profile_name(name)
+            view = options['view']
+            if view and request['view'] != view and not request['view'].startswith(f'{view}.'):
+                continue
+            if request['duration_ms'] >= options['min_duration']:
+                profiles.append((os.path.join(options['dir'], name), request))
+        if not profiles:
+            self.stdout.write("There are no matching profiles")
+            return
+
+        durations = defaultdict(list)
+        for path, request in profiles:
+            durations[request['view']].append(request['duration_ms'])
+        self.stdout.write(f"{'view':<40}{'profiles':>9}{'p50 ms':>9}{'max ms':>9}")
+        for view, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+            self.stdout.write(f"{view:<40}{len(values):>9}{statistics.median(values):>9.0f}{max(values):>9}")
+        self.stdout.write('')
+
+        stats = pstats.Stats(*(path for path, request in profiles), stream=self.stdout)
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['top'])
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from apps.chats.models import DialogMember
+
+RECONCILE_SQL = """
+    UPDATE chats_dialogmember mb
+    SET unread_count = c.actual
+    FROM (
+        SELECT m.id,
+               (SELECT COUNT(*)
+                FROM chats_message msg
+                WHERE msg.dialog_id = m.dialog_id
+                  AND msg.sender_id <> m.user_id
+                  AND msg.id > COALESCE(rs.last_read_message_id, 0)) AS actual
+        FROM chats_dialogmember m
+        LEFT JOIN chats_dialogreadstate rs ON rs.dialog_id = m.dialog_id AND rs.user_id = m.user_id
+        WHERE m.id BETWEEN %(low)s AND %(high)s
+    ) c
+    WHERE mb.id = c.id AND mb.unread_count <> c.actual
+"""
+
+
+class Command(BaseCommand):
+    help = "Recounts unread messages of every dialog member and repairs drifted counters. " \
+           "It is safe to run periodically, counters touched by concurrent writes are fixed on the next run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Dialog members per transaction")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = DialogMember.objects.aggregate(low=Min('pk'), high=Max('pk'))
+        if bounds['low'] is None:
+            self.stdout.write("There are no dialog members")
+            return
+
+        repaired = 0
+        low = bounds['low']
+        while low <= bounds['high']:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(RECONCILE_SQL, {'low': low, 'high': low + batch_size - 1})
+                repaired += cursor.rowcount
+            low += batch_size
+        self.stdout.write(self.style.SUCCESS(f"{repaired} unread counters are repaired"))
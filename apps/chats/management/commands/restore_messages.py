@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from psycopg2.extras import execute_values
+
+from apps.chats.archive import get_archive_storage, read_entry
+from apps.chats.models import Dialog, MessageArchiveEntry
+
+RESTORE_SQL = """
+    INSERT INTO chats_message (id, created, modified, text, dialog_id, sender_id)
+    VALUES %s
+    ON CONFLICT DO NOTHING
+"""
+
+
+class Command(BaseCommand):
+    help = "Moves archived messages of the dialogs back to the database. " \
+           "The partitions of the restored months must exist."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dialog_ids', nargs='*', type=int)
+        parser.add_argument('--all', action='store_true', help="Restores every archived dialog")
+
+    def handle(self, *args, **options):
+        dialogs = Dialog.objects.filter(archived_until__isnull=False)
+        if not options['all']:
+            if not options['dialog_ids']:
+                raise CommandError("Pass dialog ids or --all")
+            dialogs = dialogs.filter(pk__in=options['dialog_ids'])
+
+        storage = get_archive_storage()
+        restored, segments = 0, set()
+        for dialog in dialogs.iterator():
+            entries = list(dialog.archive_entries.all())
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    for entry in entries:
+                        rows = [(m.pk, m.created, m.modified, m.text, m.dialog_id, m.sender_id)
+                                for m in read_entry(entry, storage)]
+                        execute_values(cursor, RESTORE_SQL, rows)
+                        restored += entry.count
+                    dialog.archive_entries.all().delete()
+                    Dialog.objects.filter(pk=dialog.pk).update(archived_until=None)
+            except IntegrityError as e:
+                raise CommandError(f"Dialog {dialog.pk} can't be restored: {e}")
+            segments.update(entry.segment for entry in entries)
+
+        # segments are append-only, a file is removed once nothing refers to it
+        referenced = set(MessageArchiveEntry.objects
+                         .filter(segment__in=segments)
+                         .values_list('segment', flat=True))
+        for segment in segments - referenced:
+            storage.delete(segment)
+        self.stdout.write(self.style.SUCCESS(f"{restored} messages are restored"))
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.3 on 2026-10-18 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['dialog', 'created', 'id'], name='chats_msg_dialog_created_idx'),
+        ),
+    ]
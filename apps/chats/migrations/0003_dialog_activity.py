@@ -0,0 +1,55 @@
+# Generated by Django 3.1.3 on 2026-10-18 03:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chats', '0002_message_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dialog',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message'),
+        ),
+        migrations.AddField(
+            model_name='dialog',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DialogMember',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('last_sent_at', models.DateTimeField(blank=True, null=True)),
+                ('last_received_at', models.DateTimeField(blank=True, null=True)),
+                ('dialog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='chats.dialog')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dialog_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dialogmember',
+            index=models.Index(fields=['user', 'last_sent_at'], name='chats_member_last_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dialogmember',
+            index=models.Index(fields=['user', 'last_received_at'], name='chats_member_last_received_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dialogmember',
+            unique_together={('dialog', 'user')},
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.1.3 on 2026-10-18 03:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+# the old flag is set for the whole dialog on read, so the newest read message of the other side is the cursor
+SEED_READ_STATES_SQL = """
+    INSERT INTO chats_dialogreadstate (created, modified, dialog_id, user_id, last_read_message_id, last_read_at)
+    SELECT now(), now(), m.dialog_id, u.user_id, MAX(m.id), MAX(m.modified)
+    FROM chats_message m
+    JOIN chats_dialog d ON d.id = m.dialog_id
+    CROSS JOIN LATERAL unnest(d.users) AS u(user_id)
+    WHERE m.is_read AND m.sender_id <> u.user_id
+    GROUP BY m.dialog_id, u.user_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chats', '0003_dialog_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DialogReadState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('last_read_at', models.DateTimeField(blank=True, null=True)),
+                ('dialog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='chats.dialog')),
+                ('last_read_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+                'unique_together': {('dialog', 'user')},
+            },
+        ),
+        migrations.RunSQL(SEED_READ_STATES_SQL, migrations.RunSQL.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
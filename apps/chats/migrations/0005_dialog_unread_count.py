@@ -0,0 +1,22 @@
+# Generated by Django 3.1.3 on 2026-10-18 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_dialog_read_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dialogmember',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='dialogmember',
+            index=models.Index(condition=models.Q(unread_count__gt=0), fields=['user'], name='chats_member_unread_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.1.3 on 2026-10-18 09:12
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_dialog_unread_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dialog',
+            name='user_low',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dialog',
+            name='user_high',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunSQL(
+            "UPDATE chats_dialog SET user_low = users[1], user_high = users[2]",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name='dialog',
+            name='user_low',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='dialog',
+            name='user_high',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='dialog',
+            name='users',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=2),
+        ),
+        migrations.AddConstraint(
+            model_name='dialog',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='chats_dialog_pair_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='dialog',
+            index=models.Index(fields=['user_high'], name='chats_dialog_user_high_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dialog',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['users'], name='chats_dialog_users_gin_idx'),
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# The existing table becomes the first partition, it covers everything up to the next month. The attach
+# doesn't scan the table because of the validated CHECK constraint, and it reuses the existing indexes.
+# On a large table build the (id, created) index CONCURRENTLY under the same name before migrating:
+#   CREATE UNIQUE INDEX CONCURRENTLY chats_message_legacy_id_created_key ON chats_message (id, created);
+PARTITION_SQL = """
+    ALTER TABLE chats_message RENAME TO chats_message_legacy;
+
+    DO $$
+    DECLARE
+        index_name text;
+        boundary timestamptz := date_trunc('month', now()) + interval '1 month';
+        month timestamptz;
+    BEGIN
+        FOR index_name IN
+            SELECT indexname FROM pg_indexes
+            WHERE tablename = 'chats_message_legacy' AND indexname <> 'chats_message_legacy_id_created_key'
+        LOOP
+            EXECUTE format('ALTER INDEX %I RENAME TO %I', index_name, 'legacy_' || index_name);
+        END LOOP;
+
+        CREATE UNIQUE INDEX IF NOT EXISTS chats_message_legacy_id_created_key ON chats_message_legacy (id, created);
+        ALTER TABLE chats_message_legacy DROP CONSTRAINT legacy_chats_message_pkey;
+        ALTER TABLE chats_message_legacy ADD CONSTRAINT chats_message_legacy_pkey
+            PRIMARY KEY USING INDEX chats_message_legacy_id_created_key;
+        EXECUTE format('ALTER TABLE chats_message_legacy ADD CONSTRAINT chats_message_legacy_created_check '
+                       'CHECK (created < %L) NOT VALID', boundary);
+        ALTER TABLE chats_message_legacy VALIDATE CONSTRAINT chats_message_legacy_created_check;
+
+        CREATE TABLE chats_message (
+            id integer NOT NULL DEFAULT nextval('chats_message_id_seq'),
+            created timestamp with time zone NOT NULL,
+            modified timestamp with time zone NOT NULL,
+            text text NOT NULL,
+            dialog_id integer NOT NULL,
+            sender_id integer NOT NULL,
+            PRIMARY KEY (id, created)
+        ) PARTITION BY RANGE (created);
+        ALTER SEQUENCE chats_message_id_seq OWNED BY chats_message.id;
+        ALTER TABLE chats_message ADD CONSTRAINT chats_message_dialog_id_692b591d_fk_chats_dialog_id
+            FOREIGN KEY (dialog_id) REFERENCES chats_dialog (id) DEFERRABLE INITIALLY DEFERRED;
+        ALTER TABLE chats_message ADD CONSTRAINT chats_message_sender_id_4f3659eb_fk_users_user_id
+            FOREIGN KEY (sender_id) REFERENCES users_user (id) DEFERRABLE INITIALLY DEFERRED;
+        CREATE INDEX chats_message_dialog_id_692b591d ON chats_message (dialog_id);
+        CREATE INDEX chats_message_sender_id_4f3659eb ON chats_message (sender_id);
+        CREATE INDEX chats_msg_dialog_created_idx ON chats_message (dialog_id, created, id);
+
+        EXECUTE format('ALTER TABLE chats_message ATTACH PARTITION chats_message_legacy '
+                       'FOR VALUES FROM (MINVALUE) TO (%L)', boundary);
+        ALTER TABLE chats_message_legacy DROP CONSTRAINT chats_message_legacy_created_check;
+
+        FOR month IN SELECT generate_series(boundary, boundary + interval '2 months', interval '1 month') LOOP
+            EXECUTE format('CREATE TABLE %I PARTITION OF chats_message FOR VALUES FROM (%L) TO (%L)',
+                           'chats_message_p' || to_char(month, 'YYYYMM'), month, month + interval '1 month');
+        END LOOP;
+    END $$;
+"""
+
+UNPARTITION_SQL = """
+    ALTER TABLE chats_message RENAME TO chats_message_partitioned;
+    CREATE TABLE chats_message (LIKE chats_message_partitioned INCLUDING DEFAULTS);
+    INSERT INTO chats_message SELECT * FROM chats_message_partitioned;
+    ALTER SEQUENCE chats_message_id_seq OWNED BY chats_message.id;
+    DROP TABLE chats_message_partitioned;
+
+    ALTER TABLE chats_message ADD CONSTRAINT chats_message_pkey PRIMARY KEY (id);
+    ALTER TABLE chats_message ADD CONSTRAINT chats_message_dialog_id_692b591d_fk_chats_dialog_id
+        FOREIGN KEY (dialog_id) REFERENCES chats_dialog (id) DEFERRABLE INITIALLY DEFERRED;
+    ALTER TABLE chats_message ADD CONSTRAINT chats_message_sender_id_4f3659eb_fk_users_user_id
+        FOREIGN KEY (sender_id) REFERENCES users_user (id) DEFERRABLE INITIALLY DEFERRED;
+    CREATE INDEX chats_message_dialog_id_692b591d ON chats_message (dialog_id);
+    CREATE INDEX chats_message_sender_id_4f3659eb ON chats_message (sender_id);
+    CREATE INDEX chats_msg_dialog_created_idx ON chats_message (dialog_id, created, id);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('chats', '0006_dialog_user_pair'),
+    ]
+
+    operations = [
+        # a partitioned table can't be referenced by a foreign key on `id` alone
+        migrations.AlterField(
+            model_name='dialog',
+            name='last_message',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message'),
+        ),
+        migrations.AlterField(
+            model_name='dialogreadstate',
+            name='last_read_message',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message'),
+        ),
+        migrations.RunSQL(PARTITION_SQL, UNPARTITION_SQL),
+    ]
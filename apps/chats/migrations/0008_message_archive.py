@@ -0,0 +1,45 @@
+# Generated by Django 3.1.3 on 2026-10-18 03:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0007_message_partitioning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dialog',
+            name='archived_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='MessageArchiveEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('segment', models.CharField(max_length=255)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('first_message_id', models.IntegerField()),
+                ('first_created', models.DateTimeField()),
+                ('last_message_id', models.IntegerField()),
+                ('last_created', models.DateTimeField()),
+                ('dialog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_entries', to='chats.dialog')),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='messagearchiveentry',
+            index=models.Index(fields=['dialog', 'last_created', 'last_message_id'], name='chats_archive_dialog_last_idx'),
+        ),
+    ]
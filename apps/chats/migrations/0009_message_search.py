@@ -0,0 +1,44 @@
+# Generated by Django 3.1.3 on 2026-10-18 03:35
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# the trigger is defined on the partitioned table, every partition inherits it
+SEARCH_TRIGGER_SQL = """
+    CREATE FUNCTION chats_message_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := to_tsvector('simple', NEW.text);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER chats_message_search_vector
+    BEFORE INSERT OR UPDATE ON chats_message
+    FOR EACH ROW EXECUTE FUNCTION chats_message_search_vector();
+"""
+
+DROP_SEARCH_TRIGGER_SQL = """
+    DROP TRIGGER chats_message_search_vector ON chats_message;
+    DROP FUNCTION chats_message_search_vector();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0008_message_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunSQL(SEARCH_TRIGGER_SQL, DROP_SEARCH_TRIGGER_SQL),
+        migrations.AddIndex(
+            model_name='message',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='chats_msg_search_idx'),
+        ),
+    ]
@@ -1,65 +1,229 @@
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
-from django.db.models import Max, Q
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models import Case, Exists, F, FloatField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Cast, Greatest, Replace
+from django.utils import timezone
 from django_extensions.db.models import TimeStampedModel
 
+from apps.chats.cache import bump_inbox_versions
+from apps.chats.events import publish_message, publish_read
+from apps.chats.receipts import get_read_buffer
+from apps.mixins import NULLABLE
 from apps.users.models import User
 
+HISTORY_CLOCK_SKEW = timedelta(minutes=5)
+
 
 class DialogQuerySet(models.QuerySet):
+    def for_user(self, user: User):
+        """Dialogs of the user with the per-user columns the serializer needs"""
+        unread_count = DialogMember.objects.filter(dialog=OuterRef('pk'), user=user).values('unread_count')[:1]
+        favorite = FavoriteDialog.objects.filter(dialog=OuterRef('pk'), user=user)
+        return (self
+                .filter(users__contains=[user.pk])
+                .annotate(unread_count=Subquery(unread_count), favorite=Exists(favorite))
+                )
+
     def last_sent(self, user: User, order: str = '-last_sent'):
         return (self
-                .prefetch_related('messages')
-                .annotate(last_sent=Max('messages__created', filter=Q(messages__sender=user)))
+                .filter(members__user=user)
+                .annotate(last_sent=F('members__last_sent_at'))
                 .order_by(order)
                 )
 
     def last_received(self, user: User, order: str = '-last_received'):
         return (self
-                .prefetch_related('messages')
-                .annotate(last_received=Max('messages__created', filter=~Q(messages__sender=user)))
+                .filter(members__user=user)
+                .annotate(last_received=F('members__last_received_at'))
                 .order_by(order)
                 )
 
 
 class DialogManager(models.Manager):
+    # the no-op update makes RETURNING yield the existing row, xmax is 0 only for a freshly inserted one
+    UPSERT_SQL = """
+        WITH dialog AS (
+            INSERT INTO chats_dialog (created, modified, users, user_low, user_high)
+            VALUES (%(now)s, %(now)s, %(users)s, %(user_low)s, %(user_high)s)
+            ON CONFLICT (user_low, user_high) DO UPDATE
+            SET user_low = EXCLUDED.user_low
+            RETURNING *, xmax = 0 AS inserted
+        ), members AS (
+            INSERT INTO chats_dialogmember (created, modified, dialog_id, user_id, unread_count)
+            SELECT %(now)s, %(now)s, dialog.id, member.user_id, 0
+            FROM dialog, unnest(dialog.users) AS member(user_id)
+            WHERE dialog.inserted
+            ON CONFLICT (dialog_id, user_id) DO NOTHING
+        )
+        SELECT * FROM dialog
+    """
+
     def get_queryset(self):
         return DialogQuerySet(self.model, using=self._db)
 
+    def for_user(self, user: User):
+        return self.get_queryset().for_user(user)
+
     def last_sent(self, user: User):
         return self.get_queryset().last_sent(user)
 
     def last_received(self, user: User):
         return self.get_queryset().last_received(user)
 
+    def get_or_create_for(self, *user_ids: int):
+        """Returns the dialog of the users and whether it has been created, concurrent calls get the same dialog"""
+        users = sorted(user_ids)
+        # stamped by the application clock as the messages are, `Dialog.history` compares the two
+        dialog = next(iter(self.raw(self.UPSERT_SQL, {
+            'users': users, 'user_low': users[0], 'user_high': users[-1], 'now': timezone.now(),
+        })))
+        if dialog.inserted:
+            bump_inbox_versions(users)
+        return dialog, dialog.inserted
+
+    @transaction.atomic
+    def send_messages(self, sender: User, items) -> list:
+        """Sends `(dialog, text)` pairs with a single INSERT, the bookkeeping runs once per dialog"""
+        messages = Message.objects.bulk_create([
+            Message(sender_id=sender.pk, dialog=dialog, text=text) for dialog, text in items
+        ])
+        by_dialog = {}
+        for message in messages:
+            by_dialog.setdefault(message.dialog_id, (message.dialog, []))[1].append(message)
+        for dialog, dialog_messages in by_dialog.values():
+            dialog.register_activity(*dialog_messages)
+            for message in dialog_messages:
+                publish_message(dialog, message)
+        return messages
+
 
 class Dialog(TimeStampedModel):
-    users = ArrayField(models.IntegerField(), size=2, unique=True)
+    users = ArrayField(models.IntegerField(), size=2)
+    user_low = models.IntegerField()  # the sorted pair of `users`, kept by `save`
+    user_high = models.IntegerField()
+    # messages are partitioned, their primary key is (id, created) so `id` can't be referenced by a constraint
+    last_message = models.ForeignKey('Message', models.SET_NULL, related_name='+', db_constraint=False, **NULLABLE)
+    last_message_at = models.DateTimeField(**NULLABLE)
+    archived_until = models.DateTimeField(**NULLABLE)  # the newest archived message, older ones are in the archive
 
     objects = DialogManager()
 
+    class Meta(TimeStampedModel.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='chats_dialog_pair_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user_high'], name='chats_dialog_user_high_idx'),
+            GinIndex(fields=['users'], name='chats_dialog_users_gin_idx'),
+        ]
+
     def __str__(self):
         return f"Dialog of {self.users}"
 
     def save(self, *args, **kwargs):
         self.users = sorted(self.users)
-        return super().save(*args, **kwargs)
+        self.user_low, self.user_high = self.users[0], self.users[-1]
+        adding = self._state.adding
+        result = super().save(*args, **kwargs)
+        if adding:
+            DialogMember.objects.bulk_create(
+                [DialogMember(dialog=self, user_id=user_id) for user_id in self.users],
+                ignore_conflicts=True,
+            )
+            bump_inbox_versions(self.users)
+        return result
 
     @property
     def participants(self):
         return User.objects.filter(pk__in=self.users)
 
-    @property
-    def is_favorite(self):
-        return self.favoritedialog_set.exists()
+    def history(self):
+        """Messages of the dialog since its creation, so Postgres skips the partitions of the older months.
+
+        The bound is lowered by `HISTORY_CLOCK_SKEW`, the messages may be stamped by the clock of another node.
+        """
+        messages = self.messages.filter(created__gte=self.created - HISTORY_CLOCK_SKEW)
+        if self.archived_until is not None:
+            messages = messages.filter(created__gt=self.archived_until)
+        return messages
+
+    def is_favorite_for(self, user: User) -> bool:
+        return self.favoritedialog_set.filter(user=user).exists()
 
     def add_to_favorite(self, user: User):
         obj, c = FavoriteDialog.objects.get_or_create(dialog=self, user=user)
+        if c:
+            bump_inbox_versions([user.pk])
         return c
 
+    @transaction.atomic
     def send_message(self, sender: User, text: str):
-        return self.messages.create(sender=sender, dialog=self, text=text)
+        message = self.messages.create(sender_id=sender.pk, dialog=self, text=text)
+        self.register_activity(message)
+        publish_message(self, message)
+        return message
+
+    def register_activity(self, *messages) -> None:
+        """Keeps the denormalized activity columns in step with the new messages of the dialog.
+
+        `created` is set before the INSERT, so concurrent sends may commit out of order: the columns only
+        move forward.
+        """
+        last_sent, last_received, unread = [], [], []
+        for user_id in self.users:
+            sent = [m.created for m in messages if m.sender_id == user_id]
+            received = [m.created for m in messages if m.sender_id != user_id]
+            if sent:
+                latest = Value(max(sent), output_field=models.DateTimeField())
+                last_sent.append(When(user_id=user_id, then=Greatest(F('last_sent_at'), latest)))
+            if received:
+                latest = Value(max(received), output_field=models.DateTimeField())
+                last_received.append(When(user_id=user_id, then=Greatest(F('last_received_at'), latest)))
+                unread.append(When(user_id=user_id, then=F('unread_count') + len(received)))
+        (DialogMember.objects
+         .filter(dialog=self)
+         .update(last_sent_at=Case(*last_sent, default=F('last_sent_at')),
+                 last_received_at=Case(*last_received, default=F('last_received_at')),
+                 unread_count=Case(*unread, default=F('unread_count')),
+                 )
+         )
+        message = max(messages, key=lambda m: (m.created, m.pk))
+        newer = Q(last_message_at__isnull=True) | Q(last_message_at__lt=message.created)
+        if Dialog.objects.filter(newer, pk=self.pk).update(last_message=message, last_message_at=message.created):
+            self.last_message, self.last_message_at = message, message.created
+        bump_inbox_versions(self.users)
+
+
+class DialogMemberQuerySet(models.QuerySet):
+    def unread(self, user: User):
+        return self.filter(user=user, unread_count__gt=0)
+
+
+class DialogMember(TimeStampedModel):
+    """Per-participant state of a dialog, denormalized for the inbox ordering and unread badges"""
+    dialog = models.ForeignKey(Dialog, on_delete=models.CASCADE, related_name='members')
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='dialog_memberships')
+    last_sent_at = models.DateTimeField(**NULLABLE)
+    last_received_at = models.DateTimeField(**NULLABLE)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    objects = DialogMemberQuerySet.as_manager()
+
+    class Meta(TimeStampedModel.Meta):
+        unique_together = ('dialog', 'user')
+        indexes = [
+            models.Index(fields=['user', 'last_sent_at'], name='chats_member_last_sent_idx'),
+            models.Index(fields=['user', 'last_received_at'], name='chats_member_last_received_idx'),
+            models.Index(fields=['user'], condition=Q(unread_count__gt=0), name='chats_member_unread_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.dialog_id}"
 
 
 class FavoriteDialog(TimeStampedModel):
@@ -67,17 +231,189 @@ class FavoriteDialog(TimeStampedModel):
     dialog = models.ForeignKey(Dialog, on_delete=models.CASCADE)
 
 
+class MessageQuerySet(models.QuerySet):
+    def search(self, text: str):
+        """Messages matching a web search style query, annotated with `rank` and the `headline` of the matches.
+
+        The headline is the raw text with the matches between `Message.HEADLINE_START` and `HEADLINE_STOP`,
+        the control characters are removed from the text first, so only the highlighting produces them.
+        """
+        query = SearchQuery(text, config=Message.SEARCH_CONFIG, search_type='websearch')
+        return (self
+                .filter(search_vector=query)
+                .defer('search_vector')
+                # the rank is a float4, the double is kept exactly by the keyset cursor
+                .annotate(rank=Cast(SearchRank(F('search_vector'), query), FloatField()),
+                          # ts_headline is costly, Postgres evaluates it only for the rows of the page
+                          headline=SearchHeadline(
+                              Replace(Replace('text', Value(Message.HEADLINE_START)), Value(Message.HEADLINE_STOP)),
+                              query, config=Message.SEARCH_CONFIG,
+                              start_sel=Message.HEADLINE_START, stop_sel=Message.HEADLINE_STOP,
+                          ))
+                )
+
+
 class Message(TimeStampedModel):
+    SEARCH_CONFIG = 'simple'  # messages are in any language, the words aren't stemmed
+    HEADLINE_START, HEADLINE_STOP = '\x02', '\x03'
+
     sender = models.ForeignKey(get_user_model(), on_delete=models.PROTECT, related_name='sent_messages')
-    is_read = models.BooleanField(default=False)  # must be moved to an additional model for using with group chats
     text = models.TextField()
     dialog = models.ForeignKey(Dialog, models.PROTECT, related_name='messages')
+    search_vector = SearchVectorField(editable=False, **NULLABLE)  # is maintained by a trigger from `text`
+
+    objects = MessageQuerySet.as_manager()
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['dialog', 'created', 'id'], name='chats_msg_dialog_created_idx'),
+            GinIndex(fields=['search_vector'], name='chats_msg_search_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender}'s message to {self.dialog}"
 
-    def mark_as_read(self) -> None:
-        (self.dialog.messages
-         .filter(created__lte=self.created)
-         .update(is_read=True)
-         )
+    def mark_as_read(self, user: User) -> None:
+        DialogReadState.objects.mark_read(dialog=self.dialog, user_id=user.pk, message_id=self.pk)
+
+
+class MessageArchiveEntry(TimeStampedModel):
+    """Archived messages of a dialog, they are `length` bytes at `offset` of the segment file"""
+    dialog = models.ForeignKey(Dialog, on_delete=models.CASCADE, related_name='archive_entries')
+    segment = models.CharField(max_length=255)
+    offset = models.BigIntegerField()
+    length = models.PositiveIntegerField()
+    count = models.PositiveIntegerField()
+    first_message_id = models.IntegerField()
+    first_created = models.DateTimeField()
+    last_message_id = models.IntegerField()
+    last_created = models.DateTimeField()
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['dialog', 'last_created', 'last_message_id'], name='chats_archive_dialog_last_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.count} messages of {self.dialog_id} in {self.segment}"
+
+
+class DialogReadStateManager(models.Manager):
+    # the unread counter is reset only when the newest message of the dialog has been read
+    UPSERT_SQL = """
+        WITH state AS (
+            INSERT INTO chats_dialogreadstate (created, modified, dialog_id, user_id, last_read_message_id, last_read_at)
+            VALUES (now(), now(), %(dialog_id)s, %(user_id)s, %(message_id)s, now())
+            ON CONFLICT (dialog_id, user_id) DO UPDATE
+            SET last_read_message_id = EXCLUDED.last_read_message_id,
+                last_read_at = EXCLUDED.last_read_at,
+                modified = EXCLUDED.modified
+            WHERE chats_dialogreadstate.last_read_message_id IS NULL
+               OR chats_dialogreadstate.last_read_message_id < EXCLUDED.last_read_message_id
+            RETURNING id
+        ), reset AS (
+            UPDATE chats_dialogmember
+            SET unread_count = 0
+            WHERE dialog_id = %(dialog_id)s AND user_id = %(user_id)s AND unread_count > 0
+              AND %(message_id)s >= (SELECT last_message_id FROM chats_dialog WHERE id = %(dialog_id)s)
+            RETURNING id
+        )
+        SELECT EXISTS(SELECT 1 FROM state), EXISTS(SELECT 1 FROM reset)
+    """
+
+    def mark_read(self, dialog: Dialog, user_id: int, message_id: int) -> None:
+        """Moves the read cursor forward and resets the unread counter in one round trip"""
+        with connection.cursor() as cursor:
+            cursor.execute(self.UPSERT_SQL, {'dialog_id': dialog.pk, 'user_id': user_id, 'message_id': message_id})
+            advanced, unread_reset = cursor.fetchone()
+        if unread_reset:
+            bump_inbox_versions([user_id])
+        if advanced:
+            publish_read(dialog, user_id, message_id)
+
+    # the input comes from the read buffer, which holds a single position per (dialog, user)
+    BULK_UPSERT_SQL = """
+        WITH receipt AS (
+            SELECT * FROM unnest(%(dialog_ids)s::int[], %(user_ids)s::int[], %(message_ids)s::int[])
+                AS r(dialog_id, user_id, message_id)
+        ), state AS (
+            INSERT INTO chats_dialogreadstate (created, modified, dialog_id, user_id, last_read_message_id, last_read_at)
+            SELECT now(), now(), dialog_id, user_id, message_id, now() FROM receipt
+            ON CONFLICT (dialog_id, user_id) DO UPDATE
+            SET last_read_message_id = EXCLUDED.last_read_message_id,
+                last_read_at = EXCLUDED.last_read_at,
+                modified = EXCLUDED.modified
+            WHERE chats_dialogreadstate.last_read_message_id IS NULL
+               OR chats_dialogreadstate.last_read_message_id < EXCLUDED.last_read_message_id
+        ), reset AS (
+            UPDATE chats_dialogmember m
+            SET unread_count = 0
+            FROM receipt r JOIN chats_dialog d ON d.id = r.dialog_id
+            WHERE m.dialog_id = r.dialog_id AND m.user_id = r.user_id AND m.unread_count > 0
+              AND r.message_id >= d.last_message_id
+            RETURNING m.user_id
+        )
+        SELECT DISTINCT user_id FROM reset
+    """
+
+    def buffer_read(self, dialog: Dialog, user_id: int, message_id: int) -> None:
+        """Records the read in the read buffer, the database is written by the next flush"""
+        buffer = get_read_buffer()
+        if buffer.record(dialog.pk, user_id, message_id):
+            publish_read(dialog, user_id, message_id)
+        if buffer.flush_due():  # written through, the buffers are otherwise flushed in the background
+            buffer.flush()
+
+    def mark_read_many(self, receipts) -> None:
+        """Writes `(dialog_id, user_id, message_id)` receipts with one statement"""
+        dialog_ids, user_ids, message_ids = zip(*receipts)
+        with connection.cursor() as cursor:
+            cursor.execute(self.BULK_UPSERT_SQL, {
+                'dialog_ids': list(dialog_ids), 'user_ids': list(user_ids), 'message_ids': list(message_ids),
+            })
+            reset = [user_id for user_id, in cursor.fetchall()]
+        if reset:
+            bump_inbox_versions(reset)
+
+    def positions(self, *dialog_ids: int) -> dict:
+        """Returns the last read message id of every participant by dialog: {dialog_id: {user_id: message_id}}
+
+        Buffered reads which haven't been flushed yet are taken into account.
+        """
+        positions = get_read_buffer().get(dialog_ids)
+        states = self.filter(dialog_id__in=dialog_ids).values_list('dialog_id', 'user_id', 'last_read_message_id')
+        for dialog_id, user_id, message_id in states:
+            if message_id is not None:
+                DialogReadState.advance(positions[dialog_id], user_id, message_id)
+            else:
+                positions[dialog_id].setdefault(user_id, None)
+        return positions
+
+
+class DialogReadState(TimeStampedModel):
+    """Read cursor of a participant, messages up to `last_read_message` are read by the user"""
+    dialog = models.ForeignKey(Dialog, on_delete=models.CASCADE, related_name='read_states')
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='read_states')
+    last_read_message = models.ForeignKey(Message, models.SET_NULL, related_name='+', db_constraint=False, **NULLABLE)
+    last_read_at = models.DateTimeField(**NULLABLE)
+
+    objects = DialogReadStateManager()
+
+    class Meta(TimeStampedModel.Meta):
+        unique_together = ('dialog', 'user')
+
+    def __str__(self):
+        return f"{self.user_id} has read {self.dialog_id} up to {self.last_read_message_id}"
+
+    @staticmethod
+    def advance(positions: dict, user_id: int, message_id: int) -> None:
+        """Applies a read which hasn't been written yet to the loaded cursors of a dialog"""
+        positions[user_id] = max(positions.get(user_id) or 0, message_id)
+
+    @staticmethod
+    def is_read(message: Message, positions: dict) -> bool:
+        """A message is read once any participant other than its sender has read past it"""
+        return any(
+            user_id != message.sender_id and position is not None and position >= message.pk
+            for user_id, position in positions.items()
+        )
@@ -0,0 +1,166 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class MessageCursorPagination(BasePagination):
+    """Keyset pagination over ``(created, id)`` of the message history.
+
+    Without a cursor the newest page is returned. ``before`` walks back in the history,
+    ``after`` walks forward from a known message. Every page is a single range scan of
+    the ``(dialog_id, created, id)`` index, so deep pages cost the same as the first one.
+    Messages inside a page are always ordered chronologically.
+
+    When ``archive`` is set (see ``apps.chats.archive.DialogArchive``) pages which run past the
+    hot data are completed with archived messages.
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    before_query_param = 'before'
+    after_query_param = 'after'
+    invalid_cursor_message = 'Invalid cursor'
+    archive = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        before = self.decode_cursor(request.query_params.get(self.before_query_param))
+        after = self.decode_cursor(request.query_params.get(self.after_query_param))
+
+        if after is not None:
+            created, pk = after
+            queryset = (queryset
+                        .filter(Q(created__gt=created) | Q(created=created, id__gt=pk))
+                        .order_by('created', 'id')
+                        )
+            page = list(queryset[:self.page_size + 1])
+            if self.archive is not None:
+                # archived messages are older than every hot one
+                page = (self.archive.after(after, self.page_size + 1) + page)[:self.page_size + 1]
+            self.has_newer = len(page) > self.page_size
+            self.has_older = True
+            page = page[:self.page_size]
+        else:
+            if before is not None:
+                created, pk = before
+                queryset = queryset.filter(Q(created__lt=created) | Q(created=created, id__lt=pk))
+            page = list(queryset.order_by('-created', '-id')[:self.page_size + 1])
+            if self.archive is not None and len(page) <= self.page_size:
+                cursor = (page[-1].created, page[-1].pk) if page else before
+                page += self.archive.before(cursor, self.page_size + 1 - len(page))
+            self.has_older = len(page) > self.page_size
+            self.has_newer = before is not None
+            page = page[:self.page_size]
+            page.reverse()
+
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('before', self.get_before_link()),
+            ('after', self.get_after_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_before_link(self):
+        if not self.page or not self.has_older:
+            return None
+        return self.encode_link(self.before_query_param, self.after_query_param, self.page[0])
+
+    def get_after_link(self):
+        # the link is kept at the head of the history too, so clients can poll for new messages
+        if not self.page:
+            return None
+        return self.encode_link(self.after_query_param, self.before_query_param, self.page[-1])
+
+    def encode_link(self, param, opposite_param, message):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, opposite_param)
+        return replace_query_param(url, param, self.encode_cursor(message))
+
+    @staticmethod
+    def encode_cursor(message) -> str:
+        value = f"{message.created.isoformat()}|{message.pk}"
+        return urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            created, pk = urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+            created = parse_datetime(created)
+            pk = int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created, pk
+
+
+class SearchCursorPagination(BasePagination):
+    """Keyset pagination over ``(rank, id)`` of search results, the best matches first.
+
+    The rank of a message is stable for the same query, so following ``next`` never skips
+    or repeats results while new messages arrive.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request.query_params.get(self.cursor_query_param))
+        if cursor is not None:
+            rank, pk = cursor
+            queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=pk))
+        page = list(queryset.order_by('-rank', '-id')[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        message = self.page[-1]
+        cursor = urlsafe_b64encode(f"{message.rank!r}|{message.pk}".encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            rank, pk = urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+            return float(rank), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
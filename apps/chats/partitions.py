@@ -0,0 +1,82 @@
+"""Monthly range partitions of the message table.
+
+`chats_message` is partitioned by `created`. Future months are created ahead of time by the
+`create_message_partitions` command and old months leave the table with `detach_message_partitions`,
+which is a metadata change instead of a DELETE of millions of rows.
+"""
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+TABLE = 'chats_message'
+
+PARTITIONS_SQL = """
+    SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+    FROM pg_inherits
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE parent.relname = %s
+"""
+
+BOUNDS_RE = re.compile(r"FROM \((?P<start>[^)]+)\) TO \((?P<end>[^)]+)\)")
+
+Partition = namedtuple('Partition', ('name', 'start', 'end'))  # the bounds are None for MINVALUE/MAXVALUE
+
+
+def parse_bound(value: str):
+    if value in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return parse_datetime(value.strip("'"))
+
+
+def month_start(value: datetime, months: int = 0) -> datetime:
+    """The first moment of the month of `value`, shifted by `months`"""
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1, day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_partitions() -> list:
+    """Range partitions of the message table ordered by their upper bound, the default partition is skipped"""
+    with connection.cursor() as cursor:
+        cursor.execute(PARTITIONS_SQL, [TABLE])
+        rows = cursor.fetchall()
+    partitions = []
+    for name, bounds in rows:
+        match = BOUNDS_RE.search(bounds)
+        if match:
+            partitions.append(Partition(name, parse_bound(match['start']), parse_bound(match['end'])))
+    return sorted(partitions, key=lambda p: (p.end is None, p.end or p.start))
+
+
+def create_partitions(months: int, now: datetime = None) -> list:
+    """Makes sure the partitions cover `months` whole months after the current one, returns the new ones"""
+    until = month_start(now or timezone.now(), months + 1)
+    partitions = get_partitions()
+    start = partitions[-1].end if partitions else month_start(now or timezone.now())
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        while start is not None and start < until:
+            end = month_start(start, 1)
+            name = f"{TABLE}_p{start:%Y%m}"
+            cursor.execute(
+                f"CREATE TABLE {connection.ops.quote_name(name)} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)",
+                [start, end],
+            )
+            created.append(name)
+            start = end
+    return created
+
+
+def detach_partitions(before: datetime, drop: bool = False) -> list:
+    """Detaches the partitions which end before `before`, it doesn't touch the rows of the detached tables"""
+    detached = [p.name for p in get_partitions() if p.end is not None and p.end <= before]
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name in detached:
+            cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {connection.ops.quote_name(name)}")
+            if drop:
+                cursor.execute(f"DROP TABLE {connection.ops.quote_name(name)}")
+    return detached
@@ -0,0 +1,203 @@
+import atexit
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BaseReadBuffer:
+    """Keeps the newest read position of every (dialog, user) until it is flushed to the database"""
+
+    def record(self, dialog_id: int, user_id: int, message_id: int) -> bool:
+        """Returns whether the position has moved forward"""
+        raise NotImplementedError
+
+    def get(self, dialog_ids) -> dict:
+        """Buffered positions by dialog: {dialog_id: {user_id: message_id}}"""
+        raise NotImplementedError
+
+    def pending(self, limit: int) -> list:
+        """`(dialog_id, user_id, message_id)` receipts of up to `limit` dialogs waiting for the flush"""
+        raise NotImplementedError
+
+    def discard(self, receipts) -> None:
+        """Forgets the flushed receipts, positions which moved on since are kept for the next flush"""
+        raise NotImplementedError
+
+    def flush_due(self) -> bool:
+        """Whether the caller has to flush, a shared buffer is flushed by the periodic task instead"""
+        return False
+
+    def flush(self, batch_size: int = 1000) -> int:
+        """Writes the buffered positions to the database, one statement per batch of dialogs"""
+        from apps.chats.models import DialogReadState
+
+        flushed = 0
+        while True:
+            receipts = self.pending(batch_size)
+            if receipts:
+                # a failed write keeps the receipts buffered for the retry
+                DialogReadState.objects.mark_read_many(receipts)
+                self.discard(receipts)
+                flushed += len(receipts)
+            if len({dialog_id for dialog_id, _, _ in receipts}) < batch_size:
+                return flushed
+
+
+class InMemoryReadBuffer(BaseReadBuffer):
+    """Buffers inside the current process, no worker can see it, so a thread of the process flushes it.
+
+    The thread flushes every `flush_interval` seconds and once more when the process exits. With
+    `flush_interval` 0 every read is written through instead, tests run this way.
+    """
+
+    def __init__(self, flush_interval: float = None):
+        self._lock = threading.Lock()
+        self._positions = defaultdict(dict)
+        self.flush_interval = settings.CHAT_READ_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._flusher = None
+        self._flusher_pid = None
+        self._stopped = threading.Event()
+
+    def record(self, dialog_id: int, user_id: int, message_id: int) -> bool:
+        with self._lock:
+            current = self._positions[dialog_id].get(user_id)
+            if current is not None and current >= message_id:
+                return False
+            self._positions[dialog_id][user_id] = message_id
+            if self.flush_interval > 0:
+                self.start_flusher()
+            return True
+
+    def get(self, dialog_ids) -> dict:
+        with self._lock:
+            return {dialog_id: dict(self._positions.get(dialog_id, {})) for dialog_id in dialog_ids}
+
+    def pending(self, limit: int) -> list:
+        with self._lock:
+            dialog_ids = [dialog_id for dialog_id, users in self._positions.items() if users][:limit]
+            return [(dialog_id, user_id, message_id)
+                    for dialog_id in dialog_ids
+                    for user_id, message_id in self._positions[dialog_id].items()]
+
+    def discard(self, receipts) -> None:
+        with self._lock:
+            for dialog_id, user_id, message_id in receipts:
+                if self._positions[dialog_id].get(user_id) == message_id:
+                    del self._positions[dialog_id][user_id]
+                if not self._positions[dialog_id]:
+                    del self._positions[dialog_id]
+
+    def flush_due(self) -> bool:
+        return self.flush_interval <= 0
+
+    def start_flusher(self) -> None:
+        # a thread started before a fork doesn't run in the child, the pid tells
+        if self._flusher is not None and self._flusher_pid == os.getpid():
+            return
+        self._stopped.clear()
+        self._flusher = threading.Thread(target=self.run_flusher, name='read-receipts-flusher', daemon=True)
+        self._flusher_pid = os.getpid()
+        self._flusher.start()
+        atexit.register(self.stop)
+
+    def run_flusher(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush the read receipts, they are kept for the next flush")
+            finally:
+                connection.close()  # the thread's own connection, it mustn't stay open between the flushes
+
+    def stop(self, flush: bool = True) -> None:
+        """Stops the flusher thread and writes what is left, it runs at the exit of the process"""
+        atexit.unregister(self.stop)
+        with self._lock:
+            flusher, self._flusher = self._flusher, None
+        if flusher is None:
+            return
+        self._stopped.set()
+        if flusher.is_alive():
+            flusher.join()
+        if flush:
+            self.flush()
+
+
+class RedisReadBuffer(BaseReadBuffer):
+    """A hash of positions per dialog and a set of the dialogs waiting for the flush"""
+    key_prefix = 'chats:reads:'
+    dirty_key = 'chats:reads:dirty'
+
+    # keeps the highest position only, so repeated and late reads are no-ops
+    RECORD_SCRIPT = """
+        local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]))
+        if current and current >= tonumber(ARGV[2]) then
+            return 0
+        end
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+        redis.call('SADD', KEYS[2], ARGV[3])
+        return 1
+    """
+
+    # removes a flushed position unless a newer one has been recorded in the meantime
+    DISCARD_SCRIPT = """
+        if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+            redis.call('HDEL', KEYS[1], ARGV[1])
+        end
+        if redis.call('HLEN', KEYS[1]) == 0 then
+            redis.call('SREM', KEYS[2], ARGV[3])
+        end
+    """
+
+    def __init__(self, url: str = None):
+        import redis
+        self.redis = redis.Redis.from_url(url or settings.REDIS_URL)
+        self.record_script = self.redis.register_script(self.RECORD_SCRIPT)
+        self.discard_script = self.redis.register_script(self.DISCARD_SCRIPT)
+
+    def get_key(self, dialog_id: int) -> str:
+        return f'{self.key_prefix}{dialog_id}'
+
+    def record(self, dialog_id: int, user_id: int, message_id: int) -> bool:
+        keys = [self.get_key(dialog_id), self.dirty_key]
+        return bool(self.record_script(keys=keys, args=[user_id, message_id, dialog_id]))
+
+    def get(self, dialog_ids) -> dict:
+        dialog_ids = list(dialog_ids)
+        pipe = self.redis.pipeline(transaction=False)
+        for dialog_id in dialog_ids:
+            pipe.hgetall(self.get_key(dialog_id))
+        return {
+            dialog_id: {int(user_id): int(message_id) for user_id, message_id in positions.items()}
+            for dialog_id, positions in zip(dialog_ids, pipe.execute())
+        }
+
+    def pending(self, limit: int) -> list:
+        dialog_ids = [int(dialog_id) for dialog_id in self.redis.srandmember(self.dirty_key, limit)]
+        return [(dialog_id, user_id, message_id)
+                for dialog_id, positions in self.get(dialog_ids).items()
+                for user_id, message_id in positions.items()]
+
+    def discard(self, receipts) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        for dialog_id, user_id, message_id in receipts:
+            self.discard_script(keys=[self.get_key(dialog_id), self.dirty_key],
+                                args=[user_id, message_id, dialog_id], client=pipe)
+        pipe.execute()
+
+
+_buffer = None
+
+
+def get_read_buffer() -> BaseReadBuffer:
+    global _buffer
+    if _buffer is None:
+        _buffer = import_string(settings.CHAT_READ_BUFFER)()
+    return _buffer
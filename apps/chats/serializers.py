@@ -1,41 +1,152 @@
 from django.contrib.auth import get_user_model
+from django.db import models
+from django.utils.html import escape
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from apps.chats.models import Message, Dialog
+from apps.chats.models import Message, Dialog, DialogMember, DialogReadState
+from apps.users.cache import get_profiles
 from apps.users.serializers import UserSerializer
 
 
+class DialogListSerializer(serializers.ListSerializer):
+    """Loads participants of the whole page with one cache read instead of one query per dialog"""
+    def to_representation(self, data):
+        dialogs = list(data.all() if isinstance(data, models.Manager) else data)
+        self.context['participants'] = get_profiles(user_id for dialog in dialogs for user_id in dialog.users)
+        return super().to_representation(dialogs)
+
+
 class DialogSerializer(serializers.ModelSerializer):
     user_id = serializers.IntegerField(write_only=True)
-    participants = UserSerializer(many=True, read_only=True)
+    participants = serializers.SerializerMethodField()
     is_favorite = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Dialog
-        fields = ('id', 'participants', 'users', 'user_id', 'is_favorite',)
+        fields = ('id', 'participants', 'users', 'user_id', 'is_favorite', 'unread_count',)
         extra_kwargs = {
             'users': {'write_only': True, 'required': False},
         }
+        list_serializer_class = DialogListSerializer
+
+    def validate_user_id(self, value):
+        # the upsert writes the members with raw SQL, an unknown id would fail on their foreign key
+        if value == self.context['request'].user.pk:
+            raise ValidationError("A dialog needs another user.")
+        if not get_user_model().objects.filter(pk=value).exists():
+            raise ValidationError(f"User {value} is not found.")
+        return value
 
     def create(self, validated_data):
+        """Returns the existing dialog of the pair instead of failing on the unique constraint"""
         creator_id = self.context['request'].user.pk
-        user_id = validated_data.pop('user_id')
-        validated_data['users'] = [creator_id, user_id]
-        return super().create(validated_data)
+        dialog, self.created = Dialog.objects.get_or_create_for(creator_id, validated_data['user_id'])
+        return dialog
+
+    def get_participants(self, obj):
+        profiles = self.context.get('participants')  # is filled by DialogListSerializer
+        if profiles is None:
+            profiles = get_profiles(obj.users)
+        return [profiles[pk] for pk in obj.users if pk in profiles]
 
     def get_is_favorite(self, obj):
-        return obj.is_favorite  # must be prefetched in queryset
+        if hasattr(obj, 'favorite'):  # annotated in the dialogs queryset
+            return obj.favorite
+        request = self.context.get('request')
+        if request is None:
+            return None
+        return obj.is_favorite_for(request.user)
+
+    def get_unread_count(self, obj):
+        if hasattr(obj, 'unread_count'):  # annotated in the dialogs queryset
+            return obj.unread_count
+        request = self.context.get('request')
+        if request is None:
+            return None
+        member = DialogMember.objects.filter(dialog=obj, user=request.user).values_list('unread_count', flat=True)
+        return member.first() or 0
 
 
 class SendMessageSerializer(serializers.Serializer):
     text = serializers.CharField(required=True)
 
 
+class BatchMessageSerializer(serializers.Serializer):
+    dialog_id = serializers.IntegerField(required=True)
+    text = serializers.CharField(required=True)
+
+
+class SendBatchSerializer(serializers.Serializer):
+    MAX_MESSAGES = 100
+
+    messages = BatchMessageSerializer(many=True, allow_empty=False)
+
+    def validate_messages(self, value):
+        if len(value) > self.MAX_MESSAGES:
+            raise ValidationError(f"Ensure this field has no more than {self.MAX_MESSAGES} elements.")
+        user = self.context['request'].user
+        dialog_ids = {item['dialog_id'] for item in value}
+        dialogs = Dialog.objects.filter(pk__in=dialog_ids, users__contains=[user.pk]).in_bulk()
+        unknown = dialog_ids - set(dialogs)
+        if unknown:
+            raise ValidationError(f"Dialogs {sorted(unknown)} are not found")
+        return [(dialogs[item['dialog_id']], item['text']) for item in value]
+
+
+class MessageListSerializer(serializers.ListSerializer):
+    """Loads read cursors of all dialogs on the page with one query"""
+    def to_representation(self, data):
+        messages = list(data.all() if isinstance(data, models.Manager) else data)
+        if 'read_positions' not in self.context:
+            dialog_ids = {message.dialog_id for message in messages}
+            self.context['read_positions'] = DialogReadState.objects.positions(*dialog_ids)
+        return super().to_representation(messages)
+
+
 class MessageSerializer(serializers.ModelSerializer):
-    sender = UserSerializer(read_only=True)
-    dialog = DialogSerializer(read_only=True)
+    """Compact message, the referenced users are side-loaded once per response"""
+    sender_id = serializers.IntegerField(read_only=True)
+    dialog_id = serializers.IntegerField(read_only=True)
+    is_read = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
+        fields = ('id', 'sender_id', 'dialog_id', 'text', 'is_read', 'created',)
+        list_serializer_class = MessageListSerializer
+
+    def get_is_read(self, obj):
+        positions = self.context.get('read_positions')  # is filled by MessageListSerializer
+        if positions is None:
+            positions = DialogReadState.objects.positions(obj.dialog_id)
+        return DialogReadState.is_read(obj, positions.get(obj.dialog_id, {}))
+
+
+class MessageSearchSerializer(MessageSerializer):
+    """Search result, `headline` is the HTML escaped text with the matches wrapped in <mark> tags"""
+    rank = serializers.FloatField(read_only=True)
+    headline = serializers.SerializerMethodField()
+
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ('rank', 'headline',)
+
+    def get_headline(self, obj):
+        # the markup is added after escaping, the text of the message can't add its own
+        return (escape(obj.headline)
+                .replace(Message.HEADLINE_START, '<mark>')
+                .replace(Message.HEADLINE_STOP, '</mark>'))
+
+
+class MessageDetailSerializer(MessageSerializer):
+    """Message with the sender and the dialog nested, it is expensive and must be requested explicitly"""
+    sender = UserSerializer(read_only=True)
+    dialog = DialogSerializer(read_only=True)
+
+    class Meta(MessageSerializer.Meta):
         fields = ('id', 'sender', 'dialog', 'text', 'is_read', 'created',)
+
+
+def get_users_map(user_ids) -> dict:
+    """Serialized users keyed by id, they are side-loaded next to compact messages"""
+    return get_profiles(user_ids)
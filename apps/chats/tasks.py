@@ -0,0 +1,28 @@
+from celery import shared_task
+from django.db import OperationalError
+
+from apps.chats.broker import get_broker, get_user_channel
+from apps.chats.partitions import create_partitions
+from apps.chats.receipts import get_read_buffer
+
+
+@shared_task(autoretry_for=(OperationalError,), retry_backoff=True, max_retries=5)
+def flush_read_receipts(batch_size: int = 1000) -> int:
+    """Writes the buffered read positions to the database, one statement per batch of dialogs"""
+    return get_read_buffer().flush(batch_size)
+
+
+@shared_task(bind=True, max_retries=5)
+def publish_event(self, user_ids: list, event: dict) -> None:
+    """Fans a realtime event out to the channels of the users"""
+    broker = get_broker()
+    try:
+        for user_id in user_ids:
+            broker.publish(get_user_channel(user_id), event)
+    except broker.errors as e:
+        raise self.retry(exc=e, countdown=2 ** self.request.retries)
+
+
+@shared_task
+def create_message_partitions(months: int = 3) -> list:
+    return create_partitions(months)
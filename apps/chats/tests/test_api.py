@@ -1,12 +1,25 @@
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from django.utils import timezone
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase, APIClient
 
-from apps.chats.models import Dialog
+from apps.chats.models import Dialog, DialogMember, DialogReadState, Message
+from apps.chats.receipts import InMemoryReadBuffer
+from apps.chats.tasks import flush_read_receipts
+from apps.users.cache import get_profile_key
+from apps.users.serializers import UserSerializer
 from apps.users.tests.factories import UserFactory
 
 
 class TestChats(APITestCase):
     def setUp(self) -> None:
+        cache.clear()
         self.client = APIClient()
         self.user = UserFactory()
         self.client.force_authenticate(user=self.user)
@@ -26,6 +39,84 @@ class TestChats(APITestCase):
         assert self.user.pk in dialog.users
         assert friend.pk in dialog.users
 
+    def test_create_existing_dialog(self):
+        friend = UserFactory()
+        dialog = Dialog.objects.create(users=[friend.pk, self.user.pk])
+        assert (dialog.user_low, dialog.user_high) == tuple(sorted([friend.pk, self.user.pk]))
+        response = self.client.post(reverse('dialogs-list'), data={'user_id': friend.pk}, format='json')
+        assert response.status_code == 200
+        assert response.data['id'] == dialog.pk
+        assert Dialog.objects.count() == 1
+
+    def test_create_dialog_with_invalid_user(self):
+        for user_id in (self.user.pk, 999999):
+            response = self.client.post(reverse('dialogs-list'), data={'user_id': user_id}, format='json')
+            assert response.status_code == 400
+            assert 'user_id' in response.data
+        assert Dialog.objects.count() == 0
+
+    def test_create_dialog_members(self):
+        friend = UserFactory()
+        dialog, created = Dialog.objects.get_or_create_for(friend.pk, self.user.pk)
+        assert created
+        assert dialog.users == sorted([friend.pk, self.user.pk])
+        assert set(dialog.members.values_list('user_id', flat=True)) == {friend.pk, self.user.pk}
+        assert Dialog.objects.get_or_create_for(self.user.pk, friend.pk) == (dialog, False)
+
+    def test_save_creates_member_per_participant(self):
+        friend = UserFactory()
+        dialog = Dialog.objects.create(users=[friend.pk, self.user.pk])
+        dialog.save()
+        members = list(DialogMember.objects.filter(dialog=dialog).values_list('user_id', flat=True))
+        assert sorted(members) == sorted([friend.pk, self.user.pk])
+
+    def test_activity_moves_forward(self):
+        friend = UserFactory()
+        dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+        created = timezone.now()
+        newer = dialog.send_message(sender=friend, text="Committed first")
+        # a concurrent send stamped earlier which commits later
+        older = Message.objects.create(sender_id=friend.pk, dialog=dialog, text="Sent first")
+        Message.objects.filter(pk=older.pk).update(created=created)
+        older.created = created
+        dialog.register_activity(older)
+        dialog.refresh_from_db()
+        assert (dialog.last_message_id, dialog.last_message_at) == (newer.pk, newer.created)
+        member = DialogMember.objects.get(dialog=dialog, user=self.user)
+        assert member.last_received_at == newer.created
+        assert member.unread_count == 2
+        assert DialogMember.objects.get(dialog=dialog, user=friend).last_sent_at == newer.created
+
+    def test_backfill_dialog_activity(self):
+        friend, other = UserFactory.create_batch(2)
+        dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+        dialog.send_message(sender=self.user, text="Hi")
+        dialog.send_message(sender=friend, text="Hello")
+        last = dialog.send_message(sender=self.user, text="How are you?")
+        Dialog.objects.create(users=[self.user.pk, other.pk])
+        # the state of the dialogs created before the denormalized columns
+        DialogMember.objects.all().delete()
+        Dialog.objects.update(last_message=None, last_message_at=None)
+
+        call_command('backfill_dialog_activity', batch_size=1, stdout=StringIO())
+        dialog.refresh_from_db()
+        assert (dialog.last_message_id, dialog.last_message_at) == (last.pk, last.created)
+        hello = dialog.messages.get(text="Hello")
+        member = DialogMember.objects.get(dialog=dialog, user=self.user)
+        assert (member.last_sent_at, member.last_received_at) == (last.created, hello.created)
+        member = DialogMember.objects.get(dialog=dialog, user=friend)
+        assert (member.last_sent_at, member.last_received_at) == (hello.created, last.created)
+        empty = Dialog.objects.get(users=sorted([self.user.pk, other.pk]))
+        assert empty.last_message_id is None
+        assert empty.members.filter(last_sent_at=None, last_received_at=None).count() == 2
+        assert DialogMember.objects.count() == 4
+
+        call_command('backfill_dialog_activity', stdout=StringIO())
+        assert DialogMember.objects.count() == 4
+        call_command('reconcile_unread_counters', stdout=StringIO())
+        counters = dict(dialog.members.values_list('user_id', 'unread_count'))
+        assert counters == {self.user.pk: 1, friend.pk: 2}
+
     def test_get_last_sent_dialogs(self):
         friends = UserFactory.create_batch(10)
         dialogs = []
@@ -57,3 +148,248 @@ class TestChats(APITestCase):
         data = response.data['results']
         assert 200
         assert data[0]['id'] == dialog.pk
+
+    def test_get_messages_of_empty_dialog(self):
+        friend = UserFactory()
+        dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+        response = self.client.get(reverse('dialogs-messages', kwargs={'pk': dialog.pk}))
+        assert response.status_code == 200
+        assert response.data['results'] == []
+        assert not DialogReadState.objects.exists()
+
+    def test_get_messages_pagination(self):
+        friend = UserFactory()
+        dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+        sent = [dialog.send_message(sender=friend, text=f"Message {i}") for i in range(5)]
+        url = reverse('dialogs-messages', kwargs={'pk': dialog.pk})
+        response = self.client.get(f"{url}?page_size=2")
+        assert response.status_code == 200
+        assert [m['id'] for m in response.data['results']] == [sent[3].pk, sent[4].pk]
+        assert response.data['before']
+        assert set(response.data['users']) == {self.user.pk, friend.pk}
+        response = self.client.get(response.data['before'])
+        assert [m['id'] for m in response.data['results']] == [sent[1].pk, sent[2].pk]
+        response = self.client.get(response.data['before'])
+        assert [m['id'] for m in response.data['results']] == [sent[0].pk]
+        assert response.data['before'] is None
+        response = self.client.get(response.data['after'])
+        assert [m['id'] for m in response.data['results']] == [sent[1].pk, sent[2].pk]
+
+    def test_get_messages_marks_dialog_as_read(self):
+        friend = UserFactory()
+        dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+        own = dialog.send_message(sender=self.user, text="Hi")
+        received = dialog.send_message(sender=friend, text="Hello")
+        url = reverse('dialogs-messages', kwargs={'pk': dialog.pk})
+        response = self.client.get(url)
+        assert response.status_code == 200
+        is_read = {m['id']: m['is_read'] for m in response.data['results']}
+        assert is_read == {own.pk: False, received.pk: True}
+        state = DialogReadState.objects.get(dialog=dialog, user=self.user)
+        assert state.last_read_message_id == received.pk
+        older = dialog.messages.order_by('created').first()
+        older.mark_as_read(self.user)
+        state.refresh_from_db()
+        assert state.last_read_message_id == received.pk
+
+    def test_read_receipts_buffer(self):
+        friend = UserFactory()
+        dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+        first = dialog.send_message(sender=friend, text="Hello")
+        url = reverse('dialogs-messages', kwargs={'pk': dialog.pk})
+        buffer = InMemoryReadBuffer(flush_interval=60)
+        self.addCleanup(buffer.stop, flush=False)
+        with patch('apps.chats.models.get_read_buffer', return_value=buffer), \
+                patch('apps.chats.tasks.get_read_buffer', return_value=buffer):
+            for _ in range(3):
+                self.client.get(url)
+            last = dialog.send_message(sender=friend, text="Are you there?")
+            self.client.get(url)
+            assert not buffer.record(dialog.pk, self.user.pk, first.pk)  # only the highest position is kept
+            assert not DialogReadState.objects.exists()
+            assert DialogReadState.objects.positions(dialog.pk) == {dialog.pk: {self.user.pk: last.pk}}
+
+            assert flush_read_receipts() == 1
+            state = DialogReadState.objects.get()
+            assert (state.user_id, state.last_read_message_id) == (self.user.pk, last.pk)
+            assert DialogMember.objects.get(dialog=dialog, user=self.user).unread_count == 0
+            assert buffer.pending(100) == []
+
+    def test_unread_counters(self):
+        friend = UserFactory()
+        dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+        dialog.send_message(sender=friend, text="Hello")
+        dialog.send_message(sender=friend, text="Are you here?")
+        dialog.send_message(sender=self.user, text="Yes")
+        response = self.client.get(reverse('dialogs-unread'))
+        assert response.status_code == 200
+        assert response.data == {'total': 2, 'dialogs': {dialog.pk: 2}}
+        response = self.client.get(reverse('dialogs-list'))
+        assert response.data['results'][0]['unread_count'] == 2
+        self.client.get(reverse('dialogs-messages', kwargs={'pk': dialog.pk}))
+        response = self.client.get(reverse('dialogs-unread'))
+        assert response.data == {'total': 0, 'dialogs': {}}
+        DialogMember.objects.filter(dialog=dialog).update(unread_count=7)
+        dialog.send_message(sender=friend, text="Bye")
+        call_command('reconcile_unread_counters', stdout=StringIO())
+        counters = dict(DialogMember.objects.filter(dialog=dialog).values_list('user_id', 'unread_count'))
+        assert counters == {self.user.pk: 1, friend.pk: 1}
+
+    def test_dialogs_list_query_count(self):
+        friends = UserFactory.create_batch(5)
+        for friend in friends:
+            dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+            dialog.add_to_favorite(self.user)
+            dialog.send_message(sender=friend, text=f"{friend}'s message")
+        with self.assertNumQueries(3):  # count, dialogs, participants missed in the cache
+            response = self.client.get(reverse('dialogs-list'))
+        assert len(response.data['results']) == 5
+        assert all(dialog['is_favorite'] for dialog in response.data['results'])
+        assert all(len(dialog['participants']) == 2 for dialog in response.data['results'])
+        with self.assertNumQueries(2):  # participants are cached
+            self.client.get(f"{reverse('dialogs-list')}?last_sent=true")
+        friends[0].first_name = 'Renamed'
+        friends[0].save()
+        response = self.client.get(reverse('dialogs-list'))
+        names = {p['first_name'] for dialog in response.data['results'] for p in dialog['participants']}
+        assert 'Renamed' in names
+
+    def test_profile_update_invalidates_cache(self):
+        friend = UserFactory(first_name='Old')
+        Dialog.objects.create(users=[self.user.pk, friend.pk])
+        self.client.get(reverse('dialogs-list'))
+        assert cache.get(get_profile_key(friend.pk))['first_name'] == 'Old'
+
+        friend.save(update_fields=['last_login'])  # not a profile field, the entry is kept
+        assert cache.get(get_profile_key(friend.pk)) is not None
+        serializer = UserSerializer(friend, data={'first_name': 'New'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        assert cache.get(get_profile_key(friend.pk)) is None
+        response = self.client.get(reverse('dialogs-list'))
+        participants = {p['id']: p for p in response.data['results'][0]['participants']}
+        assert participants[friend.pk]['first_name'] == 'New'
+
+    def test_get_messages_query_count(self):
+        friend = UserFactory()
+        dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+        for i in range(10):
+            dialog.send_message(sender=friend if i % 2 else self.user, text=f"Message {i}")
+        url = reverse('dialogs-messages', kwargs={'pk': dialog.pk})
+        buffer = InMemoryReadBuffer(flush_interval=60)
+        self.addCleanup(buffer.stop, flush=False)
+        with patch('apps.chats.models.get_read_buffer', return_value=buffer):
+            with self.assertNumQueries(4):  # dialog, page, read cursors, users
+                response = self.client.get(url)
+            assert buffer.get([dialog.pk]) == {dialog.pk: {self.user.pk: dialog.last_message_id}}
+            assert not DialogReadState.objects.filter(user=self.user).exists()  # the read is left to the flush
+            assert all(m['is_read'] for m in response.data['results'] if m['sender_id'] == friend.pk)
+        assert response.data['results'][0]['sender_id'] == self.user.pk
+        assert response.data['results'][0]['dialog_id'] == dialog.pk
+        response = self.client.get(f"{url}?verbose=true")
+        assert response.data['results'][0]['sender']['id'] == self.user.pk
+        assert response.data['results'][0]['dialog']['id'] == dialog.pk
+
+    def test_dialogs_list_cache(self):
+        friend = UserFactory()
+        dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+        dialog.send_message(sender=friend, text="Hello")
+        response = self.client.get(reverse('dialogs-list'))
+        assert response.data['results'][0]['unread_count'] == 1
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('dialogs-list'))
+        assert cached.data == response.data
+        dialog.send_message(sender=friend, text="Are you here?")
+        response = self.client.get(reverse('dialogs-list'))
+        assert response.data['results'][0]['unread_count'] == 2
+        self.client.get(reverse('dialogs-messages', kwargs={'pk': dialog.pk}))
+        response = self.client.get(reverse('dialogs-list'))
+        assert response.data['results'][0]['unread_count'] == 0
+
+    def test_send_messages_batch(self):
+        friends = UserFactory.create_batch(2)
+        dialogs = [Dialog.objects.create(users=[self.user.pk, friend.pk]) for friend in friends]
+        stranger_dialog = Dialog.objects.create(users=[friends[0].pk, friends[1].pk])
+        url = reverse('messages-batch')
+        payload = [{'dialog_id': dialogs[i % 2].pk, 'text': f"Message {i}"} for i in range(5)]
+        with self.assertNumQueries(8):  # membership, savepoint, insert, 2 updates per dialog, release
+            response = self.client.post(url, data={'messages': payload}, format='json')
+        assert response.status_code == 201
+        assert [m['dialog_id'] for m in response.data['results']] == [item['dialog_id'] for item in payload]
+        counters = dict(DialogMember.objects.filter(user=friends[0]).values_list('dialog_id', 'unread_count'))
+        assert counters[dialogs[0].pk] == 3
+        dialogs[1].refresh_from_db()
+        assert dialogs[1].last_message_id == response.data['results'][3]['id']
+        payload = [{'dialog_id': stranger_dialog.pk, 'text': "Hi"}]
+        response = self.client.post(url, data={'messages': payload}, format='json')
+        assert response.status_code == 400
+
+    def test_search_messages(self):
+        friend, stranger = UserFactory.create_batch(2)
+        dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+        other_dialog = Dialog.objects.create(users=[friend.pk, stranger.pk])
+        matches = [dialog.send_message(sender=friend, text=f"Pizza tonight {i}?") for i in range(3)]
+        best = dialog.send_message(sender=self.user, text="pizza pizza pizza")
+        dialog.send_message(sender=friend, text="Something else")
+        other_dialog.send_message(sender=stranger, text="Pizza for strangers")
+
+        url = reverse('dialogs-search')
+        response = self.client.get(f"{url}?q=pizza&page_size=2")
+        assert response.status_code == 200
+        assert response.data['results'][0]['id'] == best.pk
+        assert response.data['results'][0]['headline'] == "<mark>pizza</mark> <mark>pizza</mark> <mark>pizza</mark>"
+        assert set(response.data['users']) <= {self.user.pk, friend.pk}
+        received = [m['id'] for m in response.data['results']]
+        response = self.client.get(response.data['next'])
+        received += [m['id'] for m in response.data['results']]
+        assert response.data['next'] is None
+        assert sorted(received) == sorted([m.pk for m in matches] + [best.pk])
+
+        response = self.client.get(f"{url}?q=pizza -tonight&dialog={dialog.pk}")
+        assert [m['id'] for m in response.data['results']] == [best.pk]
+        assert self.client.get(url).status_code == 400
+
+    def test_search_headline_is_escaped(self):
+        friend = UserFactory()
+        dialog = Dialog.objects.create(users=[self.user.pk, friend.pk])
+        dialog.send_message(sender=friend, text="<script>alert(1)</script> pizza <img src=x onerror=alert(1)>")
+        dialog.send_message(sender=friend, text="\x02pasta\x03 & pizza")
+        response = self.client.get(f"{reverse('dialogs-search')}?q=pizza")
+        headlines = sorted(m['headline'] for m in response.data['results'])
+        # ts_headline drops well-formed tags itself, but not all of them
+        assert headlines == [
+            " alert(1)  <mark>pizza</mark> &lt;img src=x onerror=alert(1)&gt;",
+            "pasta &amp; <mark>pizza</mark>",
+        ]
+
+
+class TestReadReceiptsFlusher(TransactionTestCase):
+    """The flusher thread has its own connection, so the data must be committed"""
+
+    def test_single_read_is_flushed(self):
+        user, friend = UserFactory.create_batch(2)
+        dialog = Dialog.objects.create(users=[user.pk, friend.pk])
+        dialog.send_message(sender=friend, text="Hello")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        buffer = InMemoryReadBuffer(flush_interval=0.05)
+        self.addCleanup(buffer.stop, flush=False)
+        with patch('apps.chats.models.get_read_buffer', return_value=buffer):
+            client.get(reverse('dialogs-messages', kwargs={'pk': dialog.pk}))
+            assert not DialogReadState.objects.exists()  # the request itself doesn't write
+            member = DialogMember.objects.filter(dialog=dialog, user=user)
+            deadline = time.monotonic() + 5
+            while member.get().unread_count and time.monotonic() < deadline:
+                time.sleep(0.05)
+        assert member.get().unread_count == 0
+        assert buffer.pending(100) == []
+
+    def test_stop_flushes(self):
+        user, friend = UserFactory.create_batch(2)
+        dialog = Dialog.objects.create(users=[user.pk, friend.pk])
+        message = dialog.send_message(sender=friend, text="Hello")
+        buffer = InMemoryReadBuffer(flush_interval=60)
+        with patch('apps.chats.models.get_read_buffer', return_value=buffer):
+            DialogReadState.objects.buffer_read(dialog, user.pk, message.pk)
+            buffer.stop()
+        assert DialogReadState.objects.get().last_read_message_id == message.pk
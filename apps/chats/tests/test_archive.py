@@ -0,0 +1,93 @@
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient, APITestCase
+
+from apps.chats.archive import read_entry
+from apps.chats.models import Dialog, Message, MessageArchiveEntry
+from apps.users.tests.factories import UserFactory
+
+
+class TestMessageArchive(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.location = tempfile.TemporaryDirectory()
+        settings_override = override_settings(CHAT_ARCHIVE_LOCATION=self.location.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(self.location.cleanup)
+
+        self.user, self.friend = UserFactory.create_batch(2)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.dialog = Dialog.objects.create(users=[self.user.pk, self.friend.pk])
+        self.sent = [self.dialog.send_message(sender=self.friend, text=f"Message {i}") for i in range(10)]
+        # the first six messages are a year old
+        old = timezone.now() - timedelta(days=365)
+        Dialog.objects.filter(pk=self.dialog.pk).update(created=old - timedelta(days=1))
+        for i, message in enumerate(self.sent[:6]):
+            Message.objects.filter(pk=message.pk).update(created=old + timedelta(minutes=i))
+
+    def archive(self):
+        call_command('archive_messages', older_than_days=30, stdout=StringIO())
+
+    def test_archive(self):
+        self.archive()
+        assert list(Message.objects.values_list('pk', flat=True).order_by('pk')) == [m.pk for m in self.sent[6:]]
+        entry = MessageArchiveEntry.objects.get(dialog=self.dialog)
+        assert entry.count == 6
+        assert (entry.first_message_id, entry.last_message_id) == (self.sent[0].pk, self.sent[5].pk)
+        assert os.path.exists(os.path.join(self.location.name, entry.segment))
+        self.dialog.refresh_from_db()
+        assert self.dialog.archived_until == entry.last_created
+        assert self.dialog.last_message_id == self.sent[-1].pk
+
+    def test_archive_is_streamed(self):
+        other = Dialog.objects.create(users=[self.user.pk, UserFactory().pk])
+        other_sent = [other.send_message(sender=self.user, text="Old " * 50) for _ in range(5)]
+        old = timezone.now() - timedelta(days=100)
+        Dialog.objects.filter(pk=other.pk).update(created=old - timedelta(days=1))
+        Message.objects.filter(dialog=other).update(created=old)
+        # the fetched chunks split the dialogs and the segment is spilled to disk
+        with patch('apps.chats.management.commands.archive_messages.MESSAGES_CHUNK_SIZE', 4), \
+                patch('apps.chats.archive.SEGMENT_SPOOL_SIZE', 100):
+            self.archive()
+        entries = {entry.dialog_id: entry for entry in MessageArchiveEntry.objects.all()}
+        assert entries[other.pk].segment == entries[self.dialog.pk].segment
+        assert [m.pk for m in read_entry(entries[self.dialog.pk])] == [m.pk for m in self.sent[:6]]
+        assert [m.text for m in read_entry(entries[other.pk])] == [m.text for m in other_sent]
+
+    def test_history_reads_through_the_archive(self):
+        self.archive()
+        url = reverse('dialogs-messages', kwargs={'pk': self.dialog.pk})
+        received = []
+        response = self.client.get(f"{url}?page_size=4")
+        while True:
+            assert response.status_code == 200
+            received = [m['id'] for m in response.data['results']] + received
+            if not response.data['before']:
+                break
+            response = self.client.get(response.data['before'])
+        assert received == [m.pk for m in self.sent]
+
+        # walking forward from an archived message crosses into the hot data
+        response = self.client.get(response.data['after'].replace('page_size=4', 'page_size=6'))
+        assert [m['id'] for m in response.data['results']] == [m.pk for m in self.sent[2:8]]
+
+    def test_restore(self):
+        self.archive()
+        segment = MessageArchiveEntry.objects.get().segment
+        call_command('restore_messages', self.dialog.pk, stdout=StringIO())
+        assert Message.objects.count() == 10
+        assert not MessageArchiveEntry.objects.exists()
+        assert not os.path.exists(os.path.join(self.location.name, segment))
+        self.dialog.refresh_from_db()
+        assert self.dialog.archived_until is None
@@ -0,0 +1,52 @@
+from django.test import TransactionTestCase
+from rest_framework.reverse import reverse
+
+from apps.chats.models import Dialog, DialogMember
+from apps.users.tests.factories import UserFactory
+
+
+class TestAsyncViews(TransactionTestCase):
+    """The views query from worker threads, so the data must be committed"""
+
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.friend = UserFactory()
+        self.dialog = Dialog.objects.create(users=[self.user.pk, self.friend.pk])
+        token = self.user.get_tokens()['access']
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def test_dialog_list(self):
+        self.dialog.send_message(sender=self.friend, text="Hello")
+        response = self.client.get(reverse('async-dialogs-list'), **self.headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data['count'] == 1
+        assert data['results'][0]['id'] == self.dialog.pk
+        assert data['results'][0]['unread_count'] == 1
+        assert len(data['results'][0]['participants']) == 2
+        response = self.client.get(reverse('async-dialogs-list'))
+        assert response.status_code == 401
+
+    def test_dialog_messages(self):
+        url = reverse('async-dialogs-messages', kwargs={'pk': self.dialog.pk})
+        response = self.client.post(url, data={'text': "Hi"}, content_type='application/json', **self.headers)
+        assert response.status_code == 200
+        self.dialog.send_message(sender=self.friend, text="Hello")
+        response = self.client.get(url, **self.headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert [m['text'] for m in data['results']] == ["Hi", "Hello"]
+        assert [m['is_read'] for m in data['results']] == [False, True]
+        assert set(data['users']) == {str(self.user.pk), str(self.friend.pk)}
+        assert DialogMember.objects.get(dialog=self.dialog, user=self.user).unread_count == 0
+
+    def test_dialog_list_page_numbers(self):
+        for name in ('dialogs-list', 'async-dialogs-list'):
+            url = reverse(name)
+            for page in ('0', '-1', '2', 'first'):
+                response = self.client.get(url, {'page': page}, **self.headers)
+                assert response.status_code == 404, (name, page)
+                assert response.json() == {'detail': 'Invalid page.'}
+            response = self.client.get(url, {'page': 'last'}, **self.headers)
+            assert response.status_code == 200
+            assert [dialog['id'] for dialog in response.json()['results']] == [self.dialog.pk]
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase, APIClient
+
+from apps.chats.models import Dialog
+from apps.metrics import InMemoryMetricsStore, RequestMetricsMiddleware, fingerprint
+from apps.users.tests.factories import UserFactory
+
+
+@override_settings(SERVER_TIMING=True, REQUEST_METRICS=True)
+class TestRequestMetrics(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.store = InMemoryMetricsStore()
+        patcher = patch('apps.metrics.get_metrics_store', return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.user, self.friend = UserFactory.create_batch(2)
+        self.client.force_authenticate(user=self.user)
+        self.dialog = Dialog.objects.create(users=[self.user.pk, self.friend.pk])
+        self.dialog.send_message(sender=self.friend, text="Hello")
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('dialogs-messages', kwargs={'pk': self.dialog.pk}))
+        assert response.status_code == 200
+        timing = response['Server-Timing']
+        assert 'queries"' in timing
+        assert 'db-slowest;dur=' in timing
+        assert 'render;dur=' in timing
+
+    def test_metrics(self):
+        for _ in range(2):
+            self.client.get(reverse('dialogs-messages', kwargs={'pk': self.dialog.pk}))
+        self.client.get(reverse('dialogs-list'))
+        totals = self.store.collect()
+        assert totals['DialogViewSet.messages']['requests'] == 2
+        assert totals['DialogViewSet.messages']['queries'] > 0
+        assert totals['DialogViewSet.list']['requests'] == 1
+
+        response = self.client.get(reverse('metrics'))
+        content = response.content.decode()
+        assert 'django_requests_total{view="DialogViewSet.messages"} 2' in content
+        assert 'django_request_duration_seconds_bucket{view="DialogViewSet.messages",le="+Inf"} 2' in content
+
+    def test_fingerprint(self):
+        sql = 'SELECT "chats_message"."id" FROM "chats_message" WHERE "id" IN (%s, %s, %s) AND "text" = \'a\' LIMIT 21'
+        assert fingerprint(sql) == 'SELECT chats_message.id FROM chats_message WHERE id IN (?) AND text = ? LIMIT ?'
+
+    @override_settings(SERVER_TIMING=False, REQUEST_METRICS=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('dialogs-list'))
+        assert 'Server-Timing' not in response
+        assert not self.store.collect()
+        assert self.client.get(reverse('metrics')).status_code == 404
+
+
+@override_settings(SERVER_TIMING=True, REQUEST_METRICS=False)
+class TestAsyncRequestMetrics(SimpleTestCase):
+    databases = {'default'}
+
+    def test_async_view_stays_async(self):
+        threads = []
+
+        def query():
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            finally:
+                connection.close()  # the worker thread's own connection
+
+        async def view(request):
+            threads.append(threading.get_ident())
+            await sync_to_async(query, thread_sensitive=False)()
+            return HttpResponse()
+
+        async def call():
+            return await middleware(RequestFactory().get('/')), threading.get_ident()
+
+        middleware = RequestMetricsMiddleware(view)
+        assert asyncio.iscoroutinefunction(middleware)
+        response, loop_thread = async_to_sync(call)()
+        assert threads == [loop_thread]
+        assert 'desc="1 queries"' in response['Server-Timing']  # the query of the worker thread is counted
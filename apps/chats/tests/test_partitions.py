@@ -0,0 +1,54 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from apps.chats.models import Dialog, Message
+from apps.chats.partitions import detach_partitions, get_partitions, month_start
+from apps.users.tests.factories import UserFactory
+
+
+class TestMessagePartitions(TestCase):
+    def setUp(self) -> None:
+        self.user, self.friend = UserFactory.create_batch(2)
+        self.dialog = Dialog.objects.create(users=[self.user.pk, self.friend.pk])
+        self.dialog.send_message(sender=self.friend, text="Hello")
+
+    def test_create_partitions(self):
+        now = timezone.now()
+        assert get_partitions()[-1].end == month_start(now, 4)  # the migration covers three months ahead
+        out = StringIO()
+        call_command('create_message_partitions', months=5, stdout=out)
+        assert f"chats_message_p{month_start(now, 5):%Y%m}" in out.getvalue()
+        assert get_partitions()[-1].end == month_start(now, 6)
+        out = StringIO()
+        call_command('create_message_partitions', months=5, stdout=out)
+        assert "0 partitions are created" in out.getvalue()
+
+    def test_history_is_pruned(self):
+        # the partitions of the months before the dialog are skipped
+        now = timezone.now()
+        self.dialog.created = month_start(now, 2) + timedelta(days=1)
+        plan = self.dialog.history().explain()
+        assert 'chats_message_legacy' not in plan
+        assert f'chats_message_p{month_start(now, 1):%Y%m}' not in plan
+        assert f'chats_message_p{month_start(now, 2):%Y%m}' in plan
+
+    def test_history_is_complete(self):
+        skewed = self.dialog.send_message(sender=self.user, text="Stamped by a clock behind")
+        Message.objects.filter(pk=skewed.pk).update(created=self.dialog.created - timedelta(minutes=1))
+        # committed, but its concurrent send hasn't moved the last message yet
+        lagging = Message.objects.create(sender_id=self.friend.pk, dialog=self.dialog, text="Not registered")
+        texts = set(self.dialog.history().values_list('text', flat=True))
+        assert texts == {"Hello", skewed.text, lagging.text}
+
+    def test_detach_partitions(self):
+        call_command('detach_message_partitions', keep_months=0, stdout=StringIO())
+        assert Message.objects.exists()  # the current month is kept
+        assert detach_partitions(before=month_start(timezone.now(), 1)) == ['chats_message_legacy']
+        assert not any(partition.name == 'chats_message_legacy' for partition in get_partitions())
+        assert not Message.objects.exists()
+        self.dialog.refresh_from_db()
+        assert self.dialog.last_message_id is not None  # the history is gone, the dialog stays
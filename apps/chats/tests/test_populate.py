@@ -0,0 +1,73 @@
+import json
+import os
+from io import StringIO
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db.models import Count, F
+from django.test import TestCase, TransactionTestCase
+
+from apps.chats.management.commands.benchmark_endpoints import Command as BenchmarkEndpoints
+from apps.chats.models import Dialog, DialogMember, Message
+from apps.chats.receipts import InMemoryReadBuffer
+from apps.users.models import User
+from apps.users.tests.factories import DEFAULT_PASSWORD
+
+
+class TestPopulate(TestCase):
+    def test_populate(self):
+        out = StringIO()
+        call_command('populate', users=20, dialogs=50, messages=2000, workers=1, chunk_size=300, seed=1,
+                     stdout=out, stderr=StringIO())
+        assert "20 users, 50 dialogs" in out.getvalue()
+        assert User.objects.count() == 20
+        assert User.objects.first().check_password(DEFAULT_PASSWORD)
+        assert Dialog.objects.count() == 50
+        assert DialogMember.objects.count() == 100
+        assert 1800 < Message.objects.count() < 2200
+        assert not Message.objects.filter(search_vector__isnull=True).exists()
+
+        dialog = Dialog.objects.annotate(size=Count('messages')).order_by('-size').first()
+        assert dialog.last_message == dialog.history().latest('created', 'id')
+        assert dialog.history().count() == dialog.size
+        # the ids follow the timestamps within a dialog, the read cursors rely on that
+        assert list(dialog.messages.order_by('created', 'id')) == list(dialog.messages.order_by('id'))
+
+        # the generated unread counters match the read cursors
+        out = StringIO()
+        call_command('reconcile_unread_counters', stdout=out)
+        assert "0 unread counters are repaired" in out.getvalue()
+
+        # ids are taken from the sequences, the application keeps inserting after them
+        user = User.objects.create_user('+380501234567')
+        assert user.pk > User.objects.exclude(pk=user.pk).latest('pk').pk
+        assert not DialogMember.objects.filter(last_sent_at__gt=F('dialog__last_message_at')).exists()
+
+
+class TestBenchmarkEndpoints(TransactionTestCase):
+    def test_query_budgets(self):
+        # as in the benchmark: no test case savepoints and the reads are flushed in the background
+        buffer = InMemoryReadBuffer(flush_interval=24 * 60 * 60)
+        self.addCleanup(buffer.stop, flush=False)
+        call_command('populate', users=20, dialogs=50, messages=500, workers=1, seed=1,
+                     stdout=StringIO(), stderr=StringIO())
+        with patch('apps.chats.models.get_read_buffer', return_value=buffer):
+            results = BenchmarkEndpoints(stdout=StringIO()).run('small', requests=2)
+        with open(os.path.join(settings.BASE_DIR, 'benchmarks', 'endpoints.json')) as f:
+            baseline = json.load(f)
+        assert set(results) == set(baseline['small'])
+        # the latencies of a tiny dataset say nothing, the query budgets hold for any size
+        over = {name: m['queries'] for name, m in results.items() if m['queries'] > baseline['small'][name]['queries']}
+        assert over == {}
+
+    def test_compare(self):
+        budget = {'p50_ms': 10.0, 'p95_ms': 20.0, 'queries': 2, 'rows': 21}
+        baseline = {'small': {'dialogs': budget}}
+        assert BenchmarkEndpoints.compare({'small': {'dialogs': dict(budget, p95_ms=29.0)}}, baseline, 0.5) == []
+        measured = {'small': {'dialogs': dict(budget, queries=3, p50_ms=16.0), 'signin': budget}}
+        assert BenchmarkEndpoints.compare(measured, baseline, 0.5) == [
+            "small dialogs: queries 3 > 2",
+            "small dialogs: p50_ms 16.0 > 15",
+            "small signin: there is no baseline",
+        ]
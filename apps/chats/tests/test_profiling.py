@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.base import BaseHandler
+from django.core.management import call_command
+from django.test import AsyncClient, SimpleTestCase, override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase, APIClient
+
+from apps.chats.models import Dialog
+from apps.profiling import parse_profile_name
+from apps.users.tests.factories import UserFactory
+
+
+class TestRequestProfiling(APITestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.client = APIClient()
+        self.user, self.friend = UserFactory.create_batch(2)
+        self.client.force_authenticate(user=self.user)
+        self.dialog = Dialog.objects.create(users=[self.user.pk, self.friend.pk])
+        self.dialog.send_message(sender=self.friend, text="Hello")
+
+    def profiling(self, **kwargs):
+        return override_settings(**dict({
+            'PROFILING': True,
+            'PROFILING_SAMPLE_RATE': 0,
+            'PROFILING_VIEWS': [],
+            'PROFILING_TOKEN': 'secret',
+            'PROFILING_DIR': self.directory,
+            'PROFILING_MAX_FILES': 3,
+        }, **kwargs))
+
+    def test_profile_by_view(self):
+        with self.profiling(PROFILING_VIEWS=['DialogViewSet.messages']):
+            self.client.get(reverse('dialogs-list'))
+            self.client.get(reverse('dialogs-messages', kwargs={'pk': self.dialog.pk}))
+        names = os.listdir(self.directory)
+        assert len(names) == 1
+        assert parse_profile_name(names[0])['view'] == 'DialogViewSet.messages'
+
+        out = StringIO()
+        call_command('profile_report', dir=self.directory, view='DialogViewSet', stdout=out)
+        assert 'DialogViewSet.messages' in out.getvalue()
+        assert 'function calls' in out.getvalue()
+
+    def test_profile_by_header_and_rotate(self):
+        with self.profiling():
+            self.client.get(reverse('dialogs-list'), HTTP_X_PROFILE='wrong')
+            assert not os.listdir(self.directory)
+            for _ in range(5):
+                self.client.get(reverse('dialogs-list'), HTTP_X_PROFILE='secret')
+        assert len(os.listdir(self.directory)) == 3
+
+    def test_disabled(self):
+        with self.profiling(PROFILING=False, PROFILING_SAMPLE_RATE=1):
+            self.client.get(reverse('dialogs-list'))
+        assert not os.listdir(self.directory)
+
+
+class TestAsyncStack(SimpleTestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def get_adapted_middlewares(self) -> list:
+        """Middlewares which make Django switch between sync and async under ASGI"""
+        adapted = []
+        adapt_method_mode = BaseHandler.adapt_method_mode
+
+        def spy(handler, is_async, method, method_is_async=None, debug=False, name=None):
+            if name is not None and method_is_async is not None and method_is_async != is_async:
+                adapted.append(name)
+            return adapt_method_mode(handler, is_async, method, method_is_async, debug, name)
+
+        with patch.object(BaseHandler, 'adapt_method_mode', spy):
+            ASGIHandler().load_middleware(is_async=True)
+        return adapted
+
+    def test_async_views_stay_async(self):
+        # Django 3.1 adapts the handler for a middleware before it raises MiddlewareNotUsed, so off counts too
+        for enabled in (False, True):
+            with override_settings(SERVER_TIMING=enabled, REQUEST_METRICS=enabled, PROFILING=enabled,
+                                   COMPRESSION=enabled, PROFILING_DIR=self.directory):
+                assert self.get_adapted_middlewares() == []
+
+    @override_settings(PROFILING=True, PROFILING_SAMPLE_RATE=0, PROFILING_VIEWS=[], PROFILING_TOKEN='secret')
+    def test_profile_sync_view_under_asgi(self):
+        with self.settings(PROFILING_DIR=self.directory):
+            headers = [(b'host', b'testserver'), (b'x-profile', b'secret')]
+            response = async_to_sync(AsyncClient().get)(reverse('metrics'), headers=headers)
+        assert response.status_code == 404  # the metrics are off, the view ran and is profiled anyway
+        names = os.listdir(self.directory)
+        assert len(names) == 1
+        assert parse_profile_name(names[0])['view'] == 'apps.metrics.metrics_view'
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import queue
+import sys
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from apps.chats.broker import RedisBroker
+from apps.chats.consumers import DIALOGS_PATH, websocket_application
+from apps.chats.models import Dialog
+from apps.users.tests.factories import UserFactory
+
+
+class TestRealtime(TransactionTestCase):
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.friend = UserFactory()
+        self.dialog = Dialog.objects.create(users=[self.user.pk, self.friend.pk])
+
+    def connect(self, query_string):
+        communicator = ApplicationCommunicator(websocket_application, {
+            'type': 'websocket',
+            'path': DIALOGS_PATH,
+            'query_string': query_string,
+            'headers': [],
+        })
+        return communicator
+
+    def test_unauthorized_connection_is_closed(self):
+        async def run():
+            communicator = self.connect(b'token=wrong')
+            await communicator.send_input({'type': 'websocket.connect'})
+            event = await communicator.receive_output()
+            assert event == {'type': 'websocket.close', 'code': 4401}
+
+        async_to_sync(run)()
+
+    def test_inactive_user_is_rejected(self):
+        token = self.friend.get_tokens()['access']
+        self.friend.is_active = False
+        self.friend.save()
+
+        async def run():
+            communicator = self.connect(f'token={token}'.encode())
+            await communicator.send_input({'type': 'websocket.connect'})
+            assert await communicator.receive_output() == {'type': 'websocket.close', 'code': 4401}
+
+        async_to_sync(run)()
+
+    @override_settings(JWT_CLAIMS_CACHE_TTL=0.1)
+    def test_connection_is_closed_on_deactivation(self):
+        token = self.friend.get_tokens()['access']
+
+        async def run():
+            communicator = self.connect(f'token={token}'.encode())
+            await communicator.send_input({'type': 'websocket.connect'})
+            assert (await communicator.receive_output())['type'] == 'websocket.accept'
+            self.friend.is_active = False
+            await sync_to_async(self.friend.save)()
+            assert await communicator.receive_output(timeout=2) == {'type': 'websocket.close', 'code': 4401}
+            await communicator.wait()
+
+        async_to_sync(run)()
+
+    def test_connection_is_closed_when_token_expires(self):
+        access = self.friend.make_token().access_token
+        access.set_exp(lifetime=timedelta(seconds=1))
+
+        async def run():
+            communicator = self.connect(f'token={access}'.encode())
+            await communicator.send_input({'type': 'websocket.connect'})
+            assert (await communicator.receive_output())['type'] == 'websocket.accept'
+            assert await communicator.receive_output(timeout=3) == {'type': 'websocket.close', 'code': 4401}
+            await communicator.wait()
+
+        async_to_sync(run)()
+
+    def test_new_message_is_pushed_to_participants(self):
+        token = self.friend.get_tokens()['access']
+
+        async def run():
+            communicator = self.connect(f'token={token}'.encode())
+            await communicator.send_input({'type': 'websocket.connect'})
+            assert (await communicator.receive_output())['type'] == 'websocket.accept'
+            message = await sync_to_async(self.dialog.send_message)(sender=self.user, text="Hello")
+            event = await communicator.receive_output(timeout=2)
+            data = json.loads(event['text'])
+            assert data['type'] == 'message'
+            assert data['message']['id'] == message.pk
+            assert data['message']['dialog_id'] == self.dialog.pk
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait()
+
+        async_to_sync(run)()
+
+
+class FakePubSub:
+    def __init__(self):
+        self.channels = set()
+        self.messages = queue.Queue()
+
+    @property
+    def subscribed(self):
+        return bool(self.channels)
+
+    def subscribe(self, *channels):
+        self.channels.update(channels)
+
+    def unsubscribe(self, *channels):
+        self.channels.difference_update(channels)
+
+    def get_message(self, timeout):
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class FakeRedis:
+    def __init__(self):
+        self.pubsubs = []
+
+    def pubsub(self, **kwargs):
+        self.pubsubs.append(FakePubSub())
+        return self.pubsubs[-1]
+
+    def publish(self, channel, data):
+        for pubsub in self.pubsubs:
+            if channel in pubsub.channels:
+                pubsub.messages.put({'type': 'message', 'channel': channel.encode(), 'data': data})
+
+
+class TestRedisBroker(SimpleTestCase):
+    def test_connections_share_one_reader(self):
+        server = FakeRedis()
+        module = SimpleNamespace(Redis=SimpleNamespace(from_url=lambda url: server), RedisError=ConnectionError)
+        with patch.dict(sys.modules, {'redis': module}):
+            broker = RedisBroker('redis://')
+
+        async def wait_for(condition):
+            while not condition():
+                await asyncio.sleep(0.01)
+
+        async def run():
+            # more sockets than threads in the default executor
+            subscriptions = [broker.subscribe([f'chats:user:{i % 2}']) for i in range(50)]
+            receiving = [asyncio.ensure_future(subscription.__anext__()) for subscription in subscriptions]
+            await asyncio.wait_for(wait_for(lambda: server.pubsubs and len(server.pubsubs[0].channels) == 2), 2)
+            broker.publish('chats:user:0', {'text': 'zero'})
+            broker.publish('chats:user:1', {'text': 'one'})
+            events = await asyncio.wait_for(asyncio.gather(*receiving), 2)
+            assert events == [{'text': 'zero'}, {'text': 'one'}] * 25
+            for subscription in subscriptions:
+                await subscription.aclose()
+            await asyncio.wait_for(wait_for(lambda: not server.pubsubs[0].channels), 2)
+
+        async_to_sync(run)()
+        assert len(server.pubsubs) == 1
+        assert broker._reader.is_alive()
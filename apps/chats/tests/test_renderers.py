@@ -0,0 +1,117 @@
+import asyncio
+import datetime
+import decimal
+import gzip
+import io
+import json
+import threading
+import uuid
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase, APIClient
+
+from apps.chats.models import Dialog
+from apps.compression import CompressionMiddleware, negotiate_encoding
+from apps.users.tests.factories import UserFactory
+from apps.utils import FastJSONParser, FastJSONRenderer, UTF8CharsetJSONRenderer
+
+
+class TestFastJSON(SimpleTestCase):
+    data = {
+        'created': timezone.now(),
+        'id': uuid.uuid4(),
+        'price': decimal.Decimal('1.50'),
+        'text': 'Привіт',
+        1: [None, True, 2 ** 70],
+    }
+
+    def assert_rendered_by_orjson(self, data):
+        # the parent renderer is the fallback, it mustn't be what made the output equal
+        with patch.object(UTF8CharsetJSONRenderer, 'render', side_effect=AssertionError):
+            content = FastJSONRenderer().render(data)
+        assert content == JSONRenderer().render(data)
+
+    def test_render_datetimes(self):
+        created = timezone.now().replace(microsecond=123456)
+        self.assert_rendered_by_orjson({
+            'created': created,
+            'whole_seconds': created.replace(microsecond=0),
+            'naive': timezone.make_naive(created),
+            'kyiv': created.astimezone(datetime.timezone(datetime.timedelta(hours=2))),
+            'date': created.date(),
+            'time': created.time(),
+            'duration': datetime.timedelta(minutes=1, microseconds=5),
+        })
+
+    def test_render_line_separators(self):
+        self.assert_rendered_by_orjson({'text': 'one\u2028two\u2029three', 'id': uuid.uuid4()})
+
+    def test_render_as_stdlib(self):
+        assert FastJSONRenderer().render(self.data) == JSONRenderer().render(self.data)
+        with patch('apps.utils.orjson', None):
+            assert FastJSONRenderer().render(self.data) == JSONRenderer().render(self.data)
+        indented = FastJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        assert indented == b'{\n  "a": 1\n}'
+
+    def test_parse(self):
+        parser = FastJSONParser()
+        body = '{"text": "Привіт", "big": 1180591620717411303424}'.encode()
+        assert parser.parse(io.BytesIO(body)) == {'text': 'Привіт', 'big': 2 ** 70}
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'{"value": NaN}'))
+
+    def test_negotiate_encoding(self):
+        assert negotiate_encoding('gzip, deflate, br', ['br', 'gzip']) == 'br'
+        assert negotiate_encoding('gzip, deflate, br', ['gzip']) == 'gzip'
+        assert negotiate_encoding('br;q=0.5, gzip', ['br', 'gzip']) == 'gzip'
+        assert negotiate_encoding('*;q=0.1, gzip;q=0', ['br', 'gzip']) == 'br'
+        assert negotiate_encoding('identity', ['br', 'gzip']) is None
+        assert negotiate_encoding('', ['br', 'gzip']) is None
+
+
+@override_settings(COMPRESSION=True, COMPRESSION_MIN_SIZE=1024)
+class TestCompression(APITestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.user, self.friend = UserFactory.create_batch(2)
+        self.client.force_authenticate(user=self.user)
+        self.dialog = Dialog.objects.create(users=[self.user.pk, self.friend.pk])
+        self.dialog.send_message(sender=self.friend, text="Hello")
+        self.path = reverse('dialogs-messages', kwargs={'pk': self.dialog.pk})
+
+    def test_small_response(self):
+        response = self.client.get(self.path, HTTP_ACCEPT_ENCODING='gzip')
+        assert not response.has_header('Content-Encoding')
+
+    def test_gzip(self):
+        for _ in range(20):
+            self.dialog.send_message(sender=self.friend, text="How are you doing? " * 5)
+        response = self.client.get(self.path, HTTP_ACCEPT_ENCODING='gzip')
+        assert response['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response['Vary']
+        assert len(json.loads(gzip.decompress(response.content))['results']) == 21
+        assert not self.client.get(self.path).has_header('Content-Encoding')
+
+    def test_async_view_stays_async(self):
+        threads = []
+
+        async def view(request):
+            threads.append(threading.get_ident())
+            return HttpResponse(b'Hello ' * 1000)
+
+        async def call():
+            request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+            return await middleware(request), threading.get_ident()
+
+        middleware = CompressionMiddleware(view)
+        assert asyncio.iscoroutinefunction(middleware)
+        response, loop_thread = async_to_sync(call)()
+        assert threads == [loop_thread]  # the view ran on the event loop, not in a worker thread
+        assert response['Content-Encoding'] == 'gzip'
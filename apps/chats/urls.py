@@ -1,9 +1,11 @@
 from django.urls import path
 from rest_framework import routers
-from . import views
+from . import async_views, views
 
 
 urlpatterns = [
+    path('async/dialogs/', async_views.dialog_list, name='async-dialogs-list'),
+    path('async/dialogs/<int:pk>/messages/', async_views.dialog_messages, name='async-dialogs-messages'),
 ]
 
 router = routers.DefaultRouter()
@@ -1,58 +1,134 @@
-from rest_framework import mixins, viewsets
+from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.parsers import JSONParser
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
+from apps.utils import FastJSONParser
 from . import serializers
+from .archive import DialogArchive
+from .cache import get_inbox_page, get_inbox_page_key, get_inbox_stats, set_inbox_page
 from .filters import DialogFilteringBackend
-from .models import Message, Dialog
+from .models import Message, Dialog, DialogMember, DialogReadState
+from .pagination import MessageCursorPagination, SearchCursorPagination
 
 
 class DialogPagination(PageNumberPagination):
     page_size = 20
 
 
+def is_verbose(request) -> bool:
+    return request.query_params.get('verbose') in ('1', 'true', 'True')
+
+
+def get_message_serializer_class(request):
+    """Messages are compact unless the nested representation is requested with `?verbose=true`"""
+    if is_verbose(request):
+        return serializers.MessageDetailSerializer
+    return serializers.MessageSerializer
+
+
 class DialogViewSet(mixins.ListModelMixin,
                     mixins.CreateModelMixin,
                     viewsets.GenericViewSet):
     """Dialog source
     """
-    queryset = Dialog.objects.prefetch_related('favoritedialog_set')
+    queryset = Dialog.objects.all()
     permission_classes = (IsAuthenticated,)
     serializer_class = serializers.DialogSerializer
-    parser_classes = (JSONParser,)
+    parser_classes = (FastJSONParser,)
     pagination_class = DialogPagination
     filter_backends = (DialogFilteringBackend,)
 
     def get_queryset(self):
-        user = self.request.user
-        return super().get_queryset().filter(users__contains=[user.pk])
+        return super().get_queryset().for_user(self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED if serializer.created else status.HTTP_200_OK)
+
+    def list(self, request, *args, **kwargs):
+        """The inbox is cached per user until something in it changes"""
+        key = get_inbox_page_key(request.user.pk, request.get_full_path())
+        data = get_inbox_page(key)
+        if data is not None:
+            return Response(data)
+        response = super().list(request, *args, **kwargs)
+        set_inbox_page(key, response.data)
+        return response
+
+    @action(methods=['GET'], detail=False, permission_classes=(IsAdminUser,))
+    def cache_stats(self, request, *args, **kwargs):
+        return Response(get_inbox_stats())
 
     @action(methods=['PATCH'], detail=True)
     def add_to_favorite(self, request, pk=None, *args, **kwargs):
         dialog = get_object_or_404(self.get_queryset(), pk=pk)
         dialog.add_to_favorite(request.user)
         dialog.refresh_from_db()
-        serializer = serializers.DialogSerializer(instance=dialog)
+        dialog.favorite = True
+        serializer = serializers.DialogSerializer(instance=dialog, context=self.get_serializer_context())
         return Response(serializer.data)
 
+    @action(methods=['GET'], detail=False)
+    def unread(self, request, *args, **kwargs):
+        counters = dict(DialogMember.objects.unread(request.user).values_list('dialog_id', 'unread_count'))
+        return Response({
+            'total': sum(counters.values()),
+            'dialogs': counters,
+        })
+
+    @action(methods=['GET'], detail=False)
+    def search(self, request, *args, **kwargs):
+        """Messages of the user's dialogs matching `q`, `dialog` narrows the search to one dialog"""
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'q': ['This field is required.']})
+        dialogs = Dialog.objects.filter(users__contains=[request.user.pk])
+        if request.query_params.get('dialog'):
+            try:
+                dialogs = dialogs.filter(pk=int(request.query_params['dialog']))
+            except ValueError:
+                raise ValidationError({'dialog': ['A valid integer is required.']})
+        dialog_ids = list(dialogs.values_list('pk', flat=True))
+        paginator = SearchCursorPagination()
+        messages = paginator.paginate_queryset(Message.objects.filter(dialog_id__in=dialog_ids).search(text), request)
+        serializer = serializers.MessageSearchSerializer(messages, many=True)
+        response = paginator.get_paginated_response(serializer.data)
+        response.data['users'] = serializers.get_users_map(message.sender_id for message in messages)
+        return response
+
     @action(methods=['GET', 'POST'], detail=True)
     def messages(self, request, pk=None, *args, **kwargs):
         dialog = self.get_object()
         if request.method == 'GET':
-            messages = dialog.messages.order_by('created')  # it would be nice to have pagination here
-            last_message = messages.last()
-            last_message.mark_as_read()
-            serializer = serializers.MessageSerializer(messages, many=True)
-            return Response(serializer.data)
+            paginator = MessageCursorPagination()
+            if dialog.archived_until is not None:
+                paginator.archive = DialogArchive(dialog)
+            queryset = dialog.history()
+            if is_verbose(request):
+                queryset = queryset.select_related('sender', 'dialog')
+            messages = paginator.paginate_queryset(queryset, request, view=self)
+            positions = DialogReadState.objects.positions(dialog.pk)
+            if messages:
+                # the read is written by the next flush of the read buffer, the response already shows it
+                DialogReadState.objects.buffer_read(dialog, request.user.pk, messages[-1].pk)
+                DialogReadState.advance(positions[dialog.pk], request.user.pk, messages[-1].pk)
+            context = {'request': request, 'read_positions': positions}
+            serializer = get_message_serializer_class(request)(messages, many=True, context=context)
+            response = paginator.get_paginated_response(serializer.data)
+            response.data['users'] = serializers.get_users_map(dialog.users)
+            return response
         elif request.method == 'POST':
             serializer = serializers.SendMessageSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
             msg = dialog.send_message(sender=request.user, text=serializer.validated_data['text'])
-            return Response(serializers.MessageSerializer(instance=msg).data)
+            serializer = get_message_serializer_class(request)(instance=msg, context={'request': request})
+            return Response(serializer.data)
 
 
 class MessagePagination(PageNumberPagination):
@@ -67,5 +143,31 @@ class MessageViewSet(mixins.ListModelMixin,
     queryset = Message.objects.all()
     permission_classes = (IsAuthenticated,)
     serializer_class = serializers.MessageSerializer
-    parser_classes = (JSONParser,)
+    parser_classes = (FastJSONParser,)
     pagination_class = MessagePagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if is_verbose(self.request):
+            queryset = queryset.select_related('sender', 'dialog')
+        return queryset
+
+    def get_serializer_class(self):
+        return get_message_serializer_class(self.request)
+
+    @action(methods=['POST'], detail=False)
+    def batch(self, request, *args, **kwargs):
+        """Sends up to `SendBatchSerializer.MAX_MESSAGES` messages to the dialogs of the user at once"""
+        serializer = serializers.SendBatchSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        messages = Dialog.objects.send_messages(request.user, serializer.validated_data['messages'])
+        read_positions = {message.dialog_id: {} for message in messages}  # new messages are unread
+        data = serializers.MessageSerializer(messages, many=True, context={'read_positions': read_positions}).data
+        return Response({'results': data}, status=status.HTTP_201_CREATED)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        messages = response.data['results'] if 'results' in response.data else response.data
+        if not is_verbose(request):
+            response.data['users'] = serializers.get_users_map(message['sender_id'] for message in messages)
+        return response
@@ -0,0 +1,102 @@
+"""Response compression negotiated by `Accept-Encoding`.
+
+Brotli is preferred when the `brotli` package is installed and the client accepts it, gzip otherwise.
+Only responses of at least `COMPRESSION_MIN_SIZE` bytes are compressed: small payloads barely shrink,
+and compressing them costs more CPU than it saves on the wire.
+"""
+import gzip
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+
+from apps.middleware import AsyncCapableMiddleware
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+ACCEPT_ENCODING_RE = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4  # the higher qualities are meant for static files, they are many times slower
+
+
+def compress_gzip(content: bytes) -> bytes:
+    return gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_brotli(content: bytes) -> bytes:
+    return brotli.compress(content, quality=BROTLI_QUALITY)
+
+
+def get_encodings() -> dict:
+    """Supported encodings in the order of preference"""
+    encodings = {'br': compress_brotli} if brotli is not None else {}
+    encodings['gzip'] = compress_gzip
+    return encodings
+
+
+def parse_accept_encoding(header: str) -> dict:
+    """Quality values by coding, e.g. {'gzip': 1.0, 'br': 0.5}; malformed items are skipped"""
+    qualities = {}
+    for item in header.split(','):
+        match = ACCEPT_ENCODING_RE.match(item)
+        if match is None:
+            continue
+        coding, quality = match.group(1).lower(), match.group(2)
+        try:
+            qualities[coding] = min(float(quality), 1.0) if quality is not None else 1.0
+        except ValueError:
+            continue
+    return qualities
+
+
+def negotiate_encoding(header: str, encodings) -> str:
+    """The accepted encoding of the highest quality, ties go to the server's preference"""
+    qualities = parse_accept_encoding(header)
+    wildcard = qualities.get('*', 0.0)
+    accepted = [(qualities.get(coding, wildcard), -i, coding) for i, coding in enumerate(encodings)]
+    accepted = [item for item in accepted if item[0] > 0]
+    return max(accepted)[2] if accepted else None
+
+
+class CompressionMiddleware(AsyncCapableMiddleware):
+    """Compresses large responses, it goes right after the instrumentation middlewares in `MIDDLEWARE`"""
+
+    def __init__(self, get_response):
+        if not settings.COMPRESSION:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.encodings = get_encodings()
+
+    def call(self, request):
+        return self.compress(request, self.get_response(request))
+
+    async def acall(self, request):
+        response = await self.get_response(request)
+        # compressing is CPU bound, it doesn't hold up the event loop
+        return await sync_to_async(self.compress, thread_sensitive=False)(request, response)
+
+    def compress(self, request, response):
+        if response.streaming or len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), self.encodings)
+        if encoding is None:
+            return response
+
+        compressed = self.encodings[encoding](response.content)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag  # the representation differs, a strong validator would be wrong
+        return response
@@ -0,0 +1,286 @@
+"""Per-request SQL instrumentation.
+
+`RequestMetricsMiddleware` times the SQL statements and the response rendering of every request. With
+`SERVER_TIMING` the numbers are returned in a `Server-Timing` header, with `REQUEST_METRICS` they are
+aggregated per view and action and exported at `/metrics` in the Prometheus text format. When both are
+off the middleware removes itself at startup and costs nothing.
+"""
+import re
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.utils.module_loading import import_string
+
+from apps.middleware import AsyncCapableMiddleware
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNTERS = ('requests', 'duration', 'queries', 'db_duration', 'render_duration')
+FINGERPRINT_LENGTH = 200
+
+# literals and placeholder lists collapse, so the statements of a query shape share the fingerprint
+FINGERPRINT_RULES = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s(?:\s*,\s*%s)*'), '?'),
+    (re.compile(r'"'), ''),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def fingerprint(sql: str) -> str:
+    for pattern, replacement in FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()[:FINGERPRINT_LENGTH]
+
+
+def get_view_name(request) -> str:
+    """`DialogViewSet.messages` for viewset actions, `<View>.<method>` for other class based views"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    func = match.func
+    cls = getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    if cls is None:
+        return f'{func.__module__}.{func.__name__}'
+    method = request.method.lower()
+    action = (getattr(func, 'actions', None) or {}).get(method, method)
+    return f'{cls.__name__}.{action}'
+
+
+class QueryTimer:
+    """Times the statements of a request, `record_query` passes them to the timer of the current request"""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # the queries of an async view run in several threads at once
+        self.queries = 0
+        self.duration = 0.0
+        self.slowest = None
+        self.slowest_duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            with self._lock:
+                self.queries += 1
+                self.duration += duration
+                if duration >= self.slowest_duration:
+                    self.slowest, self.slowest_duration = sql, duration
+
+
+# a context variable follows the request into the threads `sync_to_async` runs the queries in
+current_timer = ContextVar('query_timer', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """The execute wrapper of every connection, it costs a lookup outside of measured requests"""
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_timer(connection, **kwargs):
+    # first in the list, the `execute_wrapper` context managers of others pop the last one
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+class BaseMetricsStore:
+    """Aggregates the request samples per view"""
+
+    def record(self, view: str, values: dict) -> None:
+        """Adds the `COUNTERS` of a request and counts its duration in the histogram"""
+        raise NotImplementedError
+
+    def collect(self) -> dict:
+        """Totals by view: {view: {counter: value, 'buckets': [count per bucket]}}"""
+        raise NotImplementedError
+
+    @staticmethod
+    def get_bucket(duration: float) -> int:
+        """Index of the histogram bucket of the duration, `len(DURATION_BUCKETS)` stands for +Inf"""
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                return index
+        return len(DURATION_BUCKETS)
+
+
+class InMemoryMetricsStore(BaseMetricsStore):
+    """Totals of the current process, every worker process exports its own"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(lambda: dict({name: 0 for name in COUNTERS},
+                                               buckets=[0] * (len(DURATION_BUCKETS) + 1)))
+
+    def record(self, view: str, values: dict) -> None:
+        with self._lock:
+            totals = self._views[view]
+            for name in COUNTERS:
+                totals[name] += values[name]
+            totals['buckets'][self.get_bucket(values['duration'])] += 1
+
+    def collect(self) -> dict:
+        with self._lock:
+            return {view: dict(totals, buckets=list(totals['buckets'])) for view, totals in self._views.items()}
+
+
+class RedisMetricsStore(BaseMetricsStore):
+    """A hash of totals per view shared by all the worker processes"""
+    key_prefix = 'metrics:requests:'
+    views_key = 'metrics:requests:views'
+
+    def __init__(self, url: str = None):
+        import redis
+        self.redis = redis.Redis.from_url(url or settings.REDIS_URL)
+
+    def record(self, view: str, values: dict) -> None:
+        key = f'{self.key_prefix}{view}'
+        pipe = self.redis.pipeline(transaction=False)
+        for name in COUNTERS:
+            pipe.hincrbyfloat(key, name, values[name])
+        pipe.hincrby(key, f"bucket:{self.get_bucket(values['duration'])}", 1)
+        pipe.sadd(self.views_key, view)
+        pipe.execute()
+
+    def collect(self) -> dict:
+        views = sorted(view.decode() for view in self.redis.smembers(self.views_key))
+        pipe = self.redis.pipeline(transaction=False)
+        for view in views:
+            pipe.hgetall(f'{self.key_prefix}{view}')
+        metrics = {}
+        for view, fields in zip(views, pipe.execute()):
+            fields = {name.decode(): float(value) for name, value in fields.items()}
+            metrics[view] = dict({name: fields.get(name, 0) for name in COUNTERS}, buckets=[
+                int(fields.get(f'bucket:{index}', 0)) for index in range(len(DURATION_BUCKETS) + 1)
+            ])
+        return metrics
+
+
+_store = None
+
+
+def get_metrics_store() -> BaseMetricsStore:
+    global _store
+    if _store is None:
+        _store = import_string(settings.REQUEST_METRICS_STORE)()
+    return _store
+
+
+class RequestMetricsMiddleware(AsyncCapableMiddleware):
+    """Measures the SQL and rendering time of requests, it goes first in `MIDDLEWARE` to see the whole request"""
+
+    def __init__(self, get_response):
+        if not (settings.SERVER_TIMING or settings.REQUEST_METRICS):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        connection_created.connect(install_query_timer)
+        for connection in connections.all():
+            install_query_timer(connection)
+
+    def call(self, request):
+        timer, token, started = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.finish(request, response, timer, time.perf_counter() - started)
+
+    async def acall(self, request):
+        timer, token, started = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        # the store may be Redis, it isn't called from the event loop
+        return await sync_to_async(self.finish, thread_sensitive=False)(
+            request, response, timer, time.perf_counter() - started,
+        )
+
+    @staticmethod
+    def start(request):
+        request.render_duration = 0.0
+        timer = QueryTimer()
+        return timer, current_timer.set(timer), time.perf_counter()
+
+    def finish(self, request, response, timer: QueryTimer, duration: float):
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = self.get_server_timing(timer, request.render_duration, duration)
+        if settings.REQUEST_METRICS:
+            get_metrics_store().record(get_view_name(request), {
+                'requests': 1,
+                'duration': duration,
+                'queries': timer.queries,
+                'db_duration': timer.duration,
+                'render_duration': request.render_duration,
+            })
+        return response
+
+    def process_template_response(self, request, response):
+        """DRF responses are rendered right after the outermost hook, the callback closes the measurement"""
+        started = time.perf_counter()
+
+        def rendered(response):
+            request.render_duration = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def get_server_timing(timer: QueryTimer, render_duration: float, duration: float) -> str:
+        metrics = [f'db;dur={timer.duration * 1000:.1f};desc="{timer.queries} queries"']
+        if timer.slowest is not None:
+            # header values are latin-1, a quote or a backslash would end the description early
+            slowest = fingerprint(timer.slowest).encode('ascii', 'replace').decode().replace('\\', '')
+            metrics.append(f'db-slowest;dur={timer.slowest_duration * 1000:.1f};desc="{slowest}"')
+        metrics.append(f'render;dur={render_duration * 1000:.1f};desc="serialization"')
+        metrics.append(f'total;dur={duration * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+def format_labels(view: str, **labels) -> str:
+    labels = dict(view=view.replace('\\', r'\\').replace('"', r'\"'), **labels)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+def render_metrics(metrics: dict) -> str:
+    """The Prometheus text exposition format of the aggregated metrics"""
+    lines = []
+    families = (
+        ('django_requests_total', 'counter', 'Requests by view', 'requests'),
+        ('django_request_db_queries_total', 'counter', 'SQL statements by view', 'queries'),
+        ('django_request_db_duration_seconds_total', 'counter', 'Time spent in SQL by view', 'db_duration'),
+        ('django_request_render_duration_seconds_total', 'counter', 'Time spent rendering responses by view',
+         'render_duration'),
+    )
+    for name, kind, description, counter in families:
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+        lines += [f'{name}{format_labels(view)} {totals[counter]:g}' for view, totals in sorted(metrics.items())]
+
+    name = 'django_request_duration_seconds'
+    lines += [f'# HELP {name} Request duration by view', f'# TYPE {name} histogram']
+    for view, totals in sorted(metrics.items()):
+        count = 0
+        for bound, bucket in zip(DURATION_BUCKETS + ('+Inf',), totals['buckets']):
+            count += bucket
+            lines.append(f'{name}_bucket{format_labels(view, le=bound)} {count}')
+        lines.append(f"{name}_sum{format_labels(view)} {totals['duration']:g}")
+        lines.append(f'{name}_count{format_labels(view)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    if not settings.REQUEST_METRICS:
+        raise Http404
+    return HttpResponse(render_metrics(get_metrics_store().collect()), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,27 @@
+import asyncio
+
+
+class AsyncCapableMiddleware:
+    """Base of the middlewares wrapping the whole request, `call` serves the sync chain, `acall` the async one.
+
+    Being both sync and async capable, the middleware doesn't make Django move async views to a thread
+    under ASGI, nor sync ones back to the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine  # Django awaits the instance then
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.acall(request)
+        return self.call(request)
+
+    def call(self, request):
+        raise NotImplementedError
+
+    async def acall(self, request):
+        raise NotImplementedError
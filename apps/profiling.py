@@ -0,0 +1,108 @@
+"""Opt-in request profiling.
+
+With `PROFILING` on, `RequestProfilingMiddleware` runs cProfile for a sampled fraction of the requests,
+for the views listed in `PROFILING_VIEWS` and for requests carrying the `PROFILING_TOKEN` in the
+`X-Profile` header. Every profile is a pstats file in `PROFILING_DIR` named after the request, the
+oldest files are removed beyond `PROFILING_MAX_FILES`. `python manage.py profile_report` aggregates them.
+"""
+import asyncio
+import cProfile
+import os
+import random
+import re
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+
+from apps.metrics import get_view_name
+from apps.middleware import AsyncCapableMiddleware
+
+PROFILE_SUFFIX = '.prof'
+
+
+def should_profile(request, view: str) -> bool:
+    token = request.META.get('HTTP_X_PROFILE')
+    if settings.PROFILING_TOKEN and token == settings.PROFILING_TOKEN:
+        return True
+    # a class name picks every action of the view, e.g. `DialogViewSet`
+    if view in settings.PROFILING_VIEWS or view.split('.')[0] in settings.PROFILING_VIEWS:
+        return True
+    return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def get_profile_name(request, view: str, status: int, duration: float) -> str:
+    """`<time>-<view>-<method>-<status>-<duration>ms-<id>.prof`, the report groups the profiles by view"""
+    view = re.sub(r'[^\w.]', '_', view)
+    return f"{timezone.now():%Y%m%d%H%M%S}-{view}-{request.method}-{status}-{duration * 1000:.0f}ms-" \
+           f"{uuid.uuid4().hex[:8]}{PROFILE_SUFFIX}"
+
+
+def parse_profile_name(name: str) -> dict:
+    parts = name[:-len(PROFILE_SUFFIX)].split('-')
+    return {'view': parts[1], 'method': parts[2], 'status': parts[3], 'duration_ms': int(parts[4][:-2])}
+
+
+def rotate(directory: str, keep: int) -> None:
+    """Removes the oldest profiles beyond `keep`, the names start with the time so they sort by age"""
+    names = sorted(name for name in os.listdir(directory) if name.endswith(PROFILE_SUFFIX))
+    for name in names[:max(len(names) - keep, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:  # removed by another worker
+            pass
+
+
+class RequestProfilingMiddleware(AsyncCapableMiddleware):
+    """Profiles the view and the rendering of the chosen requests.
+
+    cProfile sees a single thread, so under ASGI only sync views are profiled, in the thread Django runs them in.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+
+    def call(self, request):
+        request.profiler = None
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            if request.profiler is not None:
+                request.profiler.disable()
+        if request.profiler is not None:
+            self.save(request, response, time.perf_counter() - started)
+        return response
+
+    async def acall(self, request):
+        request.profiler = None
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            if request.profiler is not None:
+                # the profiler is enabled in the sync thread `process_view` runs in, it is disabled there too
+                await sync_to_async(request.profiler.disable, thread_sensitive=True)()
+        if request.profiler is not None:
+            await sync_to_async(self.save, thread_sensitive=False)(request, response, time.perf_counter() - started)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if asyncio.iscoroutinefunction(view_func):
+            return  # its work is spread over the event loop and worker threads
+        # the URL is resolved by now, so the view name can pick the request
+        if should_profile(request, get_view_name(request)):
+            request.profiler = cProfile.Profile()
+            request.profiler.enable()
+
+    @staticmethod
+    def save(request, response, duration: float) -> None:
+        name = get_profile_name(request, get_view_name(request), response.status_code, duration)
+        request.profiler.dump_stats(os.path.join(settings.PROFILING_DIR, name))
+        rotate(settings.PROFILING_DIR, settings.PROFILING_MAX_FILES)
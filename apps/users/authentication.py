@@ -0,0 +1,41 @@
+from django.utils.translation import ugettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from apps.users.cache import get_claims_state
+from apps.users.models import User
+from apps.users.revocation import get_revocation_list
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """Builds the user from the claims of the verified token instead of a `User` query per request.
+
+    The claims are trusted while their version matches the cached state of the user, a token with
+    outdated claims falls back to the database. The fields which aren't in the token are loaded
+    when a view touches them.
+    """
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if get_revocation_list().is_token_revoked(validated_token):
+            raise InvalidToken(_('Token is revoked'))
+        return validated_token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        if any(claim not in validated_token for claim in (*User.CLAIMS, User.CLAIMS_VERSION_CLAIM)):
+            return super().get_user(validated_token)  # issued before the claims were added
+
+        state = get_claims_state(user_id)
+        if state is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        claims_version, is_active = state
+        if not is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if validated_token[User.CLAIMS_VERSION_CLAIM] != claims_version:
+            return super().get_user(validated_token)
+        return User.from_claims(validated_token)
@@ -0,0 +1,70 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+PROFILE_CACHE_KEY = 'users:profile:{}'
+PROFILE_CACHE_TIMEOUT = 60 * 60
+CLAIMS_STATES_LIMIT = 100000  # entries of the per-process claims cache
+
+_claims_states = {}
+_claims_lock = threading.Lock()
+
+
+def get_profile_key(user_id) -> str:
+    return PROFILE_CACHE_KEY.format(user_id)
+
+
+def get_profiles(user_ids) -> dict:
+    """Serialized user profiles keyed by id.
+
+    The whole batch is read with one `get_many` (a single MGET on Redis), only the missed
+    profiles are loaded from the database and written back.
+    """
+    from apps.users.models import User
+    from apps.users.serializers import UserSerializer
+
+    keys = {get_profile_key(user_id): user_id for user_id in set(user_ids)}
+    if not keys:
+        return {}
+    profiles = {keys[key]: profile for key, profile in cache.get_many(list(keys)).items()}
+    missed = [user_id for user_id in keys.values() if user_id not in profiles]
+    if missed:
+        loaded = {user.pk: dict(UserSerializer(user).data) for user in User.objects.filter(pk__in=missed)}
+        cache.set_many({get_profile_key(user_id): profile for user_id, profile in loaded.items()},
+                       PROFILE_CACHE_TIMEOUT)
+        profiles.update(loaded)
+    return profiles
+
+
+def invalidate_profile(user_id) -> None:
+    cache.delete(get_profile_key(user_id))
+
+
+def get_claims_state(user_id):
+    """`(claims_version, is_active)` of the user or None for a missing user.
+
+    The state is kept in the process for `JWT_CLAIMS_CACHE_TTL` seconds, so verifying the claims of
+    a token takes a query per user and period instead of one per request.
+    """
+    now = time.monotonic()
+    with _claims_lock:
+        state = _claims_states.get(user_id)
+    if state is not None and state[0] > now:
+        return state[1]
+
+    from apps.users.models import User
+    current = User.objects.filter(pk=user_id).values_list('claims_version', 'is_active').first()
+    with _claims_lock:
+        if len(_claims_states) >= CLAIMS_STATES_LIMIT:
+            _claims_states.clear()
+        _claims_states[user_id] = (now + settings.JWT_CLAIMS_CACHE_TTL, current)
+    return current
+
+
+def invalidate_claims_state(user_id) -> None:
+    """Other processes notice the change when their cached state expires"""
+    with _claims_lock:
+        _claims_states.pop(user_id, None)
+
@@ -0,0 +1,26 @@
+# Generated by Django 3.1.3 on 2026-10-18 05:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_claims_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='phone_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True, verbose_name='Phone number hash'),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE users_user
+            SET phone_hash = encode(sha256(convert_to(phone_number, 'UTF8')), 'hex')
+            WHERE phone_number IS NOT NULL
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,18 +1,46 @@
+import hashlib
+
 from django.utils.translation import ugettext_lazy as _
 
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.models import PermissionsMixin
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models
 from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from apps.mixins import NULLABLE
 
 
+def get_phone_hash(phone_number: str) -> str:
+    """SHA-256 of the normalized number, the apps upload address books hashed this way"""
+    return hashlib.sha256(phone_number.encode('utf-8')).hexdigest()
+
+
 class UserManager(BaseUserManager):
+    # one indexed lookup per array element, the column is `phone_number` or `phone_hash`
+    DISCOVER_SQL = """
+        SELECT id, phone_number, phone_hash, first_name, last_name
+        FROM users_user
+        WHERE {column} = ANY(%(values)s) AND is_active AND id <> %(user_id)s
+    """
+    DISCOVER_CHUNK_SIZE = 5000
+
     def get_queryset(self):
         return super().get_queryset()
 
+    def discover(self, user_id: int, column: str, values) -> list:
+        """Active users other than `user_id` whose `phone_number` or `phone_hash` is among the values"""
+        if column not in ('phone_number', 'phone_hash'):
+            raise ValueError(f"Users can't be discovered by {column}")
+        values = list(dict.fromkeys(values))
+        users = []
+        for i in range(0, len(values), self.DISCOVER_CHUNK_SIZE):
+            users.extend(self.raw(self.DISCOVER_SQL.format(column=column), {
+                'values': values[i:i + self.DISCOVER_CHUNK_SIZE], 'user_id': user_id,
+            }))
+        return users
+
     def create_user(self, phone_number, password=None, username=None):
         if not phone_number:
             raise ValueError("User must have a phone_number")
@@ -31,7 +59,11 @@ class UserManager(BaseUserManager):
 
 
 class User(PermissionsMixin, AbstractBaseUser):
+    CLAIMS = ('phone_number', 'first_name', 'last_name', 'is_active', 'is_admin')  # copied into the tokens
+    CLAIMS_VERSION_CLAIM = 'claims_version'
+
     phone_number = models.CharField(_('Phone number'), max_length=16, unique=True, **NULLABLE)
+    phone_hash = models.CharField(_('Phone number hash'), max_length=64, unique=True, editable=False, **NULLABLE)
     password = models.CharField(_('Password'), max_length=128)
 
     first_name = models.CharField(_('First name'), max_length=128, **NULLABLE)
@@ -40,6 +72,8 @@ class User(PermissionsMixin, AbstractBaseUser):
 
     is_active = models.BooleanField(_('Active'), default=True)
     is_admin = models.BooleanField(_('Admin'), default=False)
+    # grows when a field of `CLAIMS` changes, the tokens issued before carry outdated claims
+    claims_version = models.PositiveIntegerField(_('Claims version'), default=0)
 
     objects = UserManager()
 
@@ -48,6 +82,35 @@ class User(PermissionsMixin, AbstractBaseUser):
     def __str__(self):
         return f"{self.get_full_name() or 'noname'} ({self.phone_number})"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if 'phone_number' not in self.get_deferred_fields():
+            self.phone_hash = get_phone_hash(self.phone_number) if self.phone_number else None
+            if update_fields is not None and 'phone_number' in update_fields:
+                kwargs['update_fields'] = update_fields = {*update_fields, 'phone_hash'}
+        if not self._state.adding and self.claims_changed(update_fields):
+            self.claims_version += 1
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'claims_version'}
+        return super().save(*args, **kwargs)
+
+    def claims_changed(self, update_fields=None) -> bool:
+        fields = [name for name in self.CLAIMS
+                  if (update_fields is None or name in update_fields) and name not in self.get_deferred_fields()]
+        if not fields:
+            return False
+        stored = type(self).objects.filter(pk=self.pk).values(*fields).first()
+        return stored is not None and any(stored[name] != getattr(self, name) for name in fields)
+
+    @classmethod
+    def from_claims(cls, claims) -> 'User':
+        """The user of a verified token built without a query, the fields missing in the claims are deferred
+        and loaded on the first access"""
+        values = dict({name: claims[name] for name in cls.CLAIMS},
+                      id=claims[api_settings.USER_ID_CLAIM], claims_version=claims[cls.CLAIMS_VERSION_CLAIM])
+        fields = [field.attname for field in cls._meta.concrete_fields if field.attname in values]
+        return cls.from_db(DEFAULT_DB_ALIAS, fields, [values[name] for name in fields])
+
     def get_full_name(self) -> str:
         return f"{self.first_name or ''} {self.last_name or ''}"
 
@@ -71,6 +134,9 @@ class User(PermissionsMixin, AbstractBaseUser):
         token['phone_number'] = self.phone_number
         token['first_name'] = self.first_name
         token['last_name'] = self.last_name
+        token['is_active'] = self.is_active
+        token['is_admin'] = self.is_admin
+        token[self.CLAIMS_VERSION_CLAIM] = self.claims_version
         return token
 
     def make_token(self):
@@ -0,0 +1,166 @@
+"""Revoked JWTs.
+
+Tokens are revoked by their `jti` until they expire. Almost every checked token isn't revoked, so the
+Redis list keeps a Bloom filter of the revoked ids in every process: a miss clears the token without a
+network hop, only the rare hits are confirmed in Redis. The filter is rebuilt from Redis every
+`JWT_REVOCATION_SYNC_INTERVAL` seconds, a token revoked in another process is rejected after the next sync.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.settings import api_settings
+
+
+class BloomFilter:
+    """A set which answers `in` with no false negatives and `error_rate` false positives"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def get_positions(self, item: str):
+        # two halves of one digest give all the positions (Kirsch-Mitzenmacher)
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        a, b = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((a + i * b) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self.get_positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.get_positions(item))
+
+
+class BaseRevocationList:
+    def revoke(self, jti: str, expires_at: int) -> None:
+        """Revokes the token until `expires_at`, a unix timestamp as in the `exp` claim"""
+        raise NotImplementedError
+
+    def is_revoked(self, jti: str) -> bool:
+        raise NotImplementedError
+
+    def revoke_token(self, token) -> None:
+        self.revoke(token[api_settings.JTI_CLAIM], token['exp'])
+
+    def is_token_revoked(self, token) -> bool:
+        return self.is_revoked(token[api_settings.JTI_CLAIM])
+
+
+class InMemoryRevocationList(BaseRevocationList):
+    """Revocations of the current process, it is used by tests and single-node setups"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}
+
+    def revoke(self, jti: str, expires_at: int) -> None:
+        with self._lock:
+            now = time.time()
+            self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+            self._revoked[jti] = expires_at
+
+    def is_revoked(self, jti: str) -> bool:
+        with self._lock:
+            return self._revoked.get(jti, 0) > time.time()
+
+
+class SyncedBloomFilter:
+    """A Bloom filter of the revoked ids which is rebuilt from `load` every `sync_interval` seconds.
+
+    One thread rebuilds it at a time, the others keep using the previous filter meanwhile. Ids added during
+    a rebuild are merged into the new filter, `load` may have read the list before they were revoked.
+    """
+
+    def __init__(self, load, sync_interval: float):
+        self.load = load
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._filter = None
+        self._synced_at = 0.0
+        self._added = None  # the ids added since the running rebuild started
+
+    def add(self, jti: str) -> None:
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+            if self._added is not None:
+                self._added.append(jti)
+
+    def get(self) -> BloomFilter:
+        with self._lock:
+            bloom = self._filter
+            if bloom is not None and time.monotonic() - self._synced_at < self.sync_interval:
+                return bloom
+        # only the first build is waited for, later ones are left to the thread which started them
+        if not self._rebuild_lock.acquire(blocking=bloom is None):
+            return bloom
+        try:
+            with self._lock:
+                if self._filter is not None and time.monotonic() - self._synced_at < self.sync_interval:
+                    return self._filter  # rebuilt while this thread waited for the lock
+                self._added = []
+            try:
+                revoked = list(self.load())
+            except Exception:
+                with self._lock:
+                    self._added = None
+                raise
+            bloom = BloomFilter(capacity=max(len(revoked) * 2, 1024))
+            for jti in revoked:
+                bloom.add(jti)
+            with self._lock:
+                for jti in self._added:
+                    bloom.add(jti)
+                self._filter, self._synced_at, self._added = bloom, time.monotonic(), None
+            return bloom
+        finally:
+            self._rebuild_lock.release()
+
+
+class RedisRevocationList(BaseRevocationList):
+    """A key with the token lifetime per revoked id and a sorted set of the ids by expiry to build the filters"""
+    key_prefix = 'auth:revoked:'
+    index_key = 'auth:revoked'
+
+    def __init__(self, url: str = None, sync_interval: float = None):
+        import redis
+        self.redis = redis.Redis.from_url(url or settings.REDIS_URL)
+        sync_interval = settings.JWT_REVOCATION_SYNC_INTERVAL if sync_interval is None else sync_interval
+        self.filter = SyncedBloomFilter(self.load_revoked, sync_interval)
+
+    def revoke(self, jti: str, expires_at: int) -> None:
+        now = time.time()
+        if expires_at <= now:
+            return
+        pipe = self.redis.pipeline()
+        pipe.set(f'{self.key_prefix}{jti}', 1, ex=math.ceil(expires_at - now))
+        pipe.zadd(self.index_key, {jti: expires_at})
+        pipe.zremrangebyscore(self.index_key, '-inf', now)
+        pipe.execute()
+        self.filter.add(jti)
+
+    def is_revoked(self, jti: str) -> bool:
+        if jti not in self.filter.get():
+            return False
+        return bool(self.redis.exists(f'{self.key_prefix}{jti}'))
+
+    def load_revoked(self):
+        return (jti.decode() for jti in self.redis.zrangebyscore(self.index_key, time.time(), '+inf'))
+
+
+_revocation_list = None
+
+
+def get_revocation_list() -> BaseRevocationList:
+    global _revocation_list
+    if _revocation_list is None:
+        _revocation_list = import_string(settings.JWT_REVOCATION_LIST)()
+    return _revocation_list
@@ -1,7 +1,15 @@
+import re
+
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth import authenticate, get_user_model
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer, \
+    TokenVerifySerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken, UntypedToken
+
+from apps.users.revocation import get_revocation_list
 
 
 class CustomAuthTokenSerializer(serializers.Serializer):
@@ -31,6 +39,39 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         return user.make_token()
 
 
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        revocation_list = get_revocation_list()
+        if revocation_list.is_token_revoked(refresh):
+            raise TokenError(_('Token is revoked'))
+        data = super().validate(attrs)
+        if api_settings.ROTATE_REFRESH_TOKENS:  # the rotated token replaces the old one
+            revocation_list.revoke_token(refresh)
+        return data
+
+
+class CustomTokenVerifySerializer(TokenVerifySerializer):
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        if get_revocation_list().is_token_revoked(UntypedToken(attrs['token'])):
+            raise TokenError(_('Token is revoked'))
+        return data
+
+
+class SignoutSerializer(serializers.Serializer):
+    refresh = serializers.CharField(required=False)
+
+    def validate_refresh(self, value):
+        try:
+            token = RefreshToken(value)
+        except TokenError as e:
+            raise serializers.ValidationError(e.args[0])
+        if token.get(api_settings.USER_ID_CLAIM) != self.context['request'].user.pk:
+            raise serializers.ValidationError(_('Token belongs to another user'))
+        return token
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = get_user_model()
@@ -62,3 +103,37 @@ class SignupUserSerializer(UserSerializer):
             'phone_number': {'required': True, 'allow_null': False},
             'password': {'required': True, 'allow_null': False},
         }
+
+
+class ContactDiscoverySerializer(serializers.Serializer):
+    """An address book as E.164 numbers or as SHA-256 hashes of them"""
+    MAX_CONTACTS = 10000
+    FORMATTING_RE = re.compile(r'[\s().-]')
+    PHONE_NUMBER_RE = re.compile(r'^\+\d{6,15}$')
+    PHONE_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+    phone_numbers = serializers.ListField(child=serializers.CharField(max_length=32), max_length=MAX_CONTACTS,
+                                          required=False)
+    phone_hashes = serializers.ListField(child=serializers.CharField(max_length=64), max_length=MAX_CONTACTS,
+                                         required=False)
+
+    def validate_phone_numbers(self, value):
+        # the formatting of address books is dropped, numbers which still aren't E.164 can't match anyone
+        numbers = (self.FORMATTING_RE.sub('', number) for number in value)
+        return [number for number in numbers if self.PHONE_NUMBER_RE.match(number)]
+
+    def validate_phone_hashes(self, value):
+        return [phone_hash for phone_hash in map(str.lower, value) if self.PHONE_HASH_RE.match(phone_hash)]
+
+    def validate(self, attrs):
+        if 'phone_numbers' not in attrs and 'phone_hashes' not in attrs:
+            raise serializers.ValidationError(_('Either phone_numbers or phone_hashes is required'))
+        if len(attrs.get('phone_numbers', [])) + len(attrs.get('phone_hashes', [])) > self.MAX_CONTACTS:
+            raise serializers.ValidationError(_('At most %d contacts are resolved at once') % self.MAX_CONTACTS)
+        return attrs
+
+
+class ContactSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = get_user_model()
+        fields = ('id', 'first_name', 'last_name')
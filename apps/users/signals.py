@@ -0,0 +1,31 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.users.cache import invalidate_claims_state, invalidate_profile
+from apps.users.models import User
+from apps.users.serializers import UserSerializer
+
+
+@receiver(post_save, sender=User)
+def invalidate_profile_on_save(sender, instance, update_fields=None, **kwargs):
+    # e.g. `last_login` updates on every sign in must not drop the cached profile
+    if update_fields and not set(update_fields) & set(UserSerializer.Meta.fields):
+        return
+    invalidate_profile(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_profile_on_delete(sender, instance, **kwargs):
+    invalidate_profile(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def invalidate_claims_state_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not set(update_fields) & {*User.CLAIMS, 'claims_version'}:
+        return
+    invalidate_claims_state(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_claims_state_on_delete(sender, instance, **kwargs):
+    invalidate_claims_state(instance.pk)
@@ -0,0 +1,48 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase, APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.users.models import User
+from apps.users.tests.factories import UserFactory
+
+
+class TestStatelessJWTAuthentication(APITestCase):
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.user.get_tokens()['access']}")
+
+    def get_user_queries(self) -> list:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dialogs-unread'))
+        assert response.status_code == 200
+        return [query['sql'] for query in queries if '"users_user"' in query['sql']]
+
+    def test_user_from_claims(self):
+        assert len(self.get_user_queries()) == 1  # the claims version, it is cached afterwards
+        assert self.get_user_queries() == []
+
+    def test_stale_claims(self):
+        self.user.first_name = 'Changed'
+        self.user.save()
+        assert self.user.claims_version == 1
+        assert len(self.get_user_queries()) == 2  # the claims version and the whole user
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        assert self.user.claims_version == 1
+
+    def test_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        assert self.client.get(reverse('dialogs-unread')).status_code == 401
+
+    def test_deferred_fields(self):
+        user = User.from_claims(AccessToken(self.user.get_tokens()['access']))
+        assert user.phone_number == self.user.phone_number
+        assert 'password' in user.get_deferred_fields()
+        with CaptureQueriesContext(connection) as queries:
+            assert user.check_password('password')
+        assert len(queries) == 1
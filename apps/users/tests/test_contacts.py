@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase, APIClient
+
+from apps.users.models import User, get_phone_hash
+from apps.users.tests.factories import UserFactory
+
+
+class TestContactDiscovery(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()  # the throttle history
+        self.user = UserFactory(phone_number='+380501000000')
+        self.friends = [UserFactory(phone_number=f'+38050100000{i}') for i in range(1, 4)]
+        UserFactory(phone_number='+380501000009', is_active=False)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def discover(self, data):
+        return self.client.post(reverse('contacts-discover'), data, format='json')
+
+    def test_discover_by_phone_numbers(self):
+        numbers = ['+38 (050) 100-00-01', '+380501000002', '+380501000002', '+380501000000', '+380501000009',
+                   '+380999999999', 'not a number']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.discover({'phone_numbers': numbers})
+        assert response.status_code == 200
+        assert len(queries) == 1
+        assert sorted(contact['phone_number'] for contact in response.data['results']) == [
+            '+380501000001', '+380501000002',
+        ]
+        contact = next(c for c in response.data['results'] if c['id'] == self.friends[0].pk)
+        assert set(contact) == {'id', 'first_name', 'last_name', 'phone_number'}
+
+    def test_discover_by_phone_hashes(self):
+        hashes = [get_phone_hash(friend.phone_number).upper() for friend in self.friends] + ['0' * 64]
+        response = self.discover({'phone_hashes': hashes})
+        assert response.status_code == 200
+        assert {contact['id'] for contact in response.data['results']} == {friend.pk for friend in self.friends}
+        assert response.data['results'][0]['phone_hash'] in map(str.lower, hashes)
+
+    def test_phone_hash_follows_phone_number(self):
+        friend = self.friends[0]
+        friend.phone_number = '+380507777777'
+        friend.save(update_fields=['phone_number'])
+        assert User.objects.get(pk=friend.pk).phone_hash == get_phone_hash('+380507777777')
+
+    def test_validation(self):
+        assert self.discover({}).status_code == 400
+        response = self.discover({'phone_numbers': ['+380501000001'] * 10001})
+        assert response.status_code == 400
+        assert 'phone_numbers' in response.data  # rejected before the numbers are normalized
+        with self.assertRaises(ValueError):
+            User.objects.discover(self.user.pk, 'password', ['secret'])
+
+    def test_throttling(self):
+        rates = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={'contacts': '2/hour'})
+        with override_settings(REST_FRAMEWORK=rates):
+            assert [self.discover({'phone_numbers': []}).status_code for _ in range(3)] == [200, 200, 429]
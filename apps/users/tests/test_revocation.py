@@ -0,0 +1,94 @@
+import threading
+import uuid
+
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase, APIClient
+
+from apps.users.revocation import BloomFilter, SyncedBloomFilter
+from apps.users.tests.factories import UserFactory
+
+
+class TestTokenRevocation(APITestCase):
+    def setUp(self) -> None:
+        self.user = UserFactory()
+        self.tokens = self.user.get_tokens()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+
+    def test_signout(self):
+        assert self.client.get(reverse('dialogs-unread')).status_code == 200
+        response = self.client.post(reverse('auth-signout'), {'refresh': self.tokens['refresh']}, format='json')
+        assert response.status_code == 200
+        assert self.client.get(reverse('dialogs-unread')).status_code == 401
+
+        client = APIClient()
+        response = client.post(reverse('token_refresh'), {'refresh': self.tokens['refresh']}, format='json')
+        assert response.status_code == 401
+        response = client.post(reverse('token_verification'), {'token': self.tokens['access']}, format='json')
+        assert response.status_code == 401
+
+    def test_signout_keeps_other_sessions(self):
+        other = self.user.get_tokens()
+        self.client.post(reverse('auth-signout'), format='json')
+        client = APIClient()
+        response = client.post(reverse('token_refresh'), {'refresh': other['refresh']}, format='json')
+        assert response.status_code == 200
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        assert client.get(reverse('dialogs-unread')).status_code == 200
+
+    def test_signout_with_foreign_refresh(self):
+        refresh = UserFactory().get_tokens()['refresh']
+        response = self.client.post(reverse('auth-signout'), {'refresh': refresh}, format='json')
+        assert response.status_code == 400
+        assert self.client.get(reverse('dialogs-unread')).status_code == 200
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        added = [uuid.uuid4().hex for _ in range(1000)]
+        for jti in added:
+            bloom.add(jti)
+        assert all(jti in bloom for jti in added)
+        false_positives = sum(uuid.uuid4().hex in bloom for _ in range(10000))
+        assert false_positives < 300
+
+    def test_revoke_during_filter_rebuild(self):
+        loading, resume = threading.Event(), threading.Event()
+        revoked = ['old']
+
+        def load():
+            listed = list(revoked)  # read before the concurrent revoke reaches the list
+            loading.set()
+            resume.wait(5)
+            return listed
+
+        synced = SyncedBloomFilter(load, sync_interval=0)
+        rebuild = threading.Thread(target=synced.get)
+        rebuild.start()
+        assert loading.wait(5)
+        revoked.append('new')
+        synced.add('new')
+        resume.set()
+        rebuild.join(5)
+        bloom = synced._filter
+        assert 'old' in bloom and 'new' in bloom
+
+    def test_stale_filter_is_rebuilt_once(self):
+        loads, loading, resume = [], threading.Event(), threading.Event()
+
+        def load():
+            loads.append(1)
+            if len(loads) > 1:
+                loading.set()
+                resume.wait(5)
+            return ['old']
+
+        synced = SyncedBloomFilter(load, sync_interval=0)
+        stale = synced.get()
+        rebuild = threading.Thread(target=synced.get)
+        rebuild.start()
+        assert loading.wait(5)
+        # the other threads keep the stale filter instead of loading the list again
+        assert [synced.get() for _ in range(3)] == [stale] * 3
+        resume.set()
+        rebuild.join(5)
+        assert len(loads) == 2 and synced._filter is not stale
@@ -0,0 +1,11 @@
+from rest_framework.settings import api_settings
+from rest_framework.throttling import UserRateThrottle
+
+
+class ContactsDiscoveryThrottle(UserRateThrottle):
+    """A phone number resolves to a name, the discovery is throttled so the users can't be enumerated"""
+    scope = 'contacts'
+
+    def get_rate(self):
+        # the rates are read per request instead of once on import, so overridden settings apply
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
@@ -1,17 +1,18 @@
 from django.urls import path
 from rest_framework import routers
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenVerifyView
+from rest_framework_simplejwt.views import TokenObtainPairView
 from . import views
 
 
 urlpatterns = [
     path('auth/signin/', views.CustomTokenObtainPairView.as_view(), name='signin'),
     path('auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-    path('auth/token/verification/', TokenVerifyView.as_view(), name='token_verification'),
+    path('auth/token/refresh/', views.CustomTokenRefreshView.as_view(), name='token_refresh'),
+    path('auth/token/verification/', views.CustomTokenVerifyView.as_view(), name='token_verification'),
 ]
 
 router = routers.DefaultRouter()
 router.register('auth', views.AuthViewSet, basename='auth')
+router.register('contacts', views.ContactsViewSet, basename='contacts')
 
 urlpatterns += router.urls
@@ -1,17 +1,19 @@
 from django.contrib.auth import get_user_model
 from rest_framework import mixins, viewsets, status
-from rest_framework.authtoken.models import Token
 from rest_framework.decorators import action
-from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenVerifyView
 
 from apps.mixins import SerializersMixin
+from apps.utils import FastJSONParser
 from . import serializers
 from rest_framework.authtoken.views import ObtainAuthToken
 
-from .serializers import CustomTokenObtainPairSerializer
+from .revocation import get_revocation_list
+from .throttling import ContactsDiscoveryThrottle
+from .serializers import CustomTokenObtainPairSerializer, CustomTokenRefreshSerializer, CustomTokenVerifySerializer
 
 User = get_user_model()
 
@@ -23,6 +25,15 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
 
+class CustomTokenRefreshView(TokenRefreshView):
+    """Revoked refresh tokens don't get new access tokens"""
+    serializer_class = CustomTokenRefreshSerializer
+
+
+class CustomTokenVerifyView(TokenVerifyView):
+    serializer_class = CustomTokenVerifySerializer
+
+
 class AuthViewSet(SerializersMixin,
                   mixins.ListModelMixin,
                   viewsets.GenericViewSet):
@@ -50,7 +61,14 @@ class AuthViewSet(SerializersMixin,
 
     @action(methods=['get', 'post'], detail=False, permission_classes=(IsAuthenticated,))
     def signout(self, request, *args, **kwargs):
-        Token.objects.get(user=request.user).delete()
+        """Revokes the access token of the request and the refresh token sent as `refresh`"""
+        serializer = serializers.SignoutSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        revocation_list = get_revocation_list()
+        if request.auth is not None:
+            revocation_list.revoke_token(request.auth)
+        if serializer.validated_data.get('refresh'):
+            revocation_list.revoke_token(serializer.validated_data['refresh'])
         return Response()
 
 
@@ -65,7 +83,7 @@ class UsersViewSet(SerializersMixin,
         "default": serializers.UserSerializer,
         "me": serializers.UserSerializer,
     }
-    parser_classes = (MultiPartParser, FormParser, JSONParser,)
+    parser_classes = (MultiPartParser, FormParser, FastJSONParser,)
 
     def get_queryset(self):
         return super().get_queryset().filter(pk=self.request.user.pk)
@@ -74,3 +92,25 @@ class UsersViewSet(SerializersMixin,
     def me(self, request, *args, **kwargs):
         serializer = self.get_serializer(instance=request.user)
         return Response(serializer.data)
+
+
+class ContactsViewSet(viewsets.GenericViewSet):
+    """Finds the users of an address book"""
+    permission_classes = (IsAuthenticated,)
+    parser_classes = (FastJSONParser,)
+    throttle_classes = (ContactsDiscoveryThrottle,)
+
+    @action(methods=['post'], detail=False)
+    def discover(self, request, *args, **kwargs):
+        """Resolves up to `MAX_CONTACTS` numbers or hashes with a few indexed `= ANY(array)` queries"""
+        serializer = serializers.ContactDiscoverySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = []
+        for key, field in (('phone_number', 'phone_numbers'), ('phone_hash', 'phone_hashes')):
+            values = serializer.validated_data.get(field)
+            if values:
+                # a single list serializer, binding the fields per user costs more than the query
+                users = User.objects.discover(request.user.pk, key, values)
+                stubs = serializers.ContactSerializer(users, many=True).data
+                results.extend(dict(stub, **{key: getattr(user, key)}) for stub, user in zip(stubs, users))
+        return Response({'results': results})
@@ -1,10 +1,58 @@
-from rest_framework.renderers import JSONRenderer
+import io
 
+from rest_framework import renderers
+from rest_framework.parsers import JSONParser
+from rest_framework.utils.encoders import JSONEncoder
 
-class UTF8CharsetJSONRenderer(JSONRenderer):
+try:
+    import orjson
+except ImportError:  # the stdlib `json` of the parent classes is used
+    orjson = None
+
+
+class UTF8CharsetJSONRenderer(renderers.JSONRenderer):
     charset = 'utf-8'
 
 
+class FastJSONRenderer(UTF8CharsetJSONRenderer):
+    """Renders with orjson, the output is the same as the one of the parent class.
+
+    Datetimes and UUIDs are encoded natively, the other types DRF knows, e.g. decimals and lazy
+    translations, go through DRF's encoder. U+2028 and U+2029 are escaped as DRF does. Indented output
+    and values orjson can't encode, like integers over 64 bits, are rendered by the parent class. The one
+    difference: NaN and Infinity become `null` where the strict parent raises.
+    """
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z if orjson else 0
+    default = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data, default=self.default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # the line separators are valid JSON, but not valid JavaScript string literals
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    """Parses with orjson, which rejects NaN and Infinity like the strict stdlib parser.
+
+    Bodies orjson can't parse are retried with the stdlib, so the errors and big integers stay the same.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        if orjson is None or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+
+
 def get_lorem_ipsum(length=0):
     text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat. Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur. Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit anim id est laborum."
     if length:
@@ -0,0 +1,21 @@
+"""
+ASGI config for the dialogs project.
+
+HTTP requests are served by Django, websocket connections by the chats realtime application.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
+
+django_application = get_asgi_application()
+
+from apps.chats.consumers import websocket_application  # noqa: E402  the apps must be loaded first
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -27,6 +27,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.metrics.RequestMetricsMiddleware',
+    'apps.profiling.RequestProfilingMiddleware',
+    'apps.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,6 +58,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
 
 DB_HOST = os.environ.get('POSTGRES_HOST')
 DB_PORT = os.environ.get('POSTGRES_PORT')
@@ -66,6 +70,24 @@ DATABASES = {
     'default': dj_database_url.config(default=DB_URL)
 }
 
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -97,17 +119,89 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # REST
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apps.users.authentication.StatelessJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAdminUser'
     ),
     'DEFAULT_RENDERER_CLASSES': (
-        'apps.utils.UTF8CharsetJSONRenderer',
+        'apps.utils.FastJSONRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'apps.utils.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ),
+    'DEFAULT_THROTTLE_RATES': {
+        'contacts': os.environ.get('CONTACTS_DISCOVERY_RATE', '30/hour'),
+    },
 }
+
+# Users are built from the token claims, their version is rechecked in the database this often per process
+JWT_CLAIMS_CACHE_TTL = float(os.environ.get('JWT_CLAIMS_CACHE_TTL', 30))
+# Signed out tokens are revoked until they expire
+JWT_REVOCATION_LIST = os.environ.get(
+    'JWT_REVOCATION_LIST',
+    'apps.users.revocation.RedisRevocationList' if REDIS_URL else 'apps.users.revocation.InMemoryRevocationList',
+)
+JWT_REVOCATION_SYNC_INTERVAL = float(os.environ.get('JWT_REVOCATION_SYNC_INTERVAL', 10))
+
+# Realtime
+CHAT_BROKER = os.environ.get(
+    'CHAT_BROKER',
+    'apps.chats.broker.RedisBroker' if REDIS_URL else 'apps.chats.broker.InMemoryBroker',
+)
+
+# Message archive, any Django storage which takes `location` works, e.g. S3 from django-storages
+CHAT_ARCHIVE_STORAGE = os.environ.get('CHAT_ARCHIVE_STORAGE', 'django.core.files.storage.FileSystemStorage')
+CHAT_ARCHIVE_LOCATION = os.environ.get('CHAT_ARCHIVE_LOCATION', os.path.join(BASE_DIR, 'archive'))
+
+# Read receipts are buffered and written to the database in batches
+CHAT_READ_BUFFER = os.environ.get(
+    'CHAT_READ_BUFFER',
+    'apps.chats.receipts.RedisReadBuffer' if REDIS_URL else 'apps.chats.receipts.InMemoryReadBuffer',
+)
+CHAT_READ_FLUSH_INTERVAL = float(os.environ.get('CHAT_READ_FLUSH_INTERVAL', 5))
+
+# Background tasks, without a broker they run inline in the calling process
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', REDIS_URL or 'memory://')
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', '0' if REDIS_URL else '1') == '1'
+CELERY_TASK_EAGER_PROPAGATES = True
+CELERY_TASK_ACKS_LATE = True  # the tasks are idempotent, a task of a crashed worker is run again
+CELERY_BEAT_SCHEDULE = {
+    'create-message-partitions': {
+        'task': 'apps.chats.tasks.create_message_partitions',
+        'schedule': 24 * 60 * 60,
+    },
+    'flush-read-receipts': {
+        'task': 'apps.chats.tasks.flush_read_receipts',
+        'schedule': CHAT_READ_FLUSH_INTERVAL,
+    },
+}
+
+# Request instrumentation, the middleware removes itself at startup when both are off
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'  # exposes SQL fingerprints, keep it internal
+REQUEST_METRICS = os.environ.get('REQUEST_METRICS', '0') == '1'  # served at /metrics
+REQUEST_METRICS_STORE = os.environ.get(
+    'REQUEST_METRICS_STORE',
+    'apps.metrics.RedisMetricsStore' if REDIS_URL else 'apps.metrics.InMemoryMetricsStore',
+)
+
+# Request profiling, the profiles of the sampled requests are aggregated by `profile_report`
+PROFILING = os.environ.get('PROFILING', '0') == '1'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0.01))
+PROFILING_VIEWS = [view for view in os.environ.get('PROFILING_VIEWS', '').split(',') if view]  # always profiled
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')  # an `X-Profile` header with it profiles the request
+PROFILING_DIR = os.environ.get('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILING_MAX_FILES = int(os.environ.get('PROFILING_MAX_FILES', 500))
+
+# Responses are compressed with brotli or gzip, whichever the client accepts, once they are this large
+COMPRESSION = os.environ.get('COMPRESSION', '1') == '1'
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+
+TEST_RUNNER = 'config.test_runner.TestRunner'
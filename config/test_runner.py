@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+from config.celery import app
+
+
+class TestRunner(DiscoverRunner):
+    """Runs background work inline: Celery tasks are eager and buffered read receipts are written through"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        app.conf.task_always_eager = True
+        app.conf.task_eager_propagates = True
+        settings.CHAT_READ_FLUSH_INTERVAL = 0
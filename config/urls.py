@@ -3,6 +3,8 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from apps.metrics import metrics_view
+
 
 urlpatterns = [
 
@@ -10,6 +12,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('apps.users.urls')),
     path('api/v1/', include('apps.chats.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 urlpatterns += [